@@ -0,0 +1,229 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import posixpath
+import re
+
+import flask_bootstrap
+from flask import request, send_file, url_for
+from werkzeug.exceptions import NotFound
+from werkzeug.security import safe_join
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+MANIFEST = 'manifest.json'
+# suffix of each precompressed variant, most preferred first
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+COMPRESSIBLE = ('.css', '.js', '.map', '.svg', '.eot', '.ttf', '.json', '.txt')
+# relative url(...) references in stylesheets, such as bootstrap's to its fonts
+CSS_URL = re.compile(r'''url\(\s*(['"]?)(?![a-z]+:|/|#)([^'")?#]+)([^'")]*)\1\s*\)''')
+# /*# sourceMappingURL=... */ in stylesheets and //# sourceMappingURL=... in scripts
+SOURCE_MAP = re.compile(r'(?://|/\*)[#@]\s*sourceMappingURL=([^\s*]+)(?:[ \t]*\*/)?')
+# built before the files that refer to them: source maps and fonts, then scripts, then stylesheets
+BUILD_ORDER = ('.js', '.css')
+
+
+def fingerprint(name, data):
+    """name with the start of the sha256 of data before its extension, styles.3a7bd3e2360a.css"""
+    root, ext = posixpath.splitext(name)
+    return '{}.{}{}'.format(root, hashlib.sha256(data).hexdigest()[:12], ext)
+
+
+class Assets(object):
+    """
+    Serves the stylesheets, scripts and fonts of the site at ASSETS_URL_PATH under names
+    that include a hash of their content, with a Cache-Control that lets browsers and
+    proxies keep them for ASSETS_MAX_AGE without ever asking again. A changed file gets a
+    new name, and pages link to it through asset_url.
+
+    The sources are app/static and the bootstrap and jquery files bundled with
+    Flask-Bootstrap, under vendor/bootstrap/. `flask assets build` writes each of them
+    to ASSETS_BUILD_DIR under its fingerprinted name, along with .gz and .br copies, and a
+    manifest mapping the source names to the built ones. brotli is in requirements.txt;
+    a build without it installed writes only the .gz copies. Requests are answered with
+    the smallest copy their Accept-Encoding allows, so nothing is compressed while
+    serving. Older builds are left in place, pages cached before a deploy keep working.
+
+    Without a build, as in development, asset_url links to the sources, which are served
+    as they are and revalidated like any static file.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        # source name: built name
+        self.manifest = {}
+        # source name: path, found once rather than on every request for a source
+        self.sources = {}
+        # built name: encodings it has a precompressed copy for
+        self._encodings = {}
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        if not app.config.get('ASSETS_BUILD_DIR'):
+            app.config['ASSETS_BUILD_DIR'] = os.path.join(os.path.dirname(app.root_path), 'build', 'assets')
+        app.config.setdefault('ASSETS_URL_PATH', '/assets')
+        app.config.setdefault('ASSETS_MAX_AGE', 365 * 24 * 60 * 60)
+        # smaller files gain nothing from compression worth the extra copies
+        app.config.setdefault('ASSETS_MIN_COMPRESS_SIZE', 512)
+        self.app = app
+        self.manifest = self._read_manifest()
+        self.sources = self._find_sources()
+        self._encodings = {}
+
+        app.add_url_rule(app.config['ASSETS_URL_PATH'] + '/<path:filename>', 'assets', self.serve)
+        app.jinja_env.globals['asset_url'] = self.url
+
+    def url(self, name):
+        """URL of the source file called name, such as 'styles.css' or 'vendor/bootstrap/js/bootstrap.min.js'"""
+        return url_for('assets', filename=self.manifest.get(name, name))
+
+    def _find_sources(self):
+        roots = [
+            ('', os.path.join(self.app.root_path, 'static')),
+            ('vendor/bootstrap', os.path.join(os.path.dirname(flask_bootstrap.__file__), 'static')),
+        ]
+        sources = {}
+        for prefix, root in roots:
+            for directory, _, files in os.walk(root):
+                for filename in files:
+                    path = os.path.join(directory, filename)
+                    name = os.path.relpath(path, root).replace(os.sep, '/')
+                    sources[posixpath.join(prefix, name) if prefix else name] = path
+        return sources
+
+    def build(self):
+        """
+        Writes every source, and its compressed copies, to ASSETS_BUILD_DIR and replaces
+        the manifest
+
+        :return: list of (source name, built name, bytes, {encoding: compressed bytes})
+        """
+        out = self.app.config['ASSETS_BUILD_DIR']
+        self.sources = sources = self._find_sources()
+        manifest = {}
+        built = []
+        # the files a source refers to first, so that they already have their built names
+        for name in sorted(sources, key=lambda name: (self._build_rank(name), name)):
+            with open(sources[name], 'rb') as f:
+                data = f.read()
+            if self._build_rank(name):
+                data = self._rewrite(name, data, manifest)
+
+            manifest[name] = built_name = fingerprint(name, data)
+            path = os.path.join(out, *built_name.split('/'))
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                self._write(path, data)
+            built.append((name, built_name, len(data), self._compress(path, data)))
+
+        self._write(os.path.join(out, MANIFEST), json.dumps(manifest, indent=2, sort_keys=True).encode())
+        self.manifest = manifest
+        self._encodings = {}
+        return built
+
+    def serve(self, filename):
+        """A built asset in the best encoding the client accepts, or a source file when there is no build of it"""
+        path = safe_join(self.app.config['ASSETS_BUILD_DIR'], filename)
+        if path is None or filename == MANIFEST or not os.path.isfile(path):
+            return self._serve_source(filename)
+
+        encodings = self._encodings.get(filename)
+        if encodings is None:
+            encodings = self._encodings[filename] = tuple(
+                (encoding, suffix) for encoding, suffix in ENCODINGS if os.path.isfile(path + suffix))
+
+        accepted = request.accept_encodings
+        encoding = next((e for e in encodings if accepted[e[0]]), None)
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        response = send_file(path + encoding[1] if encoding else path, mimetype=mimetype,
+                             conditional=True, cache_timeout=self.app.config['ASSETS_MAX_AGE'])
+        if encoding:
+            response.headers['Content-Encoding'] = encoding[0]
+        if encodings:
+            response.vary.add('Accept-Encoding')
+        response.headers['Cache-Control'] = 'public, max-age={}, immutable'.format(self.app.config['ASSETS_MAX_AGE'])
+        return response
+
+    def _serve_source(self, filename):
+        path = self.sources.get(filename)
+        if path is None:
+            raise NotFound()
+        return send_file(path, conditional=True)
+
+    @staticmethod
+    def _build_rank(name):
+        ext = posixpath.splitext(name)[1]
+        return BUILD_ORDER.index(ext) + 1 if ext in BUILD_ORDER else 0
+
+    def _rewrite(self, name, data, manifest):
+        """data of a script or stylesheet with its references to other sources changed to their built names"""
+        directory = posixpath.dirname(name)
+
+        def built(ref):
+            target = manifest.get(posixpath.normpath(posixpath.join(directory, ref)))
+            return posixpath.relpath(target, directory or '.') if target is not None else None
+
+        def replace_url(match):
+            quote, ref, rest = match.groups()
+            target = built(ref)
+            if target is None:
+                return match.group()
+            return 'url({0}{1}{2}{0})'.format(quote, target, rest)
+
+        def replace_source_map(match):
+            ref = match.group(1)
+            if re.match(r'[a-z]+:', ref):
+                return match.group()
+            target = built(ref)
+            # a map that is not among the sources would only make browsers ask for a missing file
+            return match.group().replace(ref, target, 1) if target is not None else ''
+
+        text = data.decode('utf-8')
+        if name.endswith('.css'):
+            text = CSS_URL.sub(replace_url, text)
+        return SOURCE_MAP.sub(replace_source_map, text).encode('utf-8')
+
+    def _compress(self, path, data):
+        if not path.endswith(COMPRESSIBLE) or len(data) < self.app.config['ASSETS_MIN_COMPRESS_SIZE']:
+            return {}
+
+        compressors = {'gzip': lambda data: gzip.compress(data, 9)}
+        if brotli is not None:
+            compressors['br'] = lambda data: brotli.compress(data, quality=11)
+
+        sizes = {}
+        for encoding, suffix in ENCODINGS:
+            compress = compressors.get(encoding)
+            if compress is None:
+                continue
+            if os.path.exists(path + suffix):
+                sizes[encoding] = os.path.getsize(path + suffix)
+                continue
+            compressed = compress(data)
+            # only kept when it saves something, serve then falls back to the next encoding
+            if len(compressed) < len(data):
+                self._write(path + suffix, compressed)
+                sizes[encoding] = len(compressed)
+        return sizes
+
+    def _read_manifest(self):
+        try:
+            with open(os.path.join(self.app.config['ASSETS_BUILD_DIR'], MANIFEST)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    @staticmethod
+    def _write(path, data):
+        # written aside and renamed, so a worker never serves half a file
+        tmp = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
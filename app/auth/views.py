@@ -3,6 +3,7 @@ from flask_login import login_user, logout_user, login_required
 
 from . import auth
 from .forms import RegistrationForm, LoginForm
+from .. import limiter
 from ..models import User
 
 
@@ -12,6 +13,7 @@ def home():
 
 
 @auth.route('/register', methods=['GET', 'POST'])
+@limiter.limit('register', methods=('POST',))
 def register():
     form = RegistrationForm()
     if form.validate_on_submit():
@@ -29,11 +31,14 @@ def register():
 
 
 @auth.route('/login', methods=['GET', 'POST'])
+@limiter.limit('login', methods=('POST',))
 def login():
     form = LoginForm()
     if form.validate_on_submit():
-        u = next(User.find(form.uni.data))
+        users = User.find(form.uni.data)
+        u = next(users) if users else None
         if u is not None and u.verify_password(form.password.data):
+            u.rehash_password(form.password.data)
             login_user(u, form.remember.data)
             return redirect(request.args.get('next') or url_for('main.home'))
         flash('Invalid username or password')
@@ -0,0 +1,39 @@
+import os
+import threading
+
+
+class BackgroundWorker(object):
+    """
+    A daemon thread running target, started by the first call to ensure_started in each
+    process. Threads do not survive a fork, so one started in a server's master would be
+    missing from every worker; starting lazily gives each process its own.
+    """
+
+    def __init__(self, target, name):
+        self.target = target
+        self.name = name
+        self.thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def ensure_started(self):
+        if self._pid == os.getpid():
+            return
+
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self.thread = threading.Thread(target=self.target, name=self.name, daemon=True)
+            self.thread.start()
+            self._pid = os.getpid()
+
+
+def load_before_first_request(app, loaded, load):
+    """
+    Calls load before the app serves its first request in each process, unless loaded()
+    is true because the caches were warmed in the master before it forked
+    """
+    @app.before_first_request
+    def load_if_needed():
+        if not loaded():
+            load()
@@ -0,0 +1,172 @@
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+MISSING = object()
+
+
+class LRUBackend(object):
+    """In-process cache holding at most max_entries values, each expiring after its ttl"""
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return MISSING
+
+            expires, value = item
+            if expires < time.monotonic():
+                del self._data[key]
+                self.evictions += 1
+                return MISSING
+
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class RedisBackend(object):
+    """
+    Cache shared by every worker, e.g. a redis-server on localhost. Needs the redis
+    package, which is not a hard requirement of the app.
+    """
+
+    def __init__(self, url, prefix='culpa:'):
+        if redis is None:
+            raise RuntimeError('CACHE_BACKEND = "redis" requires the redis package')
+        self.client = redis.StrictRedis.from_url(url)
+        self.prefix = prefix
+
+    @property
+    def evictions(self):
+        return self.client.info('stats').get('evicted_keys', 0)
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        return MISSING if value is None else pickle.loads(value)
+
+    def set(self, key, value, ttl):
+        self.client.setex(self.prefix + key, int(ttl), pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+
+    def delete(self, *keys):
+        if keys:
+            self.client.delete(*[self.prefix + key for key in keys])
+
+    def clear(self):
+        keys = list(self.client.scan_iter(self.prefix + '*'))
+        if keys:
+            self.client.delete(*keys)
+
+    def __len__(self):
+        return sum(1 for _ in self.client.scan_iter(self.prefix + '*'))
+
+
+class Cache(object):
+    """
+    Read-through cache for catalog data. The backend is picked by CACHE_BACKEND:
+    'lru' (default, per process), 'redis' (shared, at CACHE_REDIS_URL) or 'null' to disable.
+    """
+
+    def __init__(self, app=None):
+        self.backend = None
+        self.default_ttl = 300
+        self.hits = 0
+        self.misses = 0
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('CACHE_BACKEND', 'lru')
+        app.config.setdefault('CACHE_DEFAULT_TTL', 300)
+        app.config.setdefault('CACHE_MAX_ENTRIES', 10000)
+        app.config.setdefault('CACHE_REDIS_URL', 'redis://localhost:6379/0')
+
+        backend = app.config['CACHE_BACKEND']
+        if backend == 'lru':
+            self.backend = LRUBackend(app.config['CACHE_MAX_ENTRIES'])
+        elif backend == 'redis':
+            self.backend = RedisBackend(app.config['CACHE_REDIS_URL'])
+        elif backend == 'null':
+            self.backend = None
+        else:
+            raise ValueError('unknown CACHE_BACKEND {}'.format(backend))
+        self.default_ttl = app.config['CACHE_DEFAULT_TTL']
+
+    def get(self, key):
+        value = MISSING if self.backend is None else self.backend.get(key)
+        if value is MISSING:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key, value, ttl=None):
+        if self.backend is not None:
+            self.backend.set(key, value, ttl or self.default_ttl)
+
+    def get_or_set(self, key, loader, ttl=None):
+        """Returns the cached value for key, calling loader and caching its result on a miss"""
+        value = self.get(key)
+        if value is MISSING:
+            value = loader()
+            self.set(key, value, ttl)
+        return value
+
+    def delete(self, *keys):
+        if self.backend is not None:
+            self.backend.delete(*keys)
+
+    def clear(self):
+        if self.backend is not None:
+            self.backend.clear()
+
+    def clear_local(self):
+        """Drops what this process cached, nothing when the backend is shared between processes"""
+        if isinstance(self.backend, LRUBackend):
+            self.backend.clear()
+
+    def clear_shared(self):
+        """Drops what every process cached in a shared backend, nothing for a per-process one"""
+        if isinstance(self.backend, RedisBackend):
+            self.backend.clear()
+
+    def stats(self):
+        return {
+            'backend': type(self.backend).__name__ if self.backend is not None else None,
+            'entries': len(self.backend) if self.backend is not None else 0,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.backend.evictions if self.backend is not None else 0
+        }
@@ -0,0 +1,235 @@
+import csv
+import json
+import os
+from collections import namedtuple
+
+from . import directory
+from .database import execute, execute_stream, get_connection, transaction
+from .page_cache import touch_all
+
+# bytes handed to COPY per read or write, which bounds memory whatever the file size
+COPY_CHUNK_SIZE = 64 * 1024
+
+Table = namedtuple('Table', 'name columns key references')
+
+# in load order, every table only references tables above it
+CATALOG = (
+    Table('departments', ('d_id', 'name', 'abbrev'), ('d_id',), {}),
+    Table('courses', ('c_id', 'name', 'abbrev'), ('c_id',), {}),
+    Table('teachers', ('uni', 'name'), ('uni',), {}),
+    Table('teaches', ('uni', 'c_id'), ('uni', 'c_id'),
+          {'uni': ('teachers', 'uni'), 'c_id': ('courses', 'c_id')}),
+    Table('course_department', ('c_id', 'd_id'), ('c_id', 'd_id'),
+          {'c_id': ('courses', 'c_id'), 'd_id': ('departments', 'd_id')}),
+    Table('teachers_department', ('uni', 'd_id'), ('uni', 'd_id'),
+          {'uni': ('teachers', 'uni'), 'd_id': ('departments', 'd_id')}),
+)
+TABLES = {table.name: table for table in CATALOG}
+FORMATS = ('csv', 'jsonl')
+
+
+def _copy_text(value):
+    """A value in COPY's text format, where \\N is NULL"""
+    if value is None:
+        return '\\N'
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+class _JSONLines(object):
+    """
+    Read-only file that presents a JSON lines file in COPY's text format, converting only
+    as many lines as each read asks for
+    """
+
+    def __init__(self, f, columns):
+        self._file = f
+        self._columns = columns
+        self._pending = ''
+        self.line = 0
+
+    def read(self, size=-1):
+        while size < 0 or len(self._pending) < size:
+            line = self._file.readline()
+            if not line:
+                break
+            self.line += 1
+            if not line.strip():
+                continue
+
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                raise ValueError('line {}: {}'.format(self.line, e))
+            self._pending += '\t'.join(_copy_text(record.get(column)) for column in self._columns) + '\n'
+
+        if size < 0:
+            data, self._pending = self._pending, ''
+        else:
+            data, self._pending = self._pending[:size], self._pending[size:]
+        return data
+
+
+def _table_for(path):
+    name, ext = os.path.splitext(os.path.basename(path))
+    fmt = ext.lstrip('.')
+    if name not in TABLES or fmt not in FORMATS:
+        raise ValueError('{}: expected <table>.csv or <table>.jsonl with table one of {}'
+                         .format(path, ', '.join(TABLES)))
+    return TABLES[name], fmt
+
+
+def _stage(cur, table, path, fmt):
+    """Copies a file into a temporary table shaped like table, returning its name and row count"""
+    stage = 'catalog_stage_{}'.format(table.name)
+    cur.execute('CREATE TEMP TABLE {} ON COMMIT DROP AS SELECT {} FROM {} WITH NO DATA'
+                .format(stage, ', '.join(table.columns), table.name))
+    # remembers file order so that the last of several rows for a key wins
+    cur.execute('ALTER TABLE {} ADD COLUMN line bigserial'.format(stage))
+
+    with open(path, newline='', encoding='utf-8') as f:
+        if fmt == 'csv':
+            header = next(csv.reader([f.readline()]), [])
+            if sorted(header) != sorted(table.columns):
+                raise ValueError('{}: header must name the columns {}'.format(path, ', '.join(table.columns)))
+            cur.copy_expert('COPY {} ({}) FROM STDIN WITH CSV'.format(stage, ', '.join(header)),
+                            f, COPY_CHUNK_SIZE)
+        else:
+            cur.copy_expert('COPY {} ({}) FROM STDIN'.format(stage, ', '.join(table.columns)),
+                            _JSONLines(f, table.columns), COPY_CHUNK_SIZE)
+
+    cur.execute('SELECT count(*) FROM {}'.format(stage))
+    return stage, cur.fetchone()[0]
+
+
+def _validate(cur, table, stage, skip_invalid):
+    """
+    Finds staged rows with a missing key or a reference to a row that does not exist,
+    dropping them with skip_invalid and failing the import otherwise
+
+    :return: number of rows dropped
+    """
+    invalid = ['s.{} IS NULL'.format(column) for column in table.key]
+    invalid += ['NOT EXISTS (SELECT 1 FROM {} r WHERE r.{} = s.{})'.format(ref_table, ref_column, column)
+                for column, (ref_table, ref_column) in sorted(table.references.items())]
+    where = ' OR '.join(invalid)
+
+    if skip_invalid:
+        cur.execute('DELETE FROM {} s WHERE {}'.format(stage, where))
+        return cur.rowcount
+
+    cur.execute('SELECT {} FROM {} s WHERE {} ORDER BY line LIMIT 5'.format(', '.join(table.columns), stage, where))
+    samples = cur.fetchall()
+    if samples:
+        cur.execute('SELECT count(*) FROM {} s WHERE {}'.format(stage, where))
+        raise ValueError('{} rows of {} have a missing key or an unknown reference, e.g. {}'
+                         .format(cur.fetchone()[0], table.name, ', '.join(map(str, samples))))
+    return 0
+
+
+def _upsert(cur, table, stage):
+    """
+    Writes the staged rows into the table in one statement
+
+    :return: (rows inserted, rows updated)
+    """
+    columns = ', '.join(table.columns)
+    key = ', '.join(table.key)
+    values = [column for column in table.columns if column not in table.key]
+
+    if not values:
+        # link tables are all key, rows that already exist are left alone
+        matches = ' AND '.join('t.{0} = s.{0}'.format(column) for column in table.key)
+        cur.execute('''INSERT INTO {table} ({columns})
+                       SELECT DISTINCT {columns} FROM {stage} s
+                       WHERE NOT EXISTS (SELECT 1 FROM {table} t WHERE {matches})
+                    '''.format(table=table.name, columns=columns, stage=stage, matches=matches))
+        return cur.rowcount, 0
+
+    # rows whose values did not change are skipped rather than rewritten
+    cur.execute('''WITH upserted AS (
+                       INSERT INTO {table} AS t ({columns})
+                       SELECT DISTINCT ON ({key}) {columns} FROM {stage} ORDER BY {key}, line DESC
+                       ON CONFLICT ({key}) DO UPDATE SET {assignments}
+                       WHERE ({current}) IS DISTINCT FROM ({excluded})
+                       RETURNING (xmax = 0) AS inserted
+                   )
+                   SELECT count(*) FILTER (WHERE inserted), count(*) FILTER (WHERE NOT inserted) FROM upserted
+                '''.format(table=table.name,
+                           columns=columns,
+                           key=key,
+                           stage=stage,
+                           assignments=', '.join('{0} = EXCLUDED.{0}'.format(column) for column in values),
+                           current=', '.join('t.' + column for column in values),
+                           excluded=', '.join('EXCLUDED.' + column for column in values)))
+    return cur.fetchone()
+
+
+def import_catalog(paths, skip_invalid=False):
+    """
+    Loads catalog files into the database in one transaction. Each file is streamed into
+    a staging table with COPY, checked against the tables it references and merged into
+    its table with a single upsert, so memory use does not depend on the file size.
+
+    :param paths: files named <table>.csv (with a header row) or <table>.jsonl
+    :param skip_invalid: drop rows with missing keys or unknown references instead of failing
+    :return: list of (table, rows read, rows rejected, rows inserted, rows updated)
+    """
+    files = {}
+    for path in paths:
+        table, fmt = _table_for(path)
+        if table.name in files:
+            raise ValueError('more than one file for {}'.format(table.name))
+        files[table.name] = (table, path, fmt)
+
+    results = []
+    with transaction() as conn:
+        # a semester's catalog takes longer than the statement timeout meant for page requests
+        execute('SET LOCAL statement_timeout = 0')
+        cur = conn.connection.cursor()
+        for table in CATALOG:
+            if table.name not in files:
+                continue
+            _, path, fmt = files[table.name]
+            stage, read = _stage(cur, table, path, fmt)
+            rejected = _validate(cur, table, stage, skip_invalid)
+            inserted, updated = _upsert(cur, table, stage)
+            results.append((table.name, read, rejected, inserted, updated))
+        cur.close()
+
+    # every cached listing and page may be stale now. Running workers see the new catalog
+    # version within DIRECTORY_CHECK_INTERVAL, drop what they cached and reload their indexes
+    touch_all('course', 'teacher', 'department', 'departments')
+    directory.invalidate()
+    # written to DIRECTORY_SNAPSHOT_PATH too, so that workers need not rebuild it
+    directory.load(rebuild=True)
+    return results
+
+
+def export_catalog(directory, fmt='csv', tables=None):
+    """
+    Writes catalog tables to <directory>/<table>.<fmt>, in the format import_catalog reads,
+    streaming rows straight from the database to the file
+
+    :param tables: names of the tables to export, all of them by default
+    :return: list of written paths
+    """
+    if fmt not in FORMATS:
+        raise ValueError('unknown format {}'.format(fmt))
+
+    paths = []
+    for table in CATALOG:
+        if tables and table.name not in tables:
+            continue
+
+        path = os.path.join(directory, '{}.{}'.format(table.name, fmt))
+        query = 'SELECT {} FROM {} ORDER BY {}'.format(', '.join(table.columns), table.name, ', '.join(table.key))
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            if fmt == 'csv':
+                cur = get_connection().connection.cursor()
+                cur.copy_expert('COPY ({}) TO STDOUT WITH CSV HEADER'.format(query), f, COPY_CHUNK_SIZE)
+                cur.close()
+            else:
+                for (line,) in execute_stream('SELECT row_to_json(r)::text FROM ({}) r'.format(query)):
+                    f.write(line + '\n')
+        paths.append(path)
+    return paths
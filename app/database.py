@@ -0,0 +1,247 @@
+import random
+import time
+from contextlib import contextmanager
+
+from flask import g, has_app_context, has_request_context, session
+from flask_sqlalchemy import SQLAlchemy as BaseSQLAlchemy
+from sqlalchemy import create_engine, event
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.engine import Engine
+
+from .background import BackgroundWorker
+
+# seconds a replica is behind the primary, 0 when it has replayed everything it received
+# or is not a replica at all, e.g. a second local instance standing in for one
+REPLICA_LAG_QUERY = '''
+    SELECT CASE WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                ELSE COALESCE(extract(epoch FROM now() - pg_last_xact_replay_timestamp()), 0)
+           END
+'''
+
+
+class SQLAlchemy(BaseSQLAlchemy):
+    """
+    Flask-SQLAlchemy with pool pre-ping support and one pooled connection per app context.
+
+    Pool sizing comes from the usual SQLALCHEMY_POOL_SIZE, SQLALCHEMY_MAX_OVERFLOW,
+    SQLALCHEMY_POOL_TIMEOUT and SQLALCHEMY_POOL_RECYCLE settings, plus SQLALCHEMY_POOL_PRE_PING.
+    SQLALCHEMY_STATEMENT_TIMEOUT (milliseconds) makes postgres cancel any statement running longer.
+    """
+
+    def init_app(self, app):
+        app.config.setdefault('SQLALCHEMY_POOL_PRE_PING', False)
+        app.config.setdefault('SQLALCHEMY_STATEMENT_TIMEOUT', 0)
+        super(SQLAlchemy, self).init_app(app)
+        app.teardown_appcontext(release_connection)
+
+    def apply_pool_defaults(self, app, options):
+        super(SQLAlchemy, self).apply_pool_defaults(app, options)
+        if app.config['SQLALCHEMY_POOL_PRE_PING']:
+            options['pool_pre_ping'] = True
+        if app.config['SQLALCHEMY_STATEMENT_TIMEOUT']:
+            connect_args = options.setdefault('connect_args', {})
+            connect_args['options'] = '-c statement_timeout={:d}'.format(app.config['SQLALCHEMY_STATEMENT_TIMEOUT'])
+
+    def create_replica_engine(self, app, uri):
+        """An engine for a read replica, with the same pool settings as the primary"""
+        options = {}
+        self.apply_pool_defaults(app, options)
+        return create_engine(uri, **options)
+
+
+class ReplicaRouter(object):
+    """
+    Sends read-only queries, those run through read() and read_stream(), to the
+    replicas at SQLALCHEMY_REPLICA_URIS, picked at random for each app context.
+
+    A thread in every app process checks the replicas every REPLICA_CHECK_INTERVAL
+    seconds, and only those that answer and are at most REPLICA_MAX_LAG seconds behind
+    get reads. Reads go to the primary instead when no replica is healthy or the chosen
+    one cannot be reached, inside a transaction, for the rest of an app context that
+    committed a write, inside a primary_reads block, and for REPLICA_PIN_SECONDS after a
+    visitor wrote, which is kept in their session so that they read their own writes.
+    """
+
+    _engine_hooked = False
+
+    def __init__(self, app=None):
+        self.app = None
+        self.engines = ()
+        self.healthy = ()
+        # engine: seconds behind, None when it could not be reached
+        self.lag = {}
+        self._worker = BackgroundWorker(self._run, 'replica-check')
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('SQLALCHEMY_REPLICA_URIS', [])
+        app.config.setdefault('REPLICA_MAX_LAG', 5)
+        app.config.setdefault('REPLICA_CHECK_INTERVAL', 5)
+        app.config.setdefault('REPLICA_PIN_SECONDS', 10)
+
+        from . import db
+        self.engines = tuple(db.create_replica_engine(app, uri) for uri in app.config['SQLALCHEMY_REPLICA_URIS'])
+        # trusted until the first check says otherwise
+        self.healthy = self.engines
+        self.app = app
+
+        if not ReplicaRouter._engine_hooked:
+            event.listen(Engine, 'commit', self._on_commit)
+            ReplicaRouter._engine_hooked = True
+
+    def connection(self):
+        """The connection the current app context reads from"""
+        if not self.engines or self._pinned():
+            return get_connection()
+
+        conn = getattr(g, '_db_read_conn', None)
+        if conn is not None:
+            return conn
+
+        self._worker.ensure_started()
+        engines = list(self.healthy)
+        random.shuffle(engines)
+        for engine in engines:
+            try:
+                conn = g._db_read_conn = engine.connect()
+                return conn
+            except DBAPIError:
+                self.healthy = tuple(e for e in self.healthy if e is not engine)
+        return get_connection()
+
+    def pin(self):
+        """Sends the current visitor's reads to the primary for the next REPLICA_PIN_SECONDS"""
+        if self.engines:
+            session['_primary_until'] = time.time() + self.app.config['REPLICA_PIN_SECONDS']
+
+    def check(self):
+        """Measures how far behind every replica is and keeps the ones close enough for reads"""
+        lag = {}
+        for engine in self.engines:
+            try:
+                with engine.connect() as conn:
+                    lag[engine] = float(conn.execute(REPLICA_LAG_QUERY).scalar())
+            except DBAPIError:
+                lag[engine] = None
+        self.lag = lag
+        self.healthy = tuple(engine for engine in self.engines
+                             if lag[engine] is not None and lag[engine] <= self.app.config['REPLICA_MAX_LAG'])
+
+    def dispose(self):
+        for engine in self.engines:
+            engine.dispose()
+
+    def stats(self):
+        known = [seconds for seconds in self.lag.values() if seconds is not None]
+        return {
+            'replicas': len(self.engines),
+            'healthy': len(self.healthy),
+            'max_lag': max(known) if known else 0,
+        }
+
+    def _pinned(self):
+        primary = getattr(g, '_db_conn', None)
+        if getattr(g, '_db_wrote', False) or getattr(g, '_db_primary_reads', 0):
+            return True
+        if primary is not None and primary.in_transaction():
+            return True
+        return has_request_context() and session.get('_primary_until', 0) > time.time()
+
+    def _on_commit(self, conn):
+        # commits on the primary, including the implicit ones after INSERT, UPDATE and DELETE
+        if conn.engine in self.engines or not has_app_context():
+            return
+        g._db_wrote = True
+        if has_request_context():
+            self.pin()
+
+    def _run(self):
+        while True:
+            try:
+                self.check()
+            except Exception:
+                self.app.logger.exception('checking replicas failed')
+            time.sleep(self.app.config['REPLICA_CHECK_INTERVAL'])
+
+
+def get_connection():
+    """
+    Returns the connection checked out for the current app context, checking one out
+    of the pool on first use. It is returned to the pool when the context is torn down.
+    """
+    conn = getattr(g, '_db_conn', None)
+    if conn is None:
+        from . import db
+        conn = g._db_conn = db.engine.connect()
+    return conn
+
+
+def release_connection(exc=None):
+    for name in ('_db_conn', '_db_read_conn'):
+        conn = g.pop(name, None)
+        if conn is not None:
+            conn.close()
+
+
+def execute(query, *multiparams):
+    """Runs a statement on the current context's connection, same signature as engine.execute"""
+    return get_connection().execute(query, *multiparams)
+
+
+def execute_stream(query, *multiparams):
+    """
+    Like execute but rows are fetched from a server-side cursor in batches as they are
+    iterated, so large results are never held in memory at once
+    """
+    return get_connection().execution_options(stream_results=True).execute(query, *multiparams)
+
+
+def read(query, *multiparams):
+    """Like execute, but for queries that only read and may be answered by a replica"""
+    from . import replicas
+    return replicas.connection().execute(query, *multiparams)
+
+
+def read_stream(query, *multiparams):
+    """Like execute_stream, but for queries that may be answered by a replica"""
+    from . import replicas
+    return replicas.connection().execution_options(stream_results=True).execute(query, *multiparams)
+
+
+@contextmanager
+def primary_reads():
+    """
+    Sends the reads of a block to the primary. For results that are cached under a
+    version read from the primary, which a lagging replica could contradict.
+    """
+    depth = getattr(g, '_db_primary_reads', 0)
+    g._db_primary_reads = depth + 1
+    try:
+        yield
+    finally:
+        g._db_primary_reads = depth
+
+
+def executemany(query, seq_of_params):
+    """Runs a statement once per parameter tuple in a single DBAPI executemany call"""
+    params = list(seq_of_params)
+    if not params:
+        return None
+    return get_connection().execute(query, params)
+
+
+@contextmanager
+def transaction():
+    """
+    Wraps a block in a transaction on the current context's connection. Nested blocks
+    join the outermost transaction so that helpers can be composed into one atomic unit.
+    """
+    conn = get_connection()
+    if conn.in_transaction():
+        yield conn
+        return
+
+    with conn.begin():
+        yield conn
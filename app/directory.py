@@ -0,0 +1,207 @@
+import os
+import pickle
+import threading
+import time
+from collections import namedtuple
+
+from .database import primary_reads, read
+
+# bump when the layout of a snapshot changes, so that files written by older code are rebuilt
+FORMAT = 1
+
+DirectoryCourse = namedtuple('DirectoryCourse', 'c_id name abbrev')
+DirectoryTeacher = namedtuple('DirectoryTeacher', 'uni name')
+DirectoryDepartment = namedtuple('DirectoryDepartment', 'did name abbrev courses teachers')
+
+
+class Snapshot(object):
+    """
+    Every department with its courses and teachers, as nested tuples sorted by name.
+    Nothing in a snapshot changes after it is built, a newer catalog is a new snapshot.
+    """
+
+    __slots__ = ('departments', 'built_at', '_by_id', '_courses')
+
+    def __init__(self, departments, built_at):
+        self.departments = departments
+        self.built_at = built_at
+        self._by_id = {department.did: department for department in departments}
+        self._courses = {course.c_id: course for department in departments for course in department.courses}
+
+    def department(self, did):
+        """The DirectoryDepartment with d_id did, None if there is none"""
+        return self._by_id.get(did)
+
+    def course(self, c_id):
+        """The DirectoryCourse with c_id, None if it is in no department"""
+        return self._courses.get(c_id)
+
+    @staticmethod
+    def build():
+        """Reads the directory from the database with one query per table"""
+        courses = {}
+        for did, c_id, name, abbrev in read('''
+                SELECT cd.d_id, c.c_id, c.name, c.abbrev
+                FROM course_department cd JOIN courses c ON c.c_id = cd.c_id
+                ORDER BY c.name, c.c_id
+                '''):
+            courses.setdefault(did, []).append(DirectoryCourse(c_id, name, abbrev))
+
+        teachers = {}
+        for did, uni, name in read('''
+                SELECT td.d_id, t.uni, t.name
+                FROM teachers_department td JOIN teachers t ON t.uni = td.uni
+                ORDER BY t.name, t.uni
+                '''):
+            teachers.setdefault(did, []).append(DirectoryTeacher(uni, name))
+
+        departments = tuple(
+            DirectoryDepartment(did, name, abbrev, tuple(courses.get(did, ())), tuple(teachers.get(did, ())))
+            for did, name, abbrev in read('SELECT d_id, name, abbrev FROM departments ORDER BY name, d_id'))
+        return Snapshot(departments, time.time())
+
+    def dump(self, path):
+        """Writes the snapshot to path, replacing the file in one step so readers never see half of it"""
+        tmp = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp, 'wb') as f:
+            pickle.dump((FORMAT, self.built_at, self.departments), f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+
+    @staticmethod
+    def from_file(path):
+        """The snapshot written to path, None if there is none or it has another FORMAT"""
+        try:
+            with open(path, 'rb') as f:
+                fmt, built_at, departments = pickle.load(f)
+        except (OSError, EOFError, ValueError, pickle.UnpicklingError):
+            return None
+
+        if fmt != FORMAT:
+            return None
+        return Snapshot(departments, built_at)
+
+
+class Directory(object):
+    """
+    Serves the department listing and department pages from a Snapshot held in memory,
+    so they cost no queries. The catalog changes about once a semester.
+
+    The snapshot is rebuilt when the catalog version changes (see invalidate) or when
+    another process writes a newer DIRECTORY_SNAPSHOT_PATH. Both are checked at most
+    every DIRECTORY_CHECK_INTERVAL seconds. The version is kept in the database with the
+    page versions (app/page_cache.py), so a change made by any process, the catalog
+    import included, reaches every worker whether or not the snapshot file is used. One
+    thread rebuilds while the others keep serving the old snapshot, and the new one is
+    swapped in as a single reference.
+
+    Callbacks passed to connect are called whenever a new catalog version is loaded,
+    so that whatever else a process derives from the catalog can follow it.
+
+    With DIRECTORY_SNAPSHOT_PATH set, processes start from that file instead of the
+    database, and every rebuild rewrites it. When the app is preloaded before forking,
+    workers share the master's snapshot.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        # (catalog version, file mtime, snapshot) swapped as one reference so readers never see a mix
+        self._current = (None, None, None)
+        self._checked_at = 0
+        self._lock = threading.Lock()
+        self._listeners = []
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('DIRECTORY_SNAPSHOT_PATH', None)
+        app.config.setdefault('DIRECTORY_CHECK_INTERVAL', 5)
+        self.app = app
+
+        # every request checks, so that no worker keeps serving an old catalog for long;
+        # it costs nothing until DIRECTORY_CHECK_INTERVAL has passed
+        @app.before_request
+        def check_directory():
+            self.get()
+
+    def get(self):
+        """The current Snapshot, replaced first if the catalog changed since it was built"""
+        snapshot = self._current[2]
+        if snapshot is not None and time.monotonic() - self._checked_at < self.app.config['DIRECTORY_CHECK_INTERVAL']:
+            return snapshot
+
+        # only the very first load makes requests wait
+        if not self._lock.acquire(blocking=snapshot is None):
+            return snapshot
+        try:
+            self._refresh()
+        finally:
+            self._lock.release()
+        return self._current[2]
+
+    def load(self, rebuild=False):
+        """
+        Swaps in the snapshot file if there is one, else a snapshot built from the
+        database, which is then written to the file
+
+        :param rebuild: always build from the database
+        :return: the new Snapshot
+        """
+        from .page_cache import version
+
+        path = self.app.config['DIRECTORY_SNAPSHOT_PATH']
+        # read before building, so a change made while building triggers another rebuild
+        catalog_version = version('catalog', 'all')
+        snapshot = Snapshot.from_file(path) if path and not rebuild else None
+        if snapshot is None:
+            # not from a replica, which may not have the change the new version stands for yet
+            with primary_reads():
+                snapshot = Snapshot.build()
+            if path:
+                snapshot.dump(path)
+
+        previous_version = self._current[0]
+        self._current = (catalog_version, self._mtime(path), snapshot)
+        self._checked_at = time.monotonic()
+        if previous_version is not None and previous_version != catalog_version:
+            for callback in self._listeners:
+                callback()
+        return snapshot
+
+    def connect(self, callback):
+        """Calls callback, without arguments, after a change to the catalog was picked up"""
+        self._listeners.append(callback)
+
+    def invalidate(self):
+        """
+        Marks the catalog as changed, every process replaces its snapshot at its next check
+        and drops the lookups it cached itself. Lookups in a shared cache are dropped here.
+        """
+        from . import cache
+        from .page_cache import touch
+
+        touch('catalog', 'all')
+        cache.clear_shared()
+        self._checked_at = 0
+
+    def _refresh(self):
+        from .page_cache import version
+
+        catalog_version, mtime, snapshot = self._current
+        path = self.app.config['DIRECTORY_SNAPSHOT_PATH']
+        if snapshot is None:
+            self.load()
+        elif self._mtime(path) != mtime:
+            # another process wrote a newer snapshot
+            self.load()
+        elif version('catalog', 'all') != catalog_version:
+            self.load(rebuild=True)
+        else:
+            self._checked_at = time.monotonic()
+
+    @staticmethod
+    def _mtime(path):
+        try:
+            return os.stat(path).st_mtime if path else None
+        except OSError:
+            return None
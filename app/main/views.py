@@ -1,9 +1,12 @@
-from flask import render_template, request, redirect, url_for, jsonify
+from flask import (Markup, Response, abort, current_app, jsonify, redirect, render_template, request,
+                   stream_with_context, url_for)
 from flask_login import current_user
 
 from . import main
 from .forms import SearchForm, VoteForm
-from ..models import Course, Department, Teacher, Review
+from .. import directory, limiter, replicas, suggestions, trending, vote_queue
+from ..page_cache import cached_fragment, cached_page
+from ..models import Course, Teacher, Review, ReviewStats
 
 
 @main.route('/')
@@ -13,34 +16,164 @@ def home():
 
 
 @main.route('/search')
+@limiter.limit('search')
 def search():
-    query = '%'.join(request.args.get('query').split(' '))
-    query = f'%{query}%'
-    return render_template('main/search.html', courses=Course.search(query), teachers=Teacher.search(query))
+    query = request.args.get('query', '')
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = current_app.config['SEARCH_RESULTS_PER_PAGE']
+
+    # fetch one extra row to know whether there is a next page
+    offset = (page - 1) * per_page
+    courses = list(Course.search(query, per_page + 1, offset) or [])
+    teachers = list(Teacher.search(query, per_page + 1, offset) or [])
+    return render_template('main/search.html',
+                           query=query,
+                           page=page,
+                           has_next=len(courses) > per_page or len(teachers) > per_page,
+                           courses=courses[:per_page],
+                           teachers=teachers[:per_page])
+
+
+@main.route('/search/suggest')
+def suggest():
+    results = suggestions.suggest(request.args.get('q', ''), current_app.config['SUGGEST_LIMIT'])
+    return jsonify(
+        {
+            'suggestions': [
+                {
+                    'kind': kind,
+                    'label': label,
+                    'url': url_for('main.course', cid=ident) if kind == 'course' else url_for('main.teacher', uni=ident)
+                }
+                for kind, ident, label in results
+            ]
+        }
+    )
 
 
 @main.route('/departments')
 def departments():
-    return render_template('main/departments.html', departments=Department.find_all())
+    return cached_page('departments', 'all',
+                       lambda: render_template('main/departments.html', departments=directory.get().departments))
 
 
 @main.route('/departments/<did>')
 def department(did):
-    return render_template('main/department.html', department=next(Department.find(did)))
+    department = directory.get().department(did)
+    if department is None:
+        abort(404)
+
+    return cached_page('department', did,
+                       lambda: render_template('main/department.html', department=department))
+
+
+@main.route('/departments/<did>/top')
+def department_top(did):
+    ranking = request.args.get('by', 'rating')
+    if ranking not in ReviewStats.RANKINGS:
+        abort(400)
+
+    department = directory.get().department(did)
+    if department is None:
+        abort(404)
+
+    return render_template('main/department_top.html',
+                           department=department,
+                           ranking=ranking,
+                           rankings=sorted(ReviewStats.RANKINGS),
+                           courses=ReviewStats.top_courses(did, ranking),
+                           popular=popular_courses(10, did))
+
+
+def popular_courses(limit, did=None):
+    """The courses trending right now, overall or in department did, as DirectoryCourses"""
+    snapshot = directory.get()
+    courses = (snapshot.course(c_id) for c_id, _ in trending.top(limit, did))
+    # courses that are in no department have no directory entry and are left out
+    return [course for course in courses if course is not None]
+
+
+@main.route('/trending')
+def trending_courses():
+    return render_template('main/trending.html', courses=popular_courses(current_app.config['TRENDING_PAGE_SIZE']))
+
+
+# which column of reviews each kind of review listing is keyed by
+REVIEW_LISTINGS = {'course': 'c_id', 'teacher': 'teacher_uni'}
+
+
+def stream_template(template_name, **context):
+    # Flask 0.12 has no stream_template, this is the recipe from its streaming docs
+    app = current_app._get_current_object()
+    app.update_template_context(context)
+    stream = app.jinja_env.get_template(template_name).stream(context)
+    stream.enable_buffering(5)
+    return stream
+
+
+def review_page(kind, ident, before=None):
+    """
+    One page of a course's or teacher's reviews, newest first.
+
+    :param before: cursor of the last review of the previous page, see Review.cursor
+    :return: (html, cursor of the next page or None)
+    """
+    per_page = current_app.config['REVIEWS_PER_PAGE']
+
+    def render():
+        keyset = Review.parse_cursor(before) if before else None
+        # fetch one extra review to know whether there is a next page
+        reviews = list(Review.find_with_details(ident, REVIEW_LISTINGS[kind], keyset, per_page + 1) or [])
+        next_cursor = reviews[per_page - 1].cursor() if len(reviews) > per_page else None
+        next_url = url_for('main.reviews', kind=kind, ident=ident, before=next_cursor) if next_cursor else None
+        return render_template('reviews.html', kind=kind, reviews=reviews[:per_page], next_url=next_url), next_cursor
+
+    html, next_cursor = cached_fragment('reviews:{}'.format(before or ''), kind, ident, render)
+    return Markup(html), next_cursor
+
+
+def review_listing_page(kind, ident, template, **context):
+    """
+    Renders a course or teacher page, either with the first page of reviews from the
+    fragment cache or, with STREAM_REVIEW_PAGES, streaming every review as it is fetched
+    """
+    if current_app.config['STREAM_REVIEW_PAGES']:
+        reviews = Review.find_with_details(ident, REVIEW_LISTINGS[kind], stream=True)
+        return Response(stream_with_context(stream_template(template, kind=kind, reviews=reviews, **context)))
+
+    return cached_page(kind, ident,
+                       lambda: render_template(template, kind=kind, reviews_html=review_page(kind, ident)[0], **context))
 
 
 @main.route('/courses/<cid>', methods=['GET', 'POST'])
 def course(cid):
-    form = VoteForm()
     course = next(Course.find(cid))
     course.add_view()
-    return render_template('main/course.html', course=course, form=form)
+    return review_listing_page('course', cid, 'main/course.html', course=course)
 
 
 @main.route('/teachers/<uni>', methods=['GET', 'POST'])
 def teacher(uni):
-    form = VoteForm()
-    return render_template('main/teacher.html', teacher=next(Teacher.find(uni)), form=form)
+    return review_listing_page('teacher', uni, 'main/teacher.html', teacher=next(Teacher.find(uni)))
+
+
+@main.route('/reviews/<kind>/<ident>')
+def reviews(kind, ident):
+    if kind not in REVIEW_LISTINGS:
+        abort(404)
+
+    before = request.args.get('before')
+    try:
+        html, next_cursor = review_page(kind, ident, before)
+    except ValueError:
+        abort(400)
+
+    return jsonify(
+        {
+            'html': html,
+            'next': url_for('main.reviews', kind=kind, ident=ident, before=next_cursor) if next_cursor else None
+        }
+    )
 
 
 @main.route('/review')
@@ -48,31 +181,41 @@ def review_redirect():
     return redirect(url_for('user.review'))
 
 
-@main.route('/vote/<rid>', methods=['POST'])
+@main.route('/vote/<int:rid>', methods=['POST'])
+@limiter.limit('vote')
 def vote(rid):
     if current_user.is_anonymous:
         # TODO: make sure that the next variable is set for login to go to the right page
         return jsonify({'message':'redirect', 'url':url_for('auth.login')})
     form = VoteForm()
+    tally = Review.find_tally(rid, current_user.uni)
+    if tally is None:
+        abort(404)
+
+    agree, disagree, stored = tally
     message = ''
     if form.validate_on_submit():
         liked = form.agree.data
-        v = current_user.get_vote(rid)
-
-        # if user has not previously voted we add a new vote
-        if not v:
-            current_user.vote(rid, liked)
-            message = 'added new vote'
-
-        # if user changed vote, we update the vote
-        elif v.liked != liked:
-            current_user.update_vote(rid, liked)
-            message = 'changed vote'
+        # a vote still waiting in the queue counts as the user's current one
+        previous = vote_queue.pending(current_user.uni, rid, stored)
 
-        else:
+        if previous == liked:
             message = 'no effect'
+        else:
+            vote_queue.add(current_user.uni, rid, liked)
+            # the vote is written after this response, keep the voter's reads where it lands
+            replicas.pin()
+            message = 'added new vote' if previous is None else 'changed vote'
+
+            # optimistic tally, what the queued vote does to the stored one once it is written
+            if stored is None:
+                agree += int(liked)
+                disagree += int(not liked)
+            elif stored != liked:
+                delta = 1 if liked else -1
+                agree += delta
+                disagree -= delta
 
-    agree, disagree = next(Review.find(rid)).get_votes()
     return jsonify(
         {
             'message': message,
@@ -1,82 +1,209 @@
+import math
 from datetime import datetime
 
-from flask_login import UserMixin
-from werkzeug.security import generate_password_hash, check_password_hash
+from flask import current_app
 
-from . import db, login_manager
+from . import (cache, directory, login_manager, passwords, sentiment_worker, statements, suggestions, trending,
+               view_buffer)
+from .database import execute, executemany, primary_reads, read, read_stream, transaction
+from .page_cache import touch
+from .search import terms, prefix_tsquery
+from .sentiment import score_review
+
+CURSOR_TIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+# days after which a review or vote counts half as much toward a course's or teacher's activity
+ACTIVITY_HALF_LIFE = 14
+# pseudo-reviews that pull the mean sentiment of little reviewed courses toward neutral when ranking
+RANKING_PRIOR = 5
+
+
+def cached_rows(key, query, *multiparams):
+    """Rows of a catalog query, read through the cache under key, from the primary on a miss"""
+    def load():
+        with primary_reads():
+            return [tuple(row) for row in read(query, *multiparams)]
+    return cache.get_or_set(key, load)
+
+
+def cached_statement(key, name, params, field=None):
+    """Rows of a statement from the QueryRegistry, read through the cache under key, from the primary on a miss"""
+    def load():
+        with primary_reads():
+            return [tuple(row) for row in statements.execute(name, params, field)]
+    return cache.get_or_set(key, load)
+
+
+def projection(columns, fields):
+    """
+    Columns a finder selects, all of columns when fields is None
+
+    :raises ValueError: if a field is not one of columns
+    """
+    if fields is None:
+        return tuple(columns)
+    unknown = [field for field in fields if field not in columns]
+    if unknown:
+        raise ValueError('unknown fields: {}'.format(', '.join(unknown)))
+    return tuple(fields)
+
+
+def warm_cache():
+    """
+    Loads the department directory, the suggestion index and the trending courses ahead
+    of traffic, e.g. in a server's master process before it forks its workers
+
+    :return: number of departments loaded
+    """
+    snapshot = directory.load()
+    suggestions.load()
+    trending.load()
+    return len(snapshot.departments)
 
 
 @login_manager.user_loader
 def load_user(user_id):
-    return next(User.find(user_id))
+    return User.load(user_id)
 
 
-class User(UserMixin):
-    def __init__(self, uni, first, last, year, password_hash=None, password=None, school=None, num_reviews=0):
+class User(object):
+    """
+    A student account. Provides what flask-login needs itself instead of inheriting
+    UserMixin, so that instances have slots and no __dict__.
+    """
+
+    __slots__ = ('uni', 'first', 'last', 'year', 'password_hash', 'school', 'num_reviews')
 
-        # needed for flask login
-        self.id = uni
+    # needed for flask login
+    is_active = True
+    is_authenticated = True
+    is_anonymous = False
 
+    def __init__(self, uni, first, last, year, password_hash=None, password=None, school=None, num_reviews=0):
         self.uni = uni
         self.first = first
         self.last = last
-        self.name = ', '.join([self.last, self.first])
         self.year = year
-        if password_hash:
-            self.password_hash = password_hash
-        else:
+        if password is not None:
             self.password = password
+        else:
+            self.password_hash = password_hash
         self.school = school
         self.num_reviews = num_reviews
 
+    def get_id(self):
+        return self.uni
+
+    def __eq__(self, other):
+        return isinstance(other, User) and self.uni == other.uni
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.uni)
+
+    @property
+    def name(self):
+        return ', '.join([self.last, self.first])
+
     @property
     def password(self):
         raise AttributeError('password is not readable')
 
     @password.setter
     def password(self, password):
-        self.password_hash = generate_password_hash(password)
+        # hashed in the PasswordHasher's worker processes
+        self.password_hash = passwords.hash(password)
 
     def verify_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return passwords.verify(self.password_hash, password)
+
+    def rehash_password(self, password):
+        """
+        Stores a new hash of a verified password if the current one was made with other
+        PASSWORD_HASH_METHOD or PASSWORD_SALT_LENGTH settings
+
+        :return: whether the hash was replaced
+        """
+        if not passwords.needs_rehash(self.password_hash):
+            return False
+        self.password = password
+        self.update()
+        passwords.rehashed += 1
+        return True
 
     def save(self):
-        db.engine.execute('INSERT INTO users VALUES (%s, %s, %s, %s, %s, %s)',
-                          (self.uni,
-                           self.name,
-                           self.year,
-                           self.password_hash,
-                           self.school,
-                           self.num_reviews)
-                          )
-
-    def get_reviews(self):
-        return Review.find(self.uni, 'uni')
+        execute('INSERT INTO users VALUES (%s, %s, %s, %s, %s, %s)',
+                (self.uni,
+                 self.name,
+                 self.year,
+                 self.password_hash,
+                 self.school,
+                 self.num_reviews)
+                )
+        cache.delete(User.cache_key(self.uni))
+
+    def update(self):
+        """Writes back changed profile fields and, if one was set, a new password"""
+        execute('''
+            UPDATE users SET name = %s, year = %s, school = %s, password_hash = COALESCE(%s, password_hash)
+            WHERE uni = %s
+        ''', (self.name, self.year, self.school, self.password_hash, self.uni))
+        cache.delete(User.cache_key(self.uni))
+
+    def get_reviews(self, before=None, limit=None):
+        return Review.find(self.uni, 'uni', before, limit)
 
     def get_vote(self, rid):
         return Vote.find(self.uni, rid)
 
     def vote(self, rid, liked):
-        v = Vote(self.uni, rid, liked)
-        v.save()
+        """
+        Records or changes the user's vote on a review right away, without the vote queue
 
-    def update_vote(self, rid, liked):
-        db.engine.execute('UPDATE votes SET liked = %s WHERE (uni, r_id) = (%s, %s)', (liked, self.uni, rid))
+        :return: (agree, disagree) tally after the vote
+        """
+        Vote.save_many([(self.uni, rid, liked, datetime.now())])
+        return Review.find_votes(rid)
 
     @staticmethod
-    def find(val, field='uni'):
+    def cache_key(uni):
+        return 'user:{}'.format(uni)
 
-        query = 'SELECT * FROM users WHERE {} = %s'.format(field)
-        cur = db.engine.execute(query, (val,))
+    @staticmethod
+    def load(uni):
+        """
+        The logged in user of a request, read through the cache for USER_CACHE_TTL seconds.
+        The password hash is left out, only logging in needs it and that goes through find.
+        """
+        def fetch():
+            cur = statements.execute('user_profile', (uni,))
+            row = cur.fetchone()
+            cur.close()
+            return tuple(row) if row else None
+
+        row = cache.get_or_set(User.cache_key(uni), fetch, current_app.config['USER_CACHE_TTL'])
+        if row is None:
+            return None
+
+        uni, name, year, school, num_reviews = row
+        last, first = name.split(', ', 1)
+        return User(uni, first, last, year, school=school, num_reviews=num_reviews)
+
+    @staticmethod
+    def find(val, field='uni'):
+        cur = statements.execute('user', (val,), field)
 
         if cur.rowcount == 0:
             return None
 
         def user_generator():
             for (uni, name, year, password_hash, school, num_reviews) in cur:
+                last, first = name.split(', ', 1)
                 yield User(uni=uni,
-                           first=name.split(', ')[1],
-                           last=name.split(', ')[0],
+                           first=first,
+                           last=last,
                            year=year,
                            password_hash=password_hash,
                            school=school,
@@ -86,18 +213,21 @@ class User(UserMixin):
         return user_generator()
 
 class Vote(object):
-    def __init__(self, uni, r_id, liked, voted_on=datetime.now()):
+    __slots__ = ('uni', 'r_id', 'liked', 'voted_on')
+
+    def __init__(self, uni, r_id, liked, voted_on=None):
         self.uni = uni
         self.r_id = r_id
         self.liked = liked
-        self.voted_on = voted_on
+        self.voted_on = voted_on or datetime.now()
 
     def save(self):
-        db.engine.execute('INSERT INTO votes VALUES (%s, %s, %s, %s)', (self.uni, self.r_id, self.voted_on, self.liked))
+        """Writes the vote right away, with the same tally, stats and cache updates as a queued one"""
+        Vote.save_many([(self.uni, self.r_id, self.liked, self.voted_on)])
 
     @staticmethod
     def find(uni, rid):
-        cur = db.engine.execute('SELECT * FROM votes v WHERE v.uni = %s AND v.r_id = %s', (uni, rid))
+        cur = execute('SELECT * FROM votes v WHERE v.uni = %s AND v.r_id = %s', (uni, rid))
 
         if cur.rowcount == 0:
             return None
@@ -106,65 +236,281 @@ class Vote(object):
         cur.close()
         return Vote(uni, r_id, liked, voted_on)
 
+    @staticmethod
+    def save_many(votes):
+        """
+        Writes a batch of votes in one transaction. New votes are inserted and changed ones
+        flipped with one upsert, then the tallies of the reviews and their stats move by the
+        net change. Votes repeating what is already stored change nothing.
+
+        :param votes: list of (uni, r_id, liked, voted_on), at most one per (uni, r_id)
+        """
+        if not votes:
+            return
+
+        values = ', '.join(['(%s, %s::int, %s::boolean, %s::timestamp)'] * len(votes))
+        with transaction():
+            cur = execute('''
+                WITH incoming (uni, r_id, liked, voted_on) AS (VALUES {}),
+                written AS (
+                    INSERT INTO votes AS v (uni, r_id, voted_on, liked)
+                    SELECT i.uni, i.r_id, i.voted_on, i.liked FROM incoming i
+                    WHERE EXISTS (SELECT 1 FROM reviews r WHERE r.r_id = i.r_id)
+                    ORDER BY i.uni, i.r_id
+                    ON CONFLICT (uni, r_id) DO UPDATE SET liked = EXCLUDED.liked, voted_on = EXCLUDED.voted_on
+                    WHERE v.liked <> EXCLUDED.liked
+                    RETURNING v.r_id, v.liked, v.xmax = 0 AS inserted
+                ),
+                changes AS (
+                    -- a new vote adds one to its side, a flipped one also takes one from the other side
+                    SELECT r_id,
+                           sum(CASE WHEN liked THEN 1 WHEN inserted THEN 0 ELSE -1 END) AS agree,
+                           sum(CASE WHEN NOT liked THEN 1 WHEN inserted THEN 0 ELSE -1 END) AS disagree,
+                           count(*) AS votes
+                    FROM written GROUP BY r_id
+                )
+                UPDATE reviews r SET agree = r.agree + c.agree, disagree = r.disagree + c.disagree
+                FROM changes c
+                WHERE r.r_id = c.r_id
+                RETURNING r.c_id, r.teacher_uni, c.agree, c.disagree, c.votes
+            '''.format(values), tuple(v for vote in votes for v in vote))
+            changes = [tuple(row) for row in cur]
+            ReviewStats.add([(c_id, t_uni, 0, 0.0, agree, disagree, n) for c_id, t_uni, agree, disagree, n in changes])
+
+        for c_id, t_uni in {change[:2] for change in changes}:
+            Review.touch(c_id, t_uni)
+        for c_id, _, _, _, n in changes:
+            trending.add(c_id, 'vote', n)
+
 
 class Review(object):
-    def __init__(self, c_id, uni, t_uni, general, workload, sentiment_score=0, written_on=datetime.now(), r_id=None):
+    __slots__ = ('c_id', 'uni', 't_uni', 'general', 'workload', 'sentiment_score', 'written_on', 'r_id',
+                 'agree', 'disagree', 'teacher_name', 'course_name')
+
+    def __init__(self, c_id, uni, t_uni, general, workload, sentiment_score=0, written_on=None, r_id=None,
+                 agree=0, disagree=0, teacher_name=None, course_name=None):
         self.c_id = c_id
         self.uni = uni
         self.t_uni = t_uni
         self.general = general
         self.workload = workload
         self.sentiment_score = sentiment_score
-        self.written_on = written_on
+        self.written_on = written_on or datetime.now()
         self.r_id = r_id
+        self.agree = agree
+        self.disagree = disagree
+        # only filled in by listings that join the teacher and course names
+        self.teacher_name = teacher_name
+        self.course_name = course_name
 
     def save(self):
-        db.engine.execute('''
-            INSERT INTO reviews (c_id, uni, teacher_uni, general_content, workload_content, sentiment_score, written_on)
-            VALUES (%s, %s, %s, %s, %s, %s, %s)
-        ''', (self.c_id, self.uni, self.t_uni, self.general, self.workload, self.sentiment_score, self.written_on))
+        with transaction():
+            cur = execute('''
+                INSERT INTO reviews (c_id, uni, teacher_uni, general_content, workload_content, sentiment_score, written_on)
+                VALUES (%s, %s, %s, %s, %s, %s, %s)
+                RETURNING r_id
+            ''', (self.c_id, self.uni, self.t_uni, self.general, self.workload, self.sentiment_score, self.written_on))
+            self.r_id = cur.fetchone()[0]
+
+            # scored in the background by SentimentWorker
+            execute('INSERT INTO sentiment_jobs (r_id) VALUES (%s)', (self.r_id,))
+            ReviewStats.add([(self.c_id, self.t_uni, 1, float(self.sentiment_score or 0), 0, 0, 1)])
+
+        Review.touch(self.c_id, self.t_uni)
+        trending.add(self.c_id, 'review')
+        sentiment_worker.notify()
 
-    def get_teacher(self):
-        cur = db.engine.execute('SELECT * FROM teachers t WHERE t.uni = %s', (self.t_uni, ))
+    @staticmethod
+    def touch(c_id, t_uni):
+        # the review lists of both the course and the teacher page change
+        touch('course', c_id)
+        touch('teacher', t_uni)
 
-        if cur.rowcount == 0:
-            return None
-        t = Teacher(*next(cur))
-        cur.close()
-        return t
+    def get_teacher(self):
+        teachers = Teacher.find(self.t_uni)
+        return next(teachers) if teachers else None
 
     def get_course(self):
-        cur = db.engine.execute('SELECT * FROM courses c WHERE c.c_id = %s', (self.c_id))
+        courses = Course.find(self.c_id)
+        return next(courses) if courses else None
+
+    def get_votes(self):
+        return self.agree, self.disagree
+
+    @staticmethod
+    def find_votes(rid):
+        cur = execute('SELECT agree, disagree FROM reviews WHERE r_id = %s', (rid,))
 
         if cur.rowcount == 0:
-            return None
+            return 0, 0
 
-        c = Course(*next(cur))
+        votes = cur.fetchone()
         cur.close()
-        return c
+        return votes
 
-    def get_votes(self):
-        cur = db.engine.execute('SELECT COUNT(*) FROM votes v WHERE v.r_id = %s AND liked = TRUE', (self.r_id,))
-        agree = 0 if cur.rowcount == 0 else cur.fetchone()[0]
+    @staticmethod
+    def find_tally(rid, uni):
+        """
+        :return: (agree, disagree, liked) of review rid, liked being uni's stored vote or None,
+                 or None when there is no such review
+        """
+        cur = statements.execute('review_tally', (uni, rid))
 
-        cur = db.engine.execute('SELECT COUNT(*) FROM votes v WHERE v.r_id = %s AND liked = FALSE', (self.r_id,))
-        disagree = 0 if cur.rowcount == 0 else cur.fetchone()[0]
+        row = cur.fetchone()
         cur.close()
+        return tuple(row) if row else None
+
+    @staticmethod
+    def reconcile_votes():
+        """
+        Rebuilds the agree/disagree counters of every review from the votes table
+
+        :return: number of reviews whose counters had drifted
+        """
+        cur = execute('''
+            UPDATE reviews r SET agree = vc.agree, disagree = vc.disagree
+            FROM (
+                SELECT rv.r_id,
+                       COUNT(v.r_id) FILTER (WHERE v.liked) AS agree,
+                       COUNT(v.r_id) FILTER (WHERE NOT v.liked) AS disagree
+                FROM reviews rv LEFT JOIN votes v ON v.r_id = rv.r_id
+                GROUP BY rv.r_id
+            ) vc
+            WHERE r.r_id = vc.r_id AND (r.agree, r.disagree) IS DISTINCT FROM (vc.agree, vc.disagree)
+        ''')
+        return cur.rowcount
+
+    @staticmethod
+    def score_queued(limit):
+        """
+        Claims up to limit reviews from sentiment_jobs and stores their sentiment scores.
+        Claimed jobs stay locked until the scores are written, so concurrent workers skip
+        them, and go back to the queue if anything fails.
+
+        :return: number of reviews scored
+        """
+        with transaction():
+            cur = execute('''
+                DELETE FROM sentiment_jobs WHERE r_id IN (
+                    SELECT r_id FROM sentiment_jobs ORDER BY enqueued_on LIMIT %s FOR UPDATE SKIP LOCKED
+                )
+                RETURNING r_id
+            ''', (limit,))
+            r_ids = [r_id for (r_id,) in cur]
+            if not r_ids:
+                return 0
+
+            cur = execute('SELECT r_id, general_content, workload_content FROM reviews WHERE r_id = ANY(%s)', (r_ids,))
+            Review.update_sentiment([score_review(tuple(row)) for row in cur])
+
+        return len(r_ids)
+
+    @staticmethod
+    def update_sentiment(scores):
+        """
+        Writes sentiment scores back in a single statement and moves the review stats by
+        the difference to the previous scores
 
-        return agree, disagree
+        :param scores: list of (r_id, sentiment_score)
+        """
+        if not scores:
+            return
+
+        values = ', '.join(['(%s, %s)'] * len(scores))
+        with transaction():
+            # old is a second scan of reviews, which still sees the scores from before the update
+            cur = execute('''
+                UPDATE reviews r SET sentiment_score = v.score
+                FROM (VALUES {}) v(r_id, score), reviews old
+                WHERE r.r_id = v.r_id AND old.r_id = v.r_id
+                RETURNING r.c_id, r.teacher_uni, v.score - old.sentiment_score
+            '''.format(values), tuple(v for row in scores for v in row))
+
+            deltas = [(c_id, t_uni, 0, change, 0, 0, 0) for c_id, t_uni, change in cur if change]
+            ReviewStats.add(deltas)
+        for c_id, t_uni in {delta[:2] for delta in deltas}:
+            Review.touch(c_id, t_uni)
+
+    @staticmethod
+    def find_contents(after=None, limit=1000):
+        """
+        (r_id, general_content, workload_content) of up to limit reviews, in r_id order
+
+        :param after: r_id to continue after, from the first review when None
+        """
+        if after is None:
+            rows = execute('SELECT r_id, general_content, workload_content FROM reviews ORDER BY r_id LIMIT %s',
+                           (limit,))
+        else:
+            rows = execute('''
+                SELECT r_id, general_content, workload_content FROM reviews
+                WHERE r_id > %s ORDER BY r_id LIMIT %s
+            ''', (after, limit))
+        return [tuple(row) for row in rows]
 
     @staticmethod
     def review_generator(cur):
-        for (r_id, c_id, uni, t_uni, g_content, w_content, s_score, written_on) in cur:
-            yield Review(c_id, uni, t_uni, g_content, w_content, s_score, written_on, r_id)
+        for (r_id, c_id, uni, t_uni, g_content, w_content, s_score, written_on, agree, disagree) in cur:
+            yield Review(c_id, uni, t_uni, g_content, w_content, s_score, written_on, r_id, agree, disagree)
 
         cur.close()
 
     @staticmethod
-    def find(val, field='r_id'):
-        query = '''SELECT * FROM reviews WHERE {} = %s ORDER BY written_on DESC'''.format(field)
+    def review_details_generator(cur):
+        for (r_id, c_id, uni, t_uni, g_content, w_content, s_score, written_on,
+             teacher_name, course_name, agree, disagree) in cur:
+            yield Review(c_id, uni, t_uni, g_content, w_content, s_score, written_on, r_id, agree, disagree,
+                         teacher_name, course_name)
+
+        cur.close()
 
-        cur = db.engine.execute(query, (val,))
+    def cursor(self):
+        """Opaque keyset cursor continuing a review listing after this review"""
+        return '{}_{}'.format(self.written_on.strftime(CURSOR_TIME_FORMAT), self.r_id)
+
+    @staticmethod
+    def parse_cursor(cursor):
+        """
+        :return: (written_on, r_id) of a cursor made by Review.cursor
+        :raises ValueError: on a malformed cursor
+        """
+        written_on, _, r_id = cursor.rpartition('_')
+        return datetime.strptime(written_on, CURSOR_TIME_FORMAT), int(r_id)
+
+    @staticmethod
+    def find_with_details(val, field='c_id', before=None, limit=None, stream=False):
+        """
+        Loads reviews along with their teacher and course names in a single query so that
+        rendering a list of reviews does not issue per-review lookups
+
+        :param val: value to match
+        :param field: one of c_id, teacher_uni, uni
+        :param before: (written_on, r_id) keyset to continue after, see Review.parse_cursor
+        :param limit: maximum number of reviews, all of them if None
+        :param stream: fetch rows lazily through a server-side cursor instead of all at once
+        """
+        name = 'review_details_before' if before is not None else 'review_details'
+        params = (val,) + tuple(before or ()) + (limit,)
+
+        if stream:
+            return Review.review_details_generator(statements.execute(name, params, field, stream=True))
+
+        cur = statements.execute(name, params, field)
+
+        if cur.rowcount == 0:
+            return None
+
+        return Review.review_details_generator(cur)
+
+    @staticmethod
+    def find(val, field='r_id', before=None, limit=None):
+        """
+        :param field: one of r_id, c_id, uni, teacher_uni
+        :param before: (written_on, r_id) keyset to continue after, see Review.parse_cursor
+        :param limit: maximum number of reviews, all of them if None
+        """
+        name = 'reviews_before' if before is not None else 'reviews'
+        cur = statements.execute(name, (val,) + tuple(before or ()) + (limit,), field)
 
         if cur.rowcount == 0:
             return None
@@ -172,36 +518,210 @@ class Review(object):
         return Review.review_generator(cur)
 
 
+class ReviewStats(object):
+    """
+    Precomputed review totals of a course, a teacher or a course as taught by one teacher,
+    stored in course_stats, teacher_stats and course_teacher_stats (migrations/006_review_stats.sql).
+
+    The rows are updated by ReviewStats.add in the same transactions that write reviews,
+    votes and sentiment scores, so pages read them with one primary key lookup.
+    `flask rebuild-stats` recomputes them from reviews and votes.
+    """
+
+    # kind: (table, key columns)
+    TABLES = {
+        'course': ('course_stats', ('c_id',)),
+        'teacher': ('teacher_stats', ('uni',)),
+        'course_teacher': ('course_teacher_stats', ('c_id', 'uni')),
+    }
+
+    # orderings of ReviewStats.top_courses, s is course_stats
+    RANKINGS = {
+        'rating': 's.sentiment_sum / (s.reviews + {})'.format(RANKING_PRIOR),
+        'helpful': '(s.agree + 1.0) / (s.agree + s.disagree + 2)',
+        'reviews': 's.reviews',
+        'active': None,
+    }
+
+    __slots__ = ('reviews', 'sentiment', 'agree', 'disagree', 'helpfulness', 'activity')
+
+    def __init__(self, reviews, sentiment_sum, agree, disagree, activity):
+        self.reviews = reviews
+        self.sentiment = sentiment_sum / reviews if reviews else 0.0
+        self.agree = agree
+        self.disagree = disagree
+        # share of votes that agreed with the reviews, smoothed so that a handful of votes stays near 1/2
+        self.helpfulness = (agree + 1.0) / (agree + disagree + 2)
+        self.activity = activity
+
+    @staticmethod
+    def decayed(activity, since):
+        """SQL for an activity score recorded at since, decayed to now"""
+        seconds = ACTIVITY_HALF_LIFE * 24 * 60 * 60 / math.log(2)
+        # exp underflows to an error rather than to 0 in postgres
+        return '{} * exp(GREATEST(extract(epoch FROM {} - now()) / {}, -700))'.format(activity, since, seconds)
+
+    @staticmethod
+    def add(deltas):
+        """
+        Applies changes to the stats of courses, teachers and their pairs in one statement
+
+        :param deltas: list of (c_id, teacher uni, reviews, sentiment, agree, disagree, activity) changes
+        """
+        if not deltas:
+            return
+
+        def upsert(kind):
+            table, key = ReviewStats.TABLES[kind]
+            return '''
+                INSERT INTO {table} AS s ({key}, reviews, sentiment_sum, agree, disagree, activity, activity_at)
+                SELECT {key}, sum(reviews), sum(sentiment), sum(agree), sum(disagree), sum(activity), now()
+                FROM d GROUP BY {key} ORDER BY {key}
+                ON CONFLICT ({key}) DO UPDATE SET
+                    reviews = s.reviews + EXCLUDED.reviews,
+                    sentiment_sum = s.sentiment_sum + EXCLUDED.sentiment_sum,
+                    agree = s.agree + EXCLUDED.agree,
+                    disagree = s.disagree + EXCLUDED.disagree,
+                    activity = {activity} + EXCLUDED.activity,
+                    activity_at = EXCLUDED.activity_at
+            '''.format(table=table, key=', '.join(key), activity=ReviewStats.decayed('s.activity', 's.activity_at'))
+
+        values = ', '.join(['(%s, %s, %s::int, %s::float8, %s::int, %s::int, %s::float8)'] * len(deltas))
+        execute('''
+            WITH d (c_id, uni, reviews, sentiment, agree, disagree, activity) AS (VALUES {}),
+            course AS ({}),
+            teacher AS ({})
+            {}
+        '''.format(values, upsert('course'), upsert('teacher'), upsert('course_teacher')),
+                tuple(v for delta in deltas for v in delta))
+
+    @staticmethod
+    def find(kind, *key):
+        """
+        :param kind: 'course', 'teacher' or 'course_teacher'
+        :param key: c_id, uni or both
+        :return: ReviewStats, None when nothing was reviewed yet
+        """
+        table, columns = ReviewStats.TABLES[kind]
+        cur = read('''
+            SELECT reviews, sentiment_sum, agree, disagree, {}
+            FROM {} s WHERE ({}) = ({})
+        '''.format(ReviewStats.decayed('s.activity', 's.activity_at'), table,
+                   ', '.join(columns), ', '.join(['%s'] * len(columns))), key)
+
+        row = cur.fetchone()
+        cur.close()
+        return ReviewStats(*row) if row else None
+
+    @staticmethod
+    def for_teacher_courses(uni):
+        """
+        :return: dict of c_id to the ReviewStats of each course as taught by the teacher
+        """
+        cur = read('''
+            SELECT c_id, reviews, sentiment_sum, agree, disagree, {}
+            FROM course_teacher_stats s WHERE uni = %s
+        '''.format(ReviewStats.decayed('s.activity', 's.activity_at')), (uni,))
+        return {row[0]: ReviewStats(*row[1:]) for row in cur}
+
+    @staticmethod
+    def top_courses(did, ranking='rating', limit=10):
+        """
+        Best courses of a department by one of RANKINGS
+
+        :return: list of (Course, ReviewStats)
+        """
+        activity = ReviewStats.decayed('s.activity', 's.activity_at')
+        order = ReviewStats.RANKINGS[ranking] or activity
+        cur = read('''
+            SELECT {}, s.reviews, s.sentiment_sum, s.agree, s.disagree, {}
+            FROM course_department cd
+            JOIN course_stats s ON s.c_id = cd.c_id
+            JOIN courses c ON c.c_id = cd.c_id
+            WHERE cd.d_id = %s AND s.reviews > 0
+            ORDER BY {} DESC, c.name ASC
+            LIMIT %s
+        '''.format(', '.join('c.' + field for field in Course.LISTING), activity, order), (did, limit))
+        columns = len(Course.LISTING)
+        return [(Course(*row[:columns]), ReviewStats(*row[columns:])) for row in cur]
+
+    @staticmethod
+    def rebuild():
+        """
+        Recomputes every stats row from reviews and votes. Writers wait on the table locks
+        until it commits and then apply their changes on top, so nothing is lost.
+
+        :return: number of (course, teacher) pairs
+        """
+        with transaction():
+            execute('LOCK TABLE course_stats, teacher_stats, course_teacher_stats IN EXCLUSIVE MODE')
+            execute('''
+                CREATE TEMP TABLE stats_rebuild ON COMMIT DROP AS
+                SELECT r.c_id, r.teacher_uni AS uni, count(*) AS reviews,
+                       sum(r.sentiment_score) AS sentiment_sum, sum(r.agree) AS agree, sum(r.disagree) AS disagree,
+                       sum({} + COALESCE(va.activity, 0)) AS activity
+                FROM reviews r
+                LEFT JOIN (SELECT r_id, sum({}) AS activity FROM votes GROUP BY r_id) va ON va.r_id = r.r_id
+                GROUP BY r.c_id, r.teacher_uni
+            '''.format(ReviewStats.decayed('1', 'r.written_on'), ReviewStats.decayed('1', 'voted_on')))
+
+            for kind in ('course', 'teacher', 'course_teacher'):
+                table, key = ReviewStats.TABLES[kind]
+                execute('DELETE FROM {}'.format(table))
+                cur = execute('''
+                    INSERT INTO {table} ({key}, reviews, sentiment_sum, agree, disagree, activity, activity_at)
+                    SELECT {key}, sum(reviews), sum(sentiment_sum), sum(agree), sum(disagree), sum(activity), now()
+                    FROM stats_rebuild GROUP BY {key}
+                '''.format(table=table, key=', '.join(key)))
+
+        return cur.rowcount
+
+
 class Department(object):
+    __slots__ = ('did', 'name', 'abbrev')
+
     def __init__(self, did, name, abbrev):
         self.did = did
         self.name = name
         self.abbrev = abbrev
 
     def save(self):
-        db.engine.execute('INSERT INTO departments VALUES (%s, %s)', (self.did, self.name, self.abbrev))
+        execute('INSERT INTO departments VALUES (%s, %s, %s)', (self.did, self.name, self.abbrev))
+        cache.delete('department:{}'.format(self.did), 'departments')
+        touch('department', self.did)
+        touch('departments', 'all')
+        directory.invalidate()
 
-    def get_courses(self):
-        cur = db.engine.execute('''SELECT c.* FROM courses c, course_department d 
-                                   WHERE c.c_id = d.c_id AND d.d_id = %s
-                                ''', (self.did, ))
+    def get_courses(self, fields=None):
+        """
+        :param fields: Course.COLUMNS to load, Course.LISTING by default
+        """
+        fields = projection(Course.COLUMNS, fields or Course.LISTING)
+        rows = cached_rows('department:{}:courses:{}'.format(self.did, ','.join(fields)),
+                           '''SELECT {} FROM courses c, course_department d
+                              WHERE c.c_id = d.c_id AND d.d_id = %s
+                           '''.format(', '.join('c.' + field for field in fields)), (self.did, ))
 
-        if cur.rowcount == 0:
+        if not rows:
             return None
 
-        return Course.courses_generator(cur)
+        return Course.from_rows(fields, rows)
 
     def get_teachers(self):
-        cur = db.engine.execute(
+        rows = cached_rows(
+            'department:{}:teachers'.format(self.did),
             ''' SELECT t.uni, t.name 
                 FROM teachers t, teachers_department d
                 WHERE d.d_id = %s AND t.uni = d.uni
                 ORDER BY t.name ASC
             ''', (self.did,))
 
-        if cur.rowcount == 0:
+        if not rows:
             return None
-        return Teacher.teacher_generator(cur)
+        return (Teacher(*row) for row in rows)
+
+    def get_top_courses(self, ranking='rating', limit=10):
+        return ReviewStats.top_courses(self.did, ranking, limit)
 
     @staticmethod
     def department_generator(cur):
@@ -212,8 +732,11 @@ class Department(object):
 
     @staticmethod
     def find(val, field='d_id'):
-        query = 'SELECT * FROM departments WHERE {} = %s'.format(field)
-        cur = db.engine.execute(query, (val,))
+        if field == 'd_id':
+            rows = cached_statement('department:{}'.format(val), 'department', (val,), 'd_id')
+            return (Department(*row) for row in rows) if rows else None
+
+        cur = statements.execute('department', (val,), field)
 
         if cur.rowcount == 0:
             return None
@@ -222,16 +745,16 @@ class Department(object):
 
     @staticmethod
     def find_all():
-        cur = db.engine.execute('SELECT * FROM departments')
+        rows = cached_rows('departments', 'SELECT * FROM departments')
 
-        if cur.rowcount == 0:
+        if not rows:
             return None
 
-        return Department.department_generator(cur)
+        return (Department(*row) for row in rows)
 
     @staticmethod
     def search(query):
-        cur = db.engine.execute('SELECT * FROM departments WHERE LOWER(name) LIKE LOWER(%s)', (query,)
+        cur = read('SELECT * FROM departments WHERE LOWER(name) LIKE LOWER(%s)', (query,)
                                 )
         if cur.rowcount == 0:
             return None
@@ -240,6 +763,8 @@ class Department(object):
 
 
 class Teacher(object):
+    __slots__ = ('uni', 'name', 'departments', 'courses')
+
     def __init__(self, uni, name, departments=None, courses=None):
         """
 
@@ -254,29 +779,55 @@ class Teacher(object):
         self.courses = courses
 
     def save(self):
-        # insert teacher
-        db.engine.execute('INSERT INTO teachers VALUES (%s, %s)', (self.uni, self.name))
-
-        # insert teacher department relationships
-        for did in self.departments:
-            db.engine.execute('INSERT INTO teachers_department VALUES (%s, %s)', (self.uni, did))
-
-    def get_courses(self):
+        with transaction():
+            # insert teacher
+            execute('INSERT INTO teachers VALUES (%s, %s)', (self.uni, self.name))
+
+            # insert teacher department relationships
+            executemany('INSERT INTO teachers_department VALUES (%s, %s)',
+                        [(self.uni, did) for did in self.departments or []])
+
+        cache.delete('teacher:{}'.format(self.uni),
+                     'teacher:{}:departments'.format(self.uni),
+                     *['department:{}:teachers'.format(did) for did in self.departments or []])
+        suggestions.add_teacher(self.uni, self.name)
+        touch('teacher', self.uni)
+        for did in self.departments or []:
+            touch('department', did)
+        directory.invalidate()
+
+    def get_courses(self, fields=None):
+        """
+        :param fields: Course.COLUMNS to load, Course.LISTING by default
+        """
         # TODO: Did not account for the fact that teachers can teach the same class in different semesters
 
         if not self.courses:
-            cur = db.engine.execute('SELECT t.c_id FROM teaches t WHERE t.uni = %s', (self.uni, ))
-            self.courses = [next(Course.find(cid)) for (cid,) in cur]
+            fields = projection(Course.COLUMNS, fields or Course.LISTING)
+            rows = cached_rows('teacher:{}:courses:{}'.format(self.uni, ','.join(fields)),
+                               'SELECT DISTINCT {} FROM courses c, teaches t WHERE c.c_id = t.c_id AND t.uni = %s'
+                               .format(', '.join('c.' + field for field in fields)),
+                               (self.uni, ))
+            self.courses = list(Course.from_rows(fields, rows))
 
         return self.courses
 
-    def get_reviews(self):
-        return Review.find(self.uni, 'teacher_uni')
+    def get_reviews(self, before=None, limit=None):
+        return Review.find(self.uni, 'teacher_uni', before, limit)
+
+    def get_stats(self):
+        return ReviewStats.find('teacher', self.uni)
+
+    def get_course_stats(self):
+        return ReviewStats.for_teacher_courses(self.uni)
 
     def get_departments(self):
         if not self.departments:
-            cur = db.engine.execute('SELECT td.d_id FROM teachers_department td WHERE td.uni = %s', (self.uni,))
-            self.departments = [next(Department.find(did)) for (did,) in cur]
+            rows = cached_rows('teacher:{}:departments'.format(self.uni),
+                               '''SELECT d.* FROM departments d, teachers_department td
+                                  WHERE d.d_id = td.d_id AND td.uni = %s
+                               ''', (self.uni,))
+            self.departments = [Department(*row) for row in rows]
         return self.departments
 
     @staticmethod
@@ -287,18 +838,43 @@ class Teacher(object):
         cur.close()
 
     @staticmethod
-    def search(query):
-        cur = db.engine.execute('SELECT * FROM teachers WHERE LOWER(name) LIKE %s OR LOWER(uni) LIKE %s', (query, query))
+    def search(query, limit=20, offset=0):
+        """
+        Ranked teacher search on name and uni using the indexes from migrations/003_search_indexes.sql.
+        Every term matches as a prefix and misspelled names still match by trigram word similarity.
+        """
+        query_terms = terms(query)
+        if not query_terms:
+            return None
+
+        cur = read('''
+            SELECT t.uni, t.name
+            FROM teachers t
+            WHERE to_tsvector('simple', coalesce(t.name, '') || ' ' || t.uni) @@ to_tsquery('simple', %(tsquery)s)
+               OR %(text)s <%% lower(t.name)
+            ORDER BY ts_rank(to_tsvector('simple', coalesce(t.name, '') || ' ' || t.uni),
+                             to_tsquery('simple', %(tsquery)s)) DESC,
+                     word_similarity(%(text)s, lower(t.name)) DESC,
+                     t.name ASC
+            LIMIT %(limit)s OFFSET %(offset)s
+        ''', {'tsquery': prefix_tsquery(query_terms), 'text': ' '.join(query_terms), 'limit': limit, 'offset': offset})
 
         if cur.rowcount == 0:
             return None
         return Teacher.teacher_generator(cur)
 
+    @staticmethod
+    def find_all():
+        """Every teacher, streamed from a server-side cursor"""
+        return Teacher.teacher_generator(read_stream('SELECT uni, name FROM teachers'))
+
     @staticmethod
     def find(val, field='uni'):
-        query = 'SELECT * FROM teachers WHERE {} = %s'.format(field)
+        if field == 'uni':
+            rows = cached_statement('teacher:{}'.format(val), 'teacher', (val,), 'uni')
+            return (Teacher(*row) for row in rows) if rows else None
 
-        cur = db.engine.execute(query, (val,))
+        cur = statements.execute('teacher', (val,), field)
 
         if cur.rowcount == 0:
             return None
@@ -307,71 +883,96 @@ class Teacher(object):
 
 
 class Course(object):
-    def __init__(self, c_id, name, abbrev, views, departments=None, teachers=None):
+    __slots__ = ('c_id', 'name', 'abbrev', 'views', 'departments', 'teachers', 'reviews')
+
+    # columns of courses, in table order
+    COLUMNS = ('c_id', 'name', 'abbrev', 'views')
+    # what listings of courses show, leaving out the views array
+    LISTING = ('c_id', 'name', 'abbrev')
+
+    def __init__(self, c_id, name=None, abbrev=None, views=None, departments=None, teachers=None):
+        """
+
+        :param departments: a Department or list of them
+        :param teachers: a Teacher or list of them
+        """
         self.c_id = c_id
         self.name = name
         self.abbrev = abbrev
         self.views = views
-        self.departments = []
-        self.teachers = []
+        self.departments = departments if isinstance(departments, list) else [departments] if departments else []
+        self.teachers = teachers if isinstance(teachers, list) else [teachers] if teachers else []
         self.reviews = []
 
-        if type(departments) == list:
-            for d in departments:
-                if type(d) != Department:
-                    raise TypeError('input list departments must all be of type Department')
-
-            self.departments = departments
-        elif type(departments) == Department:
-            self.departments.append(departments)
-        elif departments:
-            # allow for departments to be None
-            raise TypeError('input departments must be of type Department or list of Department')
-
-        if type(teachers) == list:
-            for t in teachers:
-                if type(t) != Teacher:
-                    raise TypeError('input list teachers must all be of type Teacher')
-
-            self.teachers = teachers
-        elif type(teachers) == Teacher:
-            self.teachers.append(teachers)
-        elif teachers:
-            # allow for teachers to be None
-            raise TypeError('input teachers must be of type Teacher or list of Teacher')
-
     def get_departments(self):
         if not self.departments:
-            cur = db.engine.execute('SELECT cd.d_id FROM course_department cd WHERE cd.c_id = %s', (self.c_id, ))
-            self.departments = [next(Department.find(did)) for (did,) in cur]
+            rows = cached_rows('course:{}:departments'.format(self.c_id),
+                               '''SELECT d.* FROM departments d, course_department cd
+                                  WHERE d.d_id = cd.d_id AND cd.c_id = %s
+                               ''', (self.c_id, ))
+            self.departments = [Department(*row) for row in rows]
         return self.departments
 
     def get_teachers(self):
         if not self.teachers:
-            cur = db.engine.execute('SELECT ts.uni FROM teaches ts WHERE ts.c_id = %s ', (self.c_id,))
-            self.teachers = [next(Teacher.find(uni)) for (uni,) in cur]
-            cur.close()
+            rows = cached_rows('course:{}:teachers'.format(self.c_id),
+                               'SELECT DISTINCT t.* FROM teachers t, teaches ts WHERE t.uni = ts.uni AND ts.c_id = %s',
+                               (self.c_id,))
+            self.teachers = [Teacher(*row) for row in rows]
         return self.teachers
 
-    def get_reviews(self):
-        return Review.find(self.c_id, 'c_id')
+    def get_reviews(self, before=None, limit=None):
+        return Review.find(self.c_id, 'c_id', before, limit)
+
+    def get_stats(self):
+        return ReviewStats.find('course', self.c_id)
 
     def add_view(self):
-        db.engine.execute('UPDATE courses SET views = array_append(views, %s) WHERE c_id = %s',
-                          (str(datetime.now()), self.c_id))
+        # buffered and written by a background thread, see ViewBuffer
+        view_buffer.add(self.c_id)
+        trending.add(self.c_id, 'view')
+
+    @staticmethod
+    def record_views(rows):
+        """
+        Appends aggregated view counts to course_views in one multi-row insert
+
+        :param rows: list of (c_id, hour, views)
+        """
+        values = ', '.join(['(%s, %s, %s)'] * len(rows))
+        params = tuple(v for row in rows for v in row)
+        execute('INSERT INTO course_views (c_id, hour, views) VALUES ' + values, params)
 
     @staticmethod
     def courses_generator(cur):
-        for (c_id, name, abbrev, views) in cur:
-            yield Course(c_id, name, abbrev, views)
+        for row in cur:
+            yield Course(*row)
 
         cur.close()
 
+    @staticmethod
+    def from_rows(fields, rows):
+        """Courses from rows holding the given columns, which are also the argument names of Course"""
+        for row in rows:
+            yield Course(**dict(zip(fields, row)))
+
+    @staticmethod
+    def find_all(fields=None):
+        """
+        Every course, streamed from a server-side cursor
+
+        :param fields: COLUMNS to load, all of them by default
+        """
+        fields = projection(Course.COLUMNS, fields)
+        return Course.from_rows(fields, read_stream('SELECT {} FROM courses'.format(', '.join(fields))))
+
     @staticmethod
     def find(val, field='c_id'):
-        query = 'SELECT * FROM courses WHERE {} = %s'.format(field)
+        if field == 'c_id':
+            rows = cached_statement('course:{}'.format(val), 'course', (val,), 'c_id')
+            return (Course(*row) for row in rows) if rows else None
 
-        cur = db.engine.execute(query, (val,))
+        cur = statements.execute('course', (val,), field)
 
         if cur.rowcount == 0:
             return None
@@ -380,15 +981,34 @@ class Course(object):
 
 
     @staticmethod
-    def search(query):
-        cur = db.engine.execute(
-            '''SELECT c.*
-               FROM courses c, course_department d
-               WHERE LOWER(c.name) LIKE LOWER(%s)
-               AND c.c_id = d.c_id
-               ORDER BY d.d_id, c.name ASC 
-               ''', (query,))
+    def search(query, limit=20, offset=0, fields=None):
+        """
+        Ranked course search on name and abbreviation using the indexes from
+        migrations/003_search_indexes.sql. Every term matches as a prefix and misspelled
+        names still match by trigram word similarity, which compares the query with the
+        closest run of words in the name rather than with the whole name.
+
+        :param fields: COLUMNS to load, LISTING by default
+        """
+        fields = projection(Course.COLUMNS, fields or Course.LISTING)
+        query_terms = terms(query)
+        if not query_terms:
+            return None
+
+        cur = read(
+            '''SELECT {}
+               FROM courses c
+               WHERE to_tsvector('simple', coalesce(c.name, '') || ' ' || coalesce(c.abbrev, ''))
+                     @@ to_tsquery('simple', %(tsquery)s)
+                  OR %(text)s <%% lower(c.name)
+               ORDER BY ts_rank(to_tsvector('simple', coalesce(c.name, '') || ' ' || coalesce(c.abbrev, '')),
+                                to_tsquery('simple', %(tsquery)s)) DESC,
+                        word_similarity(%(text)s, lower(c.name)) DESC,
+                        c.name ASC
+               LIMIT %(limit)s OFFSET %(offset)s
+               '''.format(', '.join('c.' + field for field in fields)),
+            {'tsquery': prefix_tsquery(query_terms), 'text': ' '.join(query_terms), 'limit': limit, 'offset': offset})
         if cur.rowcount == 0:
             return None
 
-        return Course.courses_generator(cur)
+        return Course.from_rows(fields, cur)
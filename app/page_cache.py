@@ -0,0 +1,83 @@
+from datetime import datetime
+
+from flask import make_response, request, session
+from flask_login import current_user
+
+from . import cache, statements
+from .database import execute, primary_reads
+
+
+def version(kind, ident):
+    """
+    Timestamp of the last change to an entity, or to every entity of its kind (see
+    touch_all), 0 if neither ever changed. Used to key and validate its cached pages.
+    Versions are kept in the cache_versions table rather than in the cache, so a touch in
+    one worker reaches every other one whatever the CACHE_BACKEND, and an ETag stays the
+    same until the entity changes.
+    """
+    return statements.execute('cache_version', (kind, str(ident))).scalar() or 0
+
+
+def touch(kind, ident):
+    """Marks an entity as changed so every cached page and fragment of it is re-rendered"""
+    # never backwards, even if the database clock is set back
+    execute('''
+        INSERT INTO cache_versions AS v (kind, ident, version)
+        VALUES (%s, %s, extract(epoch FROM clock_timestamp()))
+        ON CONFLICT (kind, ident) DO UPDATE SET version = GREATEST(EXCLUDED.version, v.version + 0.001)
+    ''', (kind, str(ident)))
+
+
+def touch_all(*kinds):
+    """Marks every entity of each of kinds as changed, e.g. after a catalog import"""
+    for kind in kinds:
+        touch(kind, '*')
+
+
+def cached_fragment(name, kind, ident, render):
+    """
+    Returns the result of render, shared by every visitor and recomputed only when the
+    entity's version changes. Fragments must not contain anything user specific.
+    """
+    key = 'fragment:{}:{}:{}:{}'.format(name, kind, ident, version(kind, ident))
+    return cache.get_or_set(key, lambda: _render_from_primary(render))
+
+
+def cached_page(kind, ident, render):
+    """
+    Serves a whole page from the cache for anonymous visitors, who all see the same
+    HTML, with an ETag and Last-Modified so that revisits can be answered with a 304.
+    Logged in visitors and pages with pending flash messages are always rendered.
+    """
+    if request.method != 'GET' or current_user.is_authenticated or session.get('_flashes'):
+        return render()
+
+    v = version(kind, ident)
+    etag = '{}-{}-{!r}'.format(kind, ident, v)
+    last_modified = datetime.utcfromtimestamp(int(v)) if v else None
+
+    # If-Modified-Since only counts without If-None-Match, and dates have whole seconds
+    if request.if_none_match:
+        not_modified = request.if_none_match.contains(etag)
+    else:
+        since = request.if_modified_since
+        not_modified = since is not None and last_modified is not None and since >= last_modified
+
+    if not_modified:
+        response = make_response('', 304)
+    else:
+        response = make_response(cache.get_or_set('page:{}:{}:{!r}'.format(kind, ident, v),
+                                                  lambda: _render_from_primary(render)))
+
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.cache_control.no_cache = True
+    response.vary.add('Cookie')
+    return response
+
+
+def _render_from_primary(render):
+    # what is cached under a version must be at least as new as the version
+    with primary_reads():
+        return render()
@@ -0,0 +1,107 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from .ratelimit import RateLimited
+
+
+class PasswordHasher(object):
+    """
+    Hashes and checks passwords in a pool of PASSWORD_WORKERS processes, so that a rush
+    of logins takes at most that many cores and request threads only wait on the result.
+    With PASSWORD_WORKERS = 0 the work is done in the request thread.
+
+    At most PASSWORD_QUEUE_SIZE hashes are queued or running per app process. A request
+    that finds the queue full for PASSWORD_QUEUE_TIMEOUT seconds gets a 429.
+
+    PASSWORD_HASH_METHOD and PASSWORD_SALT_LENGTH are passed to werkzeug's
+    generate_password_hash. The method includes the iteration count, as in
+    'pbkdf2:sha256:50000', so that stored hashes can be compared with it and those made
+    with other settings rehashed at the next login.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._pool = None
+        self._pool_pid = None
+        self._slots = None
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.rejected = 0
+        self.rehashed = 0
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:50000')
+        app.config.setdefault('PASSWORD_SALT_LENGTH', 8)
+        app.config.setdefault('PASSWORD_WORKERS', 2)
+        app.config.setdefault('PASSWORD_QUEUE_SIZE', 32)
+        app.config.setdefault('PASSWORD_QUEUE_TIMEOUT', 1)
+        self._slots = threading.BoundedSemaphore(app.config['PASSWORD_QUEUE_SIZE'])
+        self.app = app
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password,
+                         self.app.config['PASSWORD_HASH_METHOD'], self.app.config['PASSWORD_SALT_LENGTH'])
+
+    def verify(self, password_hash, password):
+        return self._run(check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        """Whether password_hash was made with another method or salt length than the configured ones"""
+        method, _, rest = password_hash.partition('$')
+        salt = rest.partition('$')[0]
+        return (method != self.app.config['PASSWORD_HASH_METHOD']
+                or len(salt) != self.app.config['PASSWORD_SALT_LENGTH'])
+
+    def stats(self):
+        return {
+            'workers': self.app.config['PASSWORD_WORKERS'],
+            'queued': self.queued,
+            'rejected': self.rejected,
+            'rehashed': self.rehashed,
+        }
+
+    def _run(self, fn, *args):
+        if not self.app.config['PASSWORD_WORKERS']:
+            return fn(*args)
+
+        if not self._slots.acquire(timeout=self.app.config['PASSWORD_QUEUE_TIMEOUT']):
+            with self._lock:
+                self.rejected += 1
+            raise RateLimited(1, 'Too many sign-ins at once, please try again in a moment.')
+
+        with self._lock:
+            self.queued += 1
+        try:
+            future = self._executor().submit(fn, *args)
+        except Exception:
+            self._done()
+            raise
+        # the slot is freed when the hash is done, even if the waiting request gave up on it
+        future.add_done_callback(self._done)
+        return future.result()
+
+    def _done(self, future=None):
+        with self._lock:
+            self.queued -= 1
+        self._slots.release()
+
+    def _executor(self):
+        # worker processes are not inherited over a fork, so each app process starts its own pool
+        if self._pool_pid == os.getpid():
+            return self._pool
+
+        with self._lock:
+            if self._pool_pid != os.getpid():
+                # forked from a process whose other threads may hold locks, a child could
+                # deadlock on one of them; the forkserver forks from a clean process instead
+                self._pool = ProcessPoolExecutor(self.app.config['PASSWORD_WORKERS'],
+                                                 mp_context=multiprocessing.get_context('forkserver'))
+                self._pool_pid = os.getpid()
+        return self._pool
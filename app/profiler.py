@@ -0,0 +1,239 @@
+import heapq
+import hmac
+import math
+import threading
+import time
+from collections import defaultdict, deque
+
+from flask import Response, abort, g, has_request_context, jsonify, request, signals_available
+from flask import before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# samples per endpoint used to spot query counts that grow with the size of the result
+GROWTH_SAMPLES = 50
+GROWTH_MIN_SAMPLES = 10
+GROWTH_CORRELATION = 0.9
+
+
+def _correlation(xs, ys):
+    n = len(xs)
+    mean_x = sum(xs) / n
+    mean_y = sum(ys) / n
+    cov = sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys))
+    var_x = sum((x - mean_x) ** 2 for x in xs)
+    var_y = sum((y - mean_y) ** 2 for y in ys)
+    if not var_x or not var_y:
+        return 0.0
+    return cov / math.sqrt(var_x * var_y)
+
+
+class EndpointStats(object):
+    def __init__(self):
+        self.requests = 0
+        self.queries = 0
+        self.db_time = 0.0
+        self.render_time = 0.0
+        self.request_time = 0.0
+        # (rows fetched, queries issued) of recent requests
+        self.samples = deque(maxlen=GROWTH_SAMPLES)
+        self.query_growth = False
+
+    def check_query_growth(self):
+        """
+        Flags the endpoint when its query count rises with the number of rows it fetches,
+        which is what an N+1 pattern looks like from the outside
+        """
+        if len(self.samples) < GROWTH_MIN_SAMPLES:
+            return False
+        rows, queries = zip(*self.samples)
+        self.query_growth = max(queries) > min(queries) and _correlation(rows, queries) >= GROWTH_CORRELATION
+        return self.query_growth
+
+
+class Profiler(object):
+    """
+    Records, for every request, how many SQL statements were run, how long they took,
+    how many rows they returned and how long templates took to render, aggregated by endpoint.
+
+    With PROFILER_HEADERS (on in debug) the numbers of each request are sent back as
+    X-DB-* response headers and the slowest statements are listed at /debug/queries.
+    With PROFILER_METRICS the aggregates are served at /metrics in Prometheus text format.
+
+    Both endpoints answer only requests with an "Authorization: Bearer <PROFILER_TOKEN>"
+    header, or, when no PROFILER_TOKEN is set, requests from PROFILER_ALLOWED_IPS.
+    """
+
+    _engine_hooked = False
+
+    def __init__(self, app=None):
+        self.app = None
+        self.endpoints = defaultdict(EndpointStats)
+        self.slowest = []
+        self.collectors = {}
+        self._lock = threading.Lock()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('PROFILER_HEADERS', app.debug)
+        app.config.setdefault('PROFILER_METRICS', True)
+        app.config.setdefault('PROFILER_SLOWEST_QUERIES', 20)
+        app.config.setdefault('PROFILER_SLOW_QUERY_TIME', 0.25)
+        app.config.setdefault('PROFILER_TOKEN', None)
+        app.config.setdefault('PROFILER_ALLOWED_IPS', ('127.0.0.1', '::1'))
+        self.app = app
+
+        if not Profiler._engine_hooked:
+            event.listen(Engine, 'before_cursor_execute', self._before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', self._after_cursor_execute)
+            Profiler._engine_hooked = True
+
+        # render times need blinker (in requirements.txt), flask only sends signals when it is installed
+        if signals_available:
+            before_render_template.connect(self._before_render, app)
+            template_rendered.connect(self._after_render, app)
+
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+
+        if app.config['PROFILER_METRICS']:
+            app.add_url_rule('/metrics', 'metrics', self.metrics)
+        if app.config['PROFILER_HEADERS']:
+            app.add_url_rule('/debug/queries', 'debug_queries', self.debug_queries)
+
+    def add_collector(self, prefix, collect):
+        """
+        Adds gauges to /metrics
+
+        :param collect: callable returning a dict of name to number, exported as culpa_<prefix>_<name>
+        """
+        self.collectors[prefix] = collect
+
+    def _start_request(self):
+        g._profile = {'start': time.perf_counter(), 'queries': 0, 'rows': 0, 'db_time': 0.0,
+                      'render_time': 0.0, 'render_depth': 0}
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['query_start'].pop()
+        if not has_request_context() or '_profile' not in g:
+            return
+
+        profile = g._profile
+        profile['queries'] += 1
+        profile['db_time'] += elapsed
+        profile['rows'] += max(cursor.rowcount, 0)
+
+        entry = (elapsed, request.endpoint or 'unknown', statement.strip(), repr(parameters)[:500])
+        with self._lock:
+            if len(self.slowest) < self.app.config['PROFILER_SLOWEST_QUERIES']:
+                heapq.heappush(self.slowest, entry)
+            elif elapsed > self.slowest[0][0]:
+                heapq.heapreplace(self.slowest, entry)
+
+        if elapsed > self.app.config['PROFILER_SLOW_QUERY_TIME']:
+            self.app.logger.warning('slow query (%.3fs) in %s: %s %s', *entry)
+
+    def _before_render(self, app, template, context):
+        if has_request_context() and '_profile' in g:
+            profile = g._profile
+            # fragments render inside pages, only time the outermost template
+            if profile['render_depth'] == 0:
+                profile['render_start'] = time.perf_counter()
+            profile['render_depth'] += 1
+
+    def _after_render(self, app, template, context):
+        if has_request_context() and '_profile' in g:
+            profile = g._profile
+            profile['render_depth'] -= 1
+            if profile['render_depth'] == 0:
+                profile['render_time'] += time.perf_counter() - profile['render_start']
+
+    def _finish_request(self, response):
+        profile = g.pop('_profile', None)
+        if profile is None:
+            return response
+
+        request_time = time.perf_counter() - profile['start']
+        endpoint = request.endpoint or 'unknown'
+        with self._lock:
+            stats = self.endpoints[endpoint]
+            stats.requests += 1
+            stats.queries += profile['queries']
+            stats.db_time += profile['db_time']
+            stats.render_time += profile['render_time']
+            stats.request_time += request_time
+            stats.samples.append((profile['rows'], profile['queries']))
+            flagged_before = stats.query_growth
+            flagged = stats.check_query_growth()
+
+        if flagged and not flagged_before:
+            self.app.logger.warning('query count of %s grows with the number of rows it fetches, '
+                                    'likely an N+1 query pattern', endpoint)
+
+        if self.app.config['PROFILER_HEADERS']:
+            response.headers['X-DB-Queries'] = str(profile['queries'])
+            response.headers['X-DB-Rows'] = str(profile['rows'])
+            response.headers['X-DB-Time'] = '{:.2f}ms'.format(profile['db_time'] * 1000)
+            response.headers['X-Render-Time'] = '{:.2f}ms'.format(profile['render_time'] * 1000)
+            response.headers['X-Request-Time'] = '{:.2f}ms'.format(request_time * 1000)
+        return response
+
+    def metrics(self):
+        self._require_access()
+        lines = []
+
+        def family(name, kind, help_text, values):
+            lines.append('# HELP culpa_{} {}'.format(name, help_text))
+            lines.append('# TYPE culpa_{} {}'.format(name, kind))
+            for endpoint, value in values:
+                lines.append('culpa_{}{{endpoint="{}"}} {}'.format(name, endpoint, value))
+
+        with self._lock:
+            endpoints = sorted(self.endpoints.items())
+            family('requests_total', 'counter', 'Requests handled.',
+                   [(e, s.requests) for e, s in endpoints])
+            family('db_queries_total', 'counter', 'SQL statements executed.',
+                   [(e, s.queries) for e, s in endpoints])
+            family('db_seconds_total', 'counter', 'Time spent in SQL statements.',
+                   [(e, '{:.6f}'.format(s.db_time)) for e, s in endpoints])
+            family('render_seconds_total', 'counter', 'Time spent rendering templates.',
+                   [(e, '{:.6f}'.format(s.render_time)) for e, s in endpoints])
+            family('request_seconds_total', 'counter', 'Time spent handling requests.',
+                   [(e, '{:.6f}'.format(s.request_time)) for e, s in endpoints])
+            family('query_growth_suspected', 'gauge', '1 if the query count grows with the result size.',
+                   [(e, int(s.query_growth)) for e, s in endpoints])
+
+        for prefix, collect in sorted(self.collectors.items()):
+            for name, value in sorted(collect().items()):
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    lines.append('# TYPE culpa_{}_{} gauge'.format(prefix, name))
+                    lines.append('culpa_{}_{} {}'.format(prefix, name, value))
+
+        return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
+
+    def debug_queries(self):
+        self._require_access()
+        with self._lock:
+            slowest = sorted(self.slowest, reverse=True)
+        return jsonify(
+            {
+                'slowest': [
+                    {'seconds': round(elapsed, 6), 'endpoint': endpoint, 'statement': statement, 'parameters': params}
+                    for elapsed, endpoint, statement, params in slowest
+                ]
+            }
+        )
+
+    def _require_access(self):
+        token = self.app.config['PROFILER_TOKEN']
+        if token:
+            supplied = request.headers.get('Authorization', '')
+            if not hmac.compare_digest(supplied.encode(), 'Bearer {}'.format(token).encode()):
+                abort(403)
+        elif request.remote_addr not in self.app.config['PROFILER_ALLOWED_IPS']:
+            abort(403)
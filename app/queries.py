@@ -0,0 +1,176 @@
+import re
+import threading
+import time
+from collections import namedtuple
+
+from .database import get_connection
+
+Statement = namedtuple('Statement', 'sql fields replica')
+
+REVIEW_COLUMNS = '''
+    SELECT r_id, c_id, uni, teacher_uni, general_content, workload_content,
+           sentiment_score, written_on, agree, disagree
+    FROM reviews
+'''
+REVIEW_DETAILS_COLUMNS = '''
+    SELECT r.r_id, r.c_id, r.uni, r.teacher_uni, r.general_content, r.workload_content,
+           r.sentiment_score, r.written_on, t.name, c.name, r.agree, r.disagree
+    FROM reviews r
+    LEFT JOIN teachers t ON t.uni = r.teacher_uni
+    LEFT JOIN courses c ON c.c_id = r.c_id
+'''
+# newest first, a NULL limit means no limit. The _before variants continue after a
+# (written_on, r_id) keyset, which keeps every page as cheap as the first one
+PAGE = 'ORDER BY {0}written_on DESC, {0}r_id DESC LIMIT %s'
+BEFORE = 'AND ({0}written_on, {0}r_id) < (%s, %s) '
+
+# name: Statement. {field} in the sql is replaced by each of fields, which makes one
+# statement per field, named <name>_by_<field>. Statements with replica set may be
+# answered by a read replica.
+STATEMENTS = {
+    'user': Statement(
+        'SELECT uni, name, year, password_hash, school, num_reviews FROM users WHERE {field} = %s',
+        ('uni',), False),
+    'user_profile': Statement(
+        'SELECT uni, name, year, school, num_reviews FROM users WHERE uni = %s',
+        None, False),
+    'course': Statement(
+        'SELECT c_id, name, abbrev FROM courses WHERE {field} = %s',
+        ('c_id', 'name', 'abbrev'), True),
+    'teacher': Statement(
+        'SELECT uni, name FROM teachers WHERE {field} = %s',
+        ('uni', 'name'), True),
+    'department': Statement(
+        'SELECT d_id, name, abbrev FROM departments WHERE {field} = %s',
+        ('d_id', 'name', 'abbrev'), True),
+    'reviews': Statement(
+        REVIEW_COLUMNS + 'WHERE {field} = %s ' + PAGE.format(''),
+        ('r_id', 'c_id', 'uni', 'teacher_uni'), True),
+    'reviews_before': Statement(
+        REVIEW_COLUMNS + 'WHERE {field} = %s ' + BEFORE.format('') + PAGE.format(''),
+        ('r_id', 'c_id', 'uni', 'teacher_uni'), True),
+    'review_details': Statement(
+        REVIEW_DETAILS_COLUMNS + 'WHERE r.{field} = %s ' + PAGE.format('r.'),
+        ('c_id', 'uni', 'teacher_uni'), True),
+    'review_details_before': Statement(
+        REVIEW_DETAILS_COLUMNS + 'WHERE r.{field} = %s ' + BEFORE.format('r.') + PAGE.format('r.'),
+        ('c_id', 'uni', 'teacher_uni'), True),
+    # a change must reach every worker at once, see app/page_cache.py
+    'cache_version': Statement(
+        "SELECT max(version) FROM cache_versions WHERE kind = %s AND ident IN (%s, '*')",
+        None, False),
+    # read right after voting, so always from the primary
+    'review_tally': Statement(
+        '''SELECT r.agree, r.disagree, v.liked
+           FROM reviews r LEFT JOIN votes v ON v.r_id = r.r_id AND v.uni = %s
+           WHERE r.r_id = %s''',
+        None, False),
+}
+
+_Compiled = namedtuple('_Compiled', 'name sql prepare execute replica')
+
+
+def _positional(sql):
+    """sql with its %s placeholders numbered $1, $2, ... as PREPARE wants them, and their count"""
+    count = [0]
+
+    def number(match):
+        if match.group() == '%%':
+            return '%'
+        count[0] += 1
+        return '${}'.format(count[0])
+
+    return re.sub(r'%[s%]', number, sql), count[0]
+
+
+class QueryRegistry(object):
+    """
+    The lookups the models run most often, declared once in STATEMENTS with the fields
+    they may be looked up by.
+
+    With QUERY_PREPARE on, each statement is prepared on a pooled connection the first
+    time it runs there, and later runs only send EXECUTE with the parameters, so postgres
+    skips parsing and, once it settles on a generic plan, planning. Which statements a
+    connection has prepared is kept in its info dict, which lives as long as the
+    connection itself. Turn it off behind a pooler that does not keep server sessions,
+    such as pgbouncer in transaction mode.
+
+    Every statement's calls and time spent are exported on /metrics.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.statements = {}
+        # name: [calls, seconds]
+        self.timings = {}
+        self._lock = threading.Lock()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('QUERY_PREPARE', True)
+        self.app = app
+        self.statements = {}
+        for name, statement in STATEMENTS.items():
+            for field in statement.fields or (None,):
+                self._compile(name if field is None else '{}_by_{}'.format(name, field),
+                              statement.sql.format(field=field) if field else statement.sql,
+                              statement.replica)
+
+    def execute(self, name, params=(), field=None, stream=False):
+        """
+        Runs a registered statement
+
+        :param field: field to look up by, for statements declared with fields
+        :param stream: fetch rows through a server-side cursor, which cannot run a
+                       prepared statement so the plain sql is sent
+        :raises ValueError: for an unknown statement or a field it is not declared with
+        """
+        key = name if field is None else '{}_by_{}'.format(name, field)
+        statement = self.statements.get(key)
+        if statement is None:
+            raise ValueError('no statement {}{}'.format(name, '' if field is None else ' by ' + field))
+
+        if statement.replica:
+            from . import replicas
+            conn = replicas.connection()
+        else:
+            conn = get_connection()
+
+        start = time.perf_counter()
+        if stream:
+            result = conn.execution_options(stream_results=True).execute(statement.sql, params)
+        elif self.app.config['QUERY_PREPARE']:
+            prepared = conn.info.setdefault('prepared_statements', set())
+            if key not in prepared:
+                conn.execute(statement.prepare)
+                prepared.add(key)
+            result = conn.execute(statement.execute, params)
+        else:
+            result = conn.execute(statement.sql, params)
+        self._record(key, time.perf_counter() - start)
+        return result
+
+    def stats(self):
+        with self._lock:
+            timings = dict(self.timings)
+
+        stats = {}
+        for name, (calls, seconds) in timings.items():
+            stats[name + '_calls'] = calls
+            stats[name + '_seconds'] = seconds
+        return stats
+
+    def _compile(self, name, sql, replica):
+        positional, params = _positional(sql)
+        execute = 'EXECUTE q_{}'.format(name)
+        if params:
+            execute += ' ({})'.format(', '.join(['%s'] * params))
+        self.statements[name] = _Compiled(name, sql, 'PREPARE q_{} AS {}'.format(name, positional), execute, replica)
+
+    def _record(self, name, seconds):
+        with self._lock:
+            timing = self.timings.setdefault(name, [0, 0.0])
+            timing[0] += 1
+            timing[1] += seconds
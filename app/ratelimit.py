@@ -0,0 +1,212 @@
+import math
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from functools import wraps
+
+from flask import request
+from flask_login import current_user
+from werkzeug.exceptions import TooManyRequests
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+
+class RateLimited(TooManyRequests):
+    """429 with a Retry-After header"""
+
+    def __init__(self, retry_after, description=None):
+        super(RateLimited, self).__init__(description)
+        self.retry_after = retry_after
+
+    def get_headers(self, environ=None):
+        return super(RateLimited, self).get_headers(environ) + [('Retry-After', str(self.retry_after))]
+
+
+class MemoryBackend(object):
+    """
+    Token buckets of this process only, so every worker allows the full rate on its own.
+    Holds at most max_keys buckets, forgetting the least recently used ones.
+    """
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        # key: (tokens, monotonic time they were counted at)
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst):
+        """
+        Takes a token from the bucket of key, which holds up to burst tokens and gains rate tokens a second
+
+        :return: 0 if a token was taken, else the seconds until there is one
+        """
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0
+            else:
+                wait = (1 - tokens) / rate
+
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return wait
+
+
+class RedisBackend(object):
+    """
+    Token buckets shared by every worker, updated atomically by a script on the redis
+    server. Needs the redis package, which is not a hard requirement of the app.
+    """
+
+    SCRIPT = '''
+        local rate, burst, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+        local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+        local tokens = tonumber(state[1]) or burst
+        local updated = tonumber(state[2]) or now
+        tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+        local wait = 0
+        if tokens >= 1 then
+            tokens = tokens - 1
+        else
+            wait = (1 - tokens) / rate
+        end
+        redis.call('HMSET', KEYS[1], 'tokens', tokens, 'updated', now)
+        redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+        return tostring(wait)
+    '''
+
+    def __init__(self, url, prefix='culpa:ratelimit:'):
+        if redis is None:
+            raise RuntimeError('RATELIMIT_BACKEND = "redis" requires the redis package')
+        self.client = redis.StrictRedis.from_url(url)
+        self.prefix = prefix
+        self._take = self.client.register_script(self.SCRIPT)
+
+    def take(self, key, rate, burst):
+        # wall clock time, which unlike monotonic time agrees between processes
+        return float(self._take(keys=[self.prefix + key], args=[rate, burst, time.time()]))
+
+
+class RateLimiter(object):
+    """
+    Throttles expensive views, answering 429 with a Retry-After header.
+
+    Each limit has a name and two independent parts:
+    - RATELIMITS[name] = (rate, burst): a token bucket per visitor, keyed by uni when
+      logged in and by IP address otherwise, which behind a proxy needs PROXY_HOPS set.
+      It holds burst requests and refills rate requests a second. The buckets live in
+      this process ('memory') or in redis at RATELIMIT_REDIS_URL ('redis'), picked by
+      RATELIMIT_BACKEND.
+    - RATELIMIT_CONCURRENCY[name]: how many of these requests one process serves at a
+      time, whoever sends them. A request waits up to RATELIMIT_ADMISSION_TIMEOUT seconds
+      for a slot, so a burst cannot take every thread and pooled connection away from
+      ordinary page views.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.backend = None
+        self._slots = {}
+        self._lock = threading.Lock()
+        # name: requests refused by the bucket, and by admission
+        self.limited = defaultdict(int)
+        self.refused = defaultdict(int)
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('RATELIMIT_ENABLED', True)
+        app.config.setdefault('RATELIMIT_BACKEND', 'memory')
+        app.config.setdefault('RATELIMIT_REDIS_URL', app.config.get('CACHE_REDIS_URL', 'redis://localhost:6379/0'))
+        app.config.setdefault('RATELIMIT_MAX_KEYS', 100000)
+        app.config.setdefault('RATELIMIT_ADMISSION_TIMEOUT', 0.1)
+        # name: (requests a second, burst)
+        app.config.setdefault('RATELIMITS', {
+            'search': (2, 30),
+            'vote': (2, 30),
+            'login': (0.1, 5),
+            'register': (0.01, 3),
+        })
+        # name: requests in flight per process, keep it below the threads of a worker
+        app.config.setdefault('RATELIMIT_CONCURRENCY', {
+            'search': 2,
+            'login': 2,
+            'register': 1,
+        })
+
+        backend = app.config['RATELIMIT_BACKEND']
+        if backend == 'memory':
+            self.backend = MemoryBackend(app.config['RATELIMIT_MAX_KEYS'])
+        elif backend == 'redis':
+            self.backend = RedisBackend(app.config['RATELIMIT_REDIS_URL'])
+        else:
+            raise ValueError('unknown RATELIMIT_BACKEND {}'.format(backend))
+        self.app = app
+
+    def limit(self, name, methods=None):
+        """
+        Decorates a view with the limit called name
+
+        :param methods: HTTP methods that are limited, all of them by default
+        """
+        def decorator(view):
+            @wraps(view)
+            def limited_view(*args, **kwargs):
+                if not self.app.config['RATELIMIT_ENABLED'] or (methods and request.method not in methods):
+                    return view(*args, **kwargs)
+
+                self.check(name)
+                slots = self._admission(name)
+                if slots is None:
+                    return view(*args, **kwargs)
+
+                if not slots.acquire(timeout=self.app.config['RATELIMIT_ADMISSION_TIMEOUT']):
+                    self.refused[name] += 1
+                    raise RateLimited(1, 'The server is busy, please try again in a moment.')
+                try:
+                    return view(*args, **kwargs)
+                finally:
+                    slots.release()
+            return limited_view
+        return decorator
+
+    def check(self, name):
+        """
+        Takes a token for the current visitor from the bucket of the limit called name
+
+        :raises RateLimited: if the bucket is empty
+        """
+        rate_limit = self.app.config['RATELIMITS'].get(name)
+        if rate_limit is None:
+            return
+
+        rate, burst = rate_limit
+        visitor = current_user.uni if current_user.is_authenticated else request.remote_addr
+        wait = self.backend.take('{}:{}'.format(name, visitor), rate, burst)
+        if wait:
+            self.limited[name] += 1
+            raise RateLimited(int(math.ceil(wait)))
+
+    def stats(self):
+        stats = {'limited_' + name: count for name, count in self.limited.items()}
+        stats.update(('refused_' + name, count) for name, count in self.refused.items())
+        return stats
+
+    def _admission(self, name):
+        concurrency = self.app.config['RATELIMIT_CONCURRENCY'].get(name)
+        if not concurrency:
+            return None
+
+        slots = self._slots.get(name)
+        if slots is None:
+            with self._lock:
+                slots = self._slots.setdefault(name, threading.BoundedSemaphore(concurrency))
+        return slots
@@ -0,0 +1,19 @@
+import re
+
+# letters and digits only, everything else (including tsquery operators) separates terms
+_TERM = re.compile(r'[^\W_]+')
+
+MAX_TERMS = 8
+
+
+def terms(query):
+    """Lower-cased search terms of a user query, capped at MAX_TERMS"""
+    return _TERM.findall((query or '').lower())[:MAX_TERMS]
+
+
+def prefix_tsquery(query_terms):
+    """
+    Builds a to_tsquery expression matching every term as a prefix, so that
+    'intro data' matches 'Introduction to Databases'
+    """
+    return ' & '.join(t + ':*' for t in query_terms)
@@ -0,0 +1,140 @@
+import math
+import re
+import threading
+from multiprocessing import Pool
+
+from .background import BackgroundWorker
+
+_WORD = re.compile(r"[a-z']+")
+
+# small hand-built lexicon tuned for course reviews, weights in [-3, 3]
+LEXICON = {
+    'amazing': 3, 'awesome': 3, 'best': 3, 'brilliant': 3, 'excellent': 3, 'fantastic': 3, 'love': 3,
+    'loved': 3, 'outstanding': 3, 'wonderful': 3,
+    'approachable': 2, 'clear': 2, 'engaging': 2, 'enjoyed': 2, 'enjoyable': 2, 'fair': 2, 'fun': 2,
+    'good': 2, 'great': 2, 'helpful': 2, 'interesting': 2, 'kind': 2, 'organized': 2, 'passionate': 2,
+    'recommend': 2, 'useful': 2, 'knowledgeable': 2,
+    'easy': 1, 'fine': 1, 'manageable': 1, 'nice': 1, 'reasonable': 1, 'solid': 1, 'learned': 1,
+    'boring': -2, 'confusing': -2, 'difficult': -1, 'disorganized': -2, 'hard': -1, 'harsh': -2,
+    'heavy': -1, 'impossible': -3, 'rude': -3, 'tedious': -2, 'unclear': -2, 'unfair': -3,
+    'unhelpful': -2, 'useless': -3, 'waste': -3, 'worst': -3, 'awful': -3, 'terrible': -3,
+    'horrible': -3, 'hate': -3, 'hated': -3, 'avoid': -2, 'bad': -2, 'poor': -2, 'stressful': -2,
+    'overwhelming': -2, 'disappointing': -2, 'annoying': -2, 'brutal': -2,
+}
+NEGATIONS = {'not', 'no', 'never', "don't", "didn't", "isn't", "wasn't", "aren't", "doesn't", 'hardly'}
+INTENSIFIERS = {'very': 1.5, 'really': 1.5, 'extremely': 2, 'so': 1.3, 'incredibly': 2, 'super': 1.5}
+
+# how many words a negation reaches
+NEGATION_SCOPE = 3
+
+
+def score(text):
+    """
+    Lexicon based sentiment of a text in [-1, 1], 0 for neutral or empty text.
+    Negations flip the words that follow them and intensifiers scale the next word.
+    """
+    total = 0.0
+    negated = 0
+    boost = 1.0
+    for word in _WORD.findall((text or '').lower()):
+        if word in NEGATIONS:
+            negated = NEGATION_SCOPE
+            continue
+        if word in INTENSIFIERS:
+            boost = INTENSIFIERS[word]
+            continue
+
+        weight = LEXICON.get(word, 0) * boost
+        total += -weight if negated else weight
+        negated = max(negated - 1, 0)
+        boost = 1.0
+
+    # squash the unbounded sum into [-1, 1]
+    return total / math.sqrt(total * total + 15)
+
+
+def score_review(row):
+    """
+    :param row: (r_id, general_content, workload_content)
+    :return: (r_id, score), the general review counting twice as much as the workload one
+    """
+    r_id, general, workload = row
+    return r_id, round((2 * score(general) + score(workload)) / 3, 4)
+
+
+class SentimentWorker(object):
+    """
+    Scores newly written reviews in the background. Review.save enqueues the review in
+    sentiment_jobs and a thread in every app process claims batches of jobs, scores them
+    and writes the scores back in one statement, so submitting a review never waits on it.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._wakeup = threading.Event()
+        self._worker = BackgroundWorker(self._run, 'sentiment-worker')
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('SENTIMENT_WORKER', True)
+        app.config.setdefault('SENTIMENT_BATCH_SIZE', 100)
+        app.config.setdefault('SENTIMENT_POLL_INTERVAL', 5)
+        self.app = app
+
+        if app.config['SENTIMENT_WORKER']:
+            app.before_request(self._worker.ensure_started)
+
+    def notify(self):
+        """Wakes the worker up after a review was enqueued"""
+        self._wakeup.set()
+
+    def run_once(self):
+        """
+        Scores one batch of queued reviews
+
+        :return: number of reviews scored
+        """
+        from .models import Review
+
+        with self.app.app_context():
+            return Review.score_queued(self.app.config['SENTIMENT_BATCH_SIZE'])
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.app.config['SENTIMENT_POLL_INTERVAL'])
+            self._wakeup.clear()
+            try:
+                # keep going while full batches come back, the queue may be backed up
+                while self.run_once() == self.app.config['SENTIMENT_BATCH_SIZE']:
+                    pass
+            except Exception:
+                self.app.logger.exception('sentiment scoring failed')
+
+
+def backfill(batch_size=1000, processes=None):
+    """
+    Rescores every review, reading them in batches in r_id order that are scored in
+    parallel by a process pool with one process per core. Each batch is written back and
+    committed on its own, so rows stay locked only while their batch is written, and a
+    failure loses no more than the batch it happened in.
+
+    :return: number of reviews scored
+    """
+    from .models import Review
+
+    scored = 0
+    last = None
+    with Pool(processes) as pool:
+        while True:
+            # a keyset rather than one cursor, which would not survive the commits in between
+            batch = Review.find_contents(last, batch_size)
+            if not batch:
+                break
+
+            Review.update_sentiment(pool.map(score_review, batch))
+            scored += len(batch)
+            last = batch[-1][0]
+
+    return scored
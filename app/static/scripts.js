@@ -1,15 +1,33 @@
 $(document).ready(function() {
-    $('input.agree, input.disagree').click(e => {
+    let suggestions = $('datalist#suggestions');
+    let search_input = $('input#query');
+    search_input.attr({list: 'suggestions', autocomplete: 'off'});
+    search_input.on('input', e => {
+        let q = search_input.val();
+        if (!q) {
+            suggestions.empty();
+            return;
+        }
+        $.getJSON(suggestions.data('url'), {q: q}, data => {
+            // ignore answers to keystrokes that have since been superseded
+            if (search_input.val() !== q) {
+                return;
+            }
+            suggestions.empty();
+            data.suggestions.forEach(s => suggestions.append($('<option>').attr('value', s.label)));
+        });
+    });
+
+    // delegated so that reviews loaded by "More reviews" get the handler too
+    $(document).on('click', 'input.agree, input.disagree', e => {
         e.preventDefault();
 
         let button = $(e.target);
         let form = button.parents('form');
+        let csrf_token = $('meta[name=csrf-token]').attr('content') || '';
 
-        form_data = form.serialize();
-        button_name = button.attr('name');
-        button_value = button.attr('value');
-
-        data = `${form_data}&${button_name}=${button_value}`;
+        let data = {csrf_token: csrf_token};
+        data[button.attr('name')] = button.attr('value');
 
         $.ajax({
             type: 'POST',
@@ -34,10 +52,27 @@ $(document).ready(function() {
 
             beforeSend: (xhr, settings) => {
                 if (!/^(GET|HEAD|OPTIONS|TRACE)$/i.test(settings.type) && !this.crossDomain) {
-                    xhr.setRequestHeader("X-CSRFToken", form.find('input[name=csrf_token]').val())
+                    xhr.setRequestHeader("X-CSRFToken", csrf_token)
                 }
             }
         });
     });
-});
 
+    let load_more = button => {
+        if (button.data('loading')) {
+            return;
+        }
+        button.data('loading', true);
+        $.getJSON(button.data('url'), data => button.replaceWith(data.html));
+    };
+
+    $(document).on('click', 'button.load-more', e => load_more($(e.target)));
+
+    // infinite scroll: fetch the next page once the button comes into view
+    $(window).on('scroll', () => {
+        let button = $('button.load-more');
+        if (button.length && button.offset().top < $(window).scrollTop() + $(window).height() + 200) {
+            load_more(button);
+        }
+    });
+});
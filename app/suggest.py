@@ -0,0 +1,100 @@
+import heapq
+import threading
+from bisect import bisect_left
+
+from .background import load_before_first_request
+from .search import terms
+
+
+def _keys(*texts):
+    """Every normalized word of the texts, each of which a query term may be a prefix of"""
+    keys = set()
+    for text in texts:
+        keys.update(terms(text))
+    return keys
+
+
+class SuggestionIndex(object):
+    """
+    In-memory prefix index over the words of course names and abbreviations and of
+    teacher names and unis. A course or teacher matches when every term of the query is
+    the prefix of one of its words, so 'intro data' reaches 'Introduction to Databases'
+    as Course.search would.
+
+    Entries live in a sorted tuple of (word, kind, id, label) that is searched with bisect,
+    so a lookup never touches the database. Writers build a new tuple and swap it in,
+    which keeps readers lock free. Every process reloads the index when the directory
+    picks up a new catalog version, e.g. after a catalog import.
+    """
+
+    def __init__(self, app=None):
+        # (keys, entries) swapped as one reference so readers never see a mix of two versions
+        self._index = ((), ())
+        self._lock = threading.Lock()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('SUGGEST_LIMIT', 10)
+
+        load_before_first_request(app, lambda: bool(self._index[1]), self.load)
+
+    def load(self):
+        from .database import primary_reads
+        from .models import Course, Teacher
+
+        entries = []
+        # reloaded when the catalog version changes, which a replica may not have caught up with
+        with primary_reads():
+            for course in Course.find_all(Course.LISTING):
+                entries.extend(self._course_entries(course.c_id, course.name, course.abbrev))
+            for teacher in Teacher.find_all():
+                entries.extend(self._teacher_entries(teacher.uni, teacher.name))
+
+        with self._lock:
+            self._swap(entries)
+
+    def add_teacher(self, uni, name):
+        """Adds a teacher to this process's index, the others reload it when the catalog version changes"""
+        with self._lock:
+            entries = [e for e in self._index[1] if e[1:3] != ('teacher', uni)]
+            self._swap(entries + self._teacher_entries(uni, name))
+
+    def suggest(self, prefix, limit=10):
+        """
+        :return: up to limit (kind, id, label) tuples matching every term of prefix, by label
+        """
+        query_terms = terms(prefix)
+        if not query_terms:
+            return []
+
+        keys, entries = self._index
+        matches = None
+        # longest first, it usually matches the fewest words and narrows the rest the most
+        for term in sorted(set(query_terms), key=len, reverse=True):
+            found = {}
+            i = bisect_left(keys, term)
+            while i < len(keys) and keys[i].startswith(term):
+                _, kind, ident, label = entries[i]
+                if matches is None or (kind, ident) in matches:
+                    found[(kind, ident)] = label
+                i += 1
+            matches = found
+            if not matches:
+                return []
+
+        best = heapq.nsmallest(limit, matches.items(), key=lambda match: (match[1], match[0]))
+        return [(kind, ident, label) for (kind, ident), label in best]
+
+    def _swap(self, entries):
+        entries = tuple(sorted(entries))
+        self._index = (tuple(e[0] for e in entries), entries)
+
+    @staticmethod
+    def _course_entries(c_id, name, abbrev):
+        return [(key, 'course', c_id, name) for key in _keys(name, abbrev)]
+
+    @staticmethod
+    def _teacher_entries(uni, name):
+        return [(key, 'teacher', uni, name) for key in _keys(name, uni)]
@@ -0,0 +1,69 @@
+import atexit
+import threading
+from collections import Counter
+from datetime import datetime
+
+from .background import BackgroundWorker
+
+
+class ViewBuffer(object):
+    """
+    Collects course page views in memory and writes them to course_views in batches
+    from a background thread, so that rendering a course page never waits on the write.
+
+    Views are aggregated per (course, hour) and flushed every VIEW_FLUSH_INTERVAL seconds
+    or as soon as VIEW_FLUSH_SIZE views are pending, whichever comes first.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._counts = Counter()
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._worker = BackgroundWorker(self._run, 'view-buffer')
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('VIEW_FLUSH_INTERVAL', 10)
+        app.config.setdefault('VIEW_FLUSH_SIZE', 500)
+        self.app = app
+        atexit.register(self.flush)
+
+    def add(self, c_id):
+        hour = datetime.now().replace(minute=0, second=0, microsecond=0)
+
+        with self._lock:
+            self._counts[(c_id, hour)] += 1
+            self._pending += 1
+            full = self._pending >= self.app.config['VIEW_FLUSH_SIZE']
+
+        self._worker.ensure_started()
+        if full:
+            self._wakeup.set()
+
+    def flush(self):
+        with self._lock:
+            counts, self._counts = self._counts, Counter()
+            self._pending = 0
+
+        if not counts:
+            return
+
+        from .models import Course
+
+        rows = [(c_id, hour, views) for (c_id, hour), views in counts.items()]
+        with self.app.app_context():
+            try:
+                Course.record_views(rows)
+            except Exception:
+                # view counts are best effort, never let a failed flush kill the worker
+                self.app.logger.exception('failed to flush %d course view buckets', len(rows))
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.app.config['VIEW_FLUSH_INTERVAL'])
+            self._wakeup.clear()
+            self.flush()
@@ -0,0 +1,244 @@
+import atexit
+import heapq
+import math
+import threading
+import time
+from operator import itemgetter
+
+from .background import BackgroundWorker, load_before_first_request
+from .database import execute, transaction
+
+# scores are kept as logarithms scaled to this time, 2018-01-01 UTC
+EPOCH = 1514764800
+
+
+def logaddexp(a, b):
+    """log(exp(a) + exp(b)) without overflowing"""
+    if a < b:
+        a, b = b, a
+    return a + math.log1p(math.exp(b - a))
+
+
+class TopK(object):
+    """
+    Space-saving sketch of the capacity items with the highest scores. An item that
+    arrives when the sketch is full replaces the lowest one and starts from its score,
+    so counts are overestimated by at most that much but memory stays bounded.
+
+    Scores are logarithms and adding to one is logaddexp. Not thread safe.
+    """
+
+    def __init__(self, capacity, scores=()):
+        self.capacity = capacity
+        self.scores = dict(scores)
+        # (score, item), with stale entries left behind by updates until the next compaction
+        self._heap = [(score, item) for item, score in self.scores.items()]
+        heapq.heapify(self._heap)
+
+    def add(self, item, score):
+        current = self.scores.get(item)
+        if current is None and len(self.scores) >= self.capacity:
+            current = self._pop_lowest()
+
+        self.scores[item] = score = score if current is None else logaddexp(current, score)
+        heapq.heappush(self._heap, (score, item))
+        if len(self._heap) > 4 * self.capacity:
+            self._heap = [(score, item) for item, score in self.scores.items()]
+            heapq.heapify(self._heap)
+
+    def top(self, n):
+        """:return: the n (item, score) with the highest scores, highest first"""
+        return heapq.nlargest(n, self.scores.items(), key=itemgetter(1))
+
+    def _pop_lowest(self):
+        while True:
+            score, item = heapq.heappop(self._heap)
+            if self.scores.get(item) == score:
+                del self.scores[item]
+                return score
+
+
+class Trending(object):
+    """
+    Time-decayed popularity of courses, overall and per department.
+
+    Every view, review and vote adds its TRENDING_WEIGHTS entry to the course's score,
+    and scores halve every TRENDING_HALF_LIFE seconds. A score is stored as the log of
+    its value scaled to EPOCH, which never overflows and never needs rewriting as time
+    passes. Adding to it is one logaddexp, and comparing two scores compares their
+    current values.
+
+    Each process keeps the top TRENDING_CAPACITY courses, and the top
+    TRENDING_DEPARTMENT_CAPACITY of every department, in TopK sketches updated as events
+    arrive. Every TRENDING_CHECKPOINT_INTERVAL seconds a background thread merges what
+    the process saw since the last checkpoint into course_trending
+    (migrations/008_course_trending.sql). It then reloads the sketches from that table,
+    so they include every other process's events too.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._rate = 0.0
+        self._overall = TopK(0)
+        self._departments = {}
+        # c_id: score added since the last checkpoint
+        self._pending = {}
+        # the directory snapshot _course_departments was built from, and its c_id: d_ids
+        self._mapped = (None, {})
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._worker = BackgroundWorker(self._run, 'trending')
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('TRENDING_HALF_LIFE', 24 * 60 * 60)
+        app.config.setdefault('TRENDING_WEIGHTS', {'view': 1.0, 'review': 10.0, 'vote': 2.0})
+        app.config.setdefault('TRENDING_CAPACITY', 500)
+        app.config.setdefault('TRENDING_DEPARTMENT_CAPACITY', 50)
+        app.config.setdefault('TRENDING_CHECKPOINT_INTERVAL', 60)
+        # courses whose current score falls below this are dropped from course_trending
+        app.config.setdefault('TRENDING_MIN_SCORE', 0.01)
+        self._rate = math.log(2) / app.config['TRENDING_HALF_LIFE']
+        self._overall = TopK(app.config['TRENDING_CAPACITY'])
+        self.app = app
+        atexit.register(self.flush)
+
+        load_before_first_request(app, lambda: self._loaded, self.load)
+
+    def add(self, c_id, event, count=1):
+        """
+        Counts count events of a kind in TRENDING_WEIGHTS for course c_id, now. Needs an
+        app context to map the course to its departments.
+        """
+        if count <= 0:
+            return
+
+        score = math.log(self.app.config['TRENDING_WEIGHTS'][event] * count) + self._now()
+        departments = self._course_departments().get(c_id, ())
+
+        with self._lock:
+            pending = self._pending.get(c_id)
+            self._pending[c_id] = score if pending is None else logaddexp(pending, score)
+            self._overall.add(c_id, score)
+            for did in departments:
+                sketch = self._departments.get(did)
+                if sketch is None:
+                    sketch = self._departments[did] = TopK(self.app.config['TRENDING_DEPARTMENT_CAPACITY'])
+                sketch.add(c_id, score)
+
+        self._worker.ensure_started()
+
+    def top(self, limit=20, did=None):
+        """
+        The most popular courses right now, overall or in department did
+
+        :return: list of (c_id, current score), highest first
+        """
+        self._worker.ensure_started()
+        now = self._now()
+        with self._lock:
+            sketch = self._overall if did is None else self._departments.get(did)
+            ranked = sketch.top(limit) if sketch is not None else []
+        return [(c_id, math.exp(score - now)) for c_id, score in ranked]
+
+    def flush(self):
+        """
+        Merges the scores this process collected since the last flush into
+        course_trending. Scores that fail to be written are kept for the next flush.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+
+        if not pending:
+            return
+
+        rows = sorted(pending.items())
+        with self.app.app_context():
+            try:
+                self._write(rows)
+            except Exception:
+                self.app.logger.exception('failed to write trending scores of %d courses', len(rows))
+                with self._lock:
+                    for c_id, score in rows:
+                        newer = self._pending.get(c_id)
+                        self._pending[c_id] = score if newer is None else logaddexp(newer, score)
+
+    def checkpoint(self):
+        """Flushes this process's scores and reloads the rankings, which then include every process's"""
+        self.flush()
+        with self.app.app_context():
+            try:
+                self.load()
+            except Exception:
+                self.app.logger.exception('failed to reload trending courses')
+
+    def load(self):
+        """Replaces the rankings with the ones in course_trending, plus what is not checkpointed yet"""
+        # from the primary, which already has what this process just flushed
+        floor = self._floor()
+        overall = [tuple(row) for row in execute('''
+            SELECT c_id, score FROM course_trending WHERE score > %s ORDER BY score DESC LIMIT %s
+        ''', (floor, self.app.config['TRENDING_CAPACITY']))]
+        by_department = {}
+        for did, c_id, score in execute('''
+                SELECT d_id, c_id, score FROM (
+                    SELECT cd.d_id, t.c_id, t.score,
+                           row_number() OVER (PARTITION BY cd.d_id ORDER BY t.score DESC) AS rank
+                    FROM course_trending t JOIN course_department cd ON cd.c_id = t.c_id
+                    WHERE t.score > %s
+                ) ranked
+                WHERE rank <= %s
+                ''', (floor, self.app.config['TRENDING_DEPARTMENT_CAPACITY'])):
+            by_department.setdefault(did, []).append((c_id, score))
+
+        departments = self._course_departments()
+        with self._lock:
+            self._overall = TopK(self.app.config['TRENDING_CAPACITY'], overall)
+            self._departments = {did: TopK(self.app.config['TRENDING_DEPARTMENT_CAPACITY'], scores)
+                                 for did, scores in by_department.items()}
+            # events that arrived while the table was read are not in it yet
+            for c_id, score in self._pending.items():
+                self._overall.add(c_id, score)
+                for did in departments.get(c_id, ()):
+                    self._departments.setdefault(
+                        did, TopK(self.app.config['TRENDING_DEPARTMENT_CAPACITY'])).add(c_id, score)
+            self._loaded = True
+
+    def _write(self, rows):
+        values = ', '.join(['(%s, %s::float8)'] * len(rows))
+        with transaction():
+            # logaddexp in SQL, exp underflows to an error rather than to 0 in postgres
+            execute('''
+                INSERT INTO course_trending AS t (c_id, score) VALUES {}
+                ON CONFLICT (c_id) DO UPDATE SET
+                    score = GREATEST(t.score, EXCLUDED.score)
+                            + ln(1 + exp(GREATEST(-abs(t.score - EXCLUDED.score), -700))),
+                    updated_at = now()
+            '''.format(values), tuple(v for row in rows for v in row))
+            execute('DELETE FROM course_trending WHERE score < %s', (self._floor(),))
+
+    def _now(self):
+        return self._rate * (time.time() - EPOCH)
+
+    def _floor(self):
+        return self._now() + math.log(self.app.config['TRENDING_MIN_SCORE'])
+
+    def _course_departments(self):
+        from . import directory
+
+        snapshot = directory.get()
+        mapped_from, departments = self._mapped
+        if mapped_from is not snapshot:
+            departments = {}
+            for department in snapshot.departments:
+                for course in department.courses:
+                    departments.setdefault(course.c_id, []).append(department.did)
+            self._mapped = (snapshot, departments)
+        return departments
+
+    def _run(self):
+        while True:
+            time.sleep(self.app.config['TRENDING_CHECKPOINT_INTERVAL'])
+            self.checkpoint()
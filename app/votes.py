@@ -0,0 +1,93 @@
+import atexit
+import threading
+from datetime import datetime
+
+from .background import BackgroundWorker
+
+MISSING = object()
+
+
+class VoteQueue(object):
+    """
+    Takes votes from requests into memory and writes them to the database in batches,
+    so a burst of clicks costs one transaction per batch instead of several round trips
+    per click.
+
+    Repeated votes by the same user on the same review replace each other while they wait,
+    so double clicks and quick changes of mind are written once. Batches are written every
+    VOTE_FLUSH_INTERVAL seconds or as soon as VOTE_FLUSH_SIZE votes are pending. At most
+    VOTE_QUEUE_SIZE votes wait at a time, past that the request writes the queue itself.
+
+    With VOTE_QUEUE_ASYNC off every vote is written before the request returns.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        # (uni, r_id): (liked, voted_on)
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._worker = BackgroundWorker(self._run, 'vote-queue')
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('VOTE_QUEUE_ASYNC', True)
+        app.config.setdefault('VOTE_FLUSH_INTERVAL', 1)
+        app.config.setdefault('VOTE_FLUSH_SIZE', 200)
+        app.config.setdefault('VOTE_QUEUE_SIZE', 5000)
+        self.app = app
+        atexit.register(self.flush)
+
+    def pending(self, uni, rid, default=None):
+        """The vote waiting to be written for uni on review rid, default if there is none"""
+        with self._lock:
+            entry = self._pending.get((uni, rid), MISSING)
+        return default if entry is MISSING else entry[0]
+
+    def add(self, uni, rid, liked):
+        with self._lock:
+            self._pending[(uni, rid)] = (liked, datetime.now())
+            size = len(self._pending)
+
+        if not self.app.config['VOTE_QUEUE_ASYNC'] or size >= self.app.config['VOTE_QUEUE_SIZE']:
+            self.flush()
+            return
+
+        self._worker.ensure_started()
+        if size >= self.app.config['VOTE_FLUSH_SIZE']:
+            self._wakeup.set()
+
+    def flush(self):
+        """
+        Writes every pending vote. A failed batch goes back in the queue, behind any
+        newer vote for the same user and review, to be retried by the next flush.
+
+        :return: number of votes written
+        """
+        with self._lock:
+            batch, self._pending = self._pending, {}
+
+        if not batch:
+            return 0
+
+        from .models import Vote
+
+        votes = [(uni, rid, liked, voted_on) for (uni, rid), (liked, voted_on) in batch.items()]
+        with self.app.app_context():
+            try:
+                Vote.save_many(votes)
+            except Exception:
+                self.app.logger.exception('failed to write %d votes, requeued', len(votes))
+                with self._lock:
+                    for key, entry in batch.items():
+                        self._pending.setdefault(key, entry)
+                return 0
+        return len(votes)
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.app.config['VOTE_FLUSH_INTERVAL'])
+            self._wakeup.clear()
+            self.flush()
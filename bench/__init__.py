@@ -0,0 +1,7 @@
+"""
+Benchmarks for the app, run with ``python -m bench --help``.
+
+``run`` builds a throwaway postgres with a synthetic catalog and drives the app through a
+mix of searches, page views, vote bursts and registrations, ``micro`` times the pure-python
+hot paths and ``compare`` checks two saved runs for regressions.
+"""
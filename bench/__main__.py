@@ -0,0 +1,156 @@
+import json
+import subprocess
+import sys
+import time
+
+import click
+
+from . import driver, micro
+from .data import SCALES, generate
+from .database import LocalPostgres
+
+LATENCY_KEYS = ('p50', 'p95', 'p99')
+
+
+def _revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _config_value(value):
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+
+def _ms(seconds):
+    return '{:9.2f}'.format(seconds * 1000)
+
+
+def _print_summary(summary):
+    click.echo('{:<12} {:>8} {:>6} {:>9} {:>9} {:>9} {:>9} {:>8}'.format(
+        'endpoint', 'requests', 'errors', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'queries'))
+    rows = sorted(summary['endpoints'].items()) + [('total', dict(summary, queries=None))]
+    for name, stats in rows:
+        queries = '' if stats['queries'] is None else '{:8.1f}'.format(stats['queries'])
+        click.echo('{:<12} {:>8} {:>6} {:9.1f} {} {} {} {:>8}'.format(
+            name, stats['requests'], stats['errors'], stats['throughput'],
+            _ms(stats['p50']), _ms(stats['p95']), _ms(stats['p99']), queries))
+
+
+@click.group()
+def cli():
+    """Load tests and micro-benchmarks for the culpa app."""
+
+
+@cli.command()
+@click.option('--scale', type=click.Choice(sorted(SCALES)), default='small', help='Size of the synthetic catalog.')
+@click.option('--seed', type=int, default=0, help='Seed of the data and the request mix.')
+@click.option('--requests', type=int, default=2000, help='Scenarios to run, not counting the warmup.')
+@click.option('--warmup', type=int, default=100, help='Scenarios run before measuring.')
+@click.option('--threads', type=int, default=4, help='Concurrent visitors.')
+@click.option('--config', 'overrides', multiple=True, metavar='KEY=VALUE',
+              help='App config override, values are parsed as JSON when possible. Repeatable.')
+@click.option('--out', type=click.Path(dir_okay=False, writable=True), help='Write the results as JSON.')
+def run(scale, seed, requests, warmup, threads, overrides, out):
+    """Load a synthetic catalog into a local postgres and drive the app with a request mix."""
+    from app import create_app, db, view_buffer, vote_queue
+    from app.models import ReviewStats
+
+    with LocalPostgres() as pg:
+        start = time.perf_counter()
+        conn = pg.connect()
+        try:
+            dataset = generate(conn, scale, seed)
+        finally:
+            conn.close()
+        click.echo('generated {} catalog in {:.1f}s'.format(scale, time.perf_counter() - start), err=True)
+
+        config = {'SQLALCHEMY_DATABASE_URI': pg.uri}
+        for override in overrides:
+            key, _, value = override.partition('=')
+            config[key] = _config_value(value)
+
+        app = create_app('bench', config)
+        with app.app_context():
+            ReviewStats.rebuild()
+        summary = driver.run(app, dataset, requests=requests, threads=threads, seed=seed, warmup=warmup)
+
+        # write buffered views and votes and close the pool while the database is still up
+        view_buffer.flush()
+        vote_queue.flush()
+        db.get_engine(app).dispose()
+
+    _print_summary(summary)
+    if out:
+        results = {
+            'meta': {
+                'revision': _revision(),
+                'scale': scale,
+                'seed': seed,
+                'requests': requests,
+                'threads': threads,
+                'config': dict(override.partition('=')[::2] for override in overrides),
+            },
+            'summary': summary,
+        }
+        with open(out, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+
+@cli.command('micro')
+@click.option('--seed', type=int, default=0)
+@click.option('--repeat', type=int, default=5, help='Timing rounds, the best one is kept.')
+@click.option('--out', type=click.Path(dir_okay=False, writable=True), help='Write the results as JSON.')
+def micro_command(seed, repeat, out):
+    """Time the pure-python hot paths, no database needed."""
+    results = micro.run(seed, repeat)
+    for name, seconds in sorted(results.items()):
+        click.echo('{:<24} {:12.2f} us'.format(name, seconds * 1e6))
+    if out:
+        with open(out, 'w') as f:
+            json.dump({'meta': {'revision': _revision(), 'seed': seed}, 'micro': results}, f, indent=2, sort_keys=True)
+
+
+@cli.command()
+@click.argument('base', type=click.File())
+@click.argument('new', type=click.File())
+@click.option('--threshold', type=float, default=0.1, help='Relative slowdown reported as a regression.')
+def compare(base, new, threshold):
+    """Compare two result files, exiting with 1 if NEW regressed from BASE."""
+    base, new = json.load(base), json.load(new)
+    regressions = []
+
+    def check(name, metric, old, current):
+        if old is None or current is None:
+            return
+        change = (current - old) / old if old else float(current > 0)
+        flag = change > threshold
+        if flag:
+            regressions.append((name, metric))
+        click.echo('{:<24} {:<10} {:12.4f} {:12.4f} {:+8.1%}{}'.format(
+            name, metric, old, current, change, '  REGRESSION' if flag else ''))
+
+    click.echo('{:<24} {:<10} {:>12} {:>12} {:>8}'.format('name', 'metric', 'base', 'new', 'change'))
+    if 'summary' in base and 'summary' in new:
+        old_endpoints, new_endpoints = base['summary']['endpoints'], new['summary']['endpoints']
+        for name in sorted(set(old_endpoints) & set(new_endpoints)):
+            for metric in LATENCY_KEYS + ('queries',):
+                check(name, metric, old_endpoints[name][metric], new_endpoints[name][metric])
+        # throughput regresses when it drops
+        check('total', '1/req/s', 1 / base['summary']['throughput'], 1 / new['summary']['throughput'])
+    if 'micro' in base and 'micro' in new:
+        for name in sorted(set(base['micro']) & set(new['micro'])):
+            check(name, 'seconds', base['micro'][name], new['micro'][name])
+
+    if regressions:
+        click.echo('{} regression(s) above {:.0%}'.format(len(regressions), threshold), err=True)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    cli(prog_name='python -m bench')
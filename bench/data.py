@@ -0,0 +1,123 @@
+import csv
+import io
+import itertools
+import random
+from datetime import datetime, timedelta
+
+from werkzeug.security import generate_password_hash
+
+PASSWORD = 'bench-password'
+
+SCALES = {
+    'small': dict(departments=10, courses=300, teachers=150, users=500, reviews=3000, votes=15000),
+    'medium': dict(departments=30, courses=3000, teachers=1500, users=5000, reviews=30000, votes=150000),
+    'large': dict(departments=60, courses=20000, teachers=8000, users=30000, reviews=300000, votes=1500000),
+}
+
+SUBJECTS = ['Algorithms', 'Biology', 'Calculus', 'Chemistry', 'Databases', 'Economics', 'Ethics', 'French',
+            'Genetics', 'Geometry', 'History', 'Linguistics', 'Literature', 'Logic', 'Music', 'Networks',
+            'Operating Systems', 'Philosophy', 'Physics', 'Politics', 'Psychology', 'Sociology', 'Statistics',
+            'Topology', 'Writing']
+LEVELS = ['Introduction to', 'Advanced', 'Topics in', 'Seminar in', 'Foundations of', 'Applied', 'Honors']
+FIRST = ['Alex', 'Ana', 'Ben', 'Chen', 'Dana', 'Eli', 'Fatima', 'Gabe', 'Hana', 'Ivan', 'Jon', 'Kofi', 'Lena',
+         'Luis', 'Maya', 'Noor', 'Omar', 'Priya', 'Rosa', 'Sam', 'Tara', 'Uma', 'Vik', 'Wen', 'Yuki', 'Zoe']
+LAST = ['Adams', 'Baker', 'Cohen', 'Diaz', 'Evans', 'Fischer', 'Garcia', 'Gravano', 'Huang', 'Ito', 'Jones',
+        'Kim', 'Lopez', 'Murphy', 'Nguyen', 'Okafor', 'Patel', 'Quinn', 'Rossi', 'Smith', 'Tanaka', 'Weber']
+WORDS = ['lectures', 'homework', 'exams', 'great', 'helpful', 'boring', 'clear', 'confusing', 'fair', 'hard',
+         'easy', 'interesting', 'workload', 'heavy', 'manageable', 'recommend', 'avoid', 'the', 'was', 'very',
+         'not', 'really', 'professor', 'problem', 'sets', 'readings', 'projects', 'curve', 'office', 'hours']
+
+
+def _copy(cur, table, columns, rows):
+    buf = io.StringIO()
+    csv.writer(buf).writerows(rows)
+    buf.seek(0)
+    cur.copy_expert('COPY {} ({}) FROM STDIN WITH CSV'.format(table, ', '.join(columns)), buf)
+
+
+def _sentence(rng, n):
+    return ' '.join(rng.choice(WORDS) for _ in range(n)).capitalize() + '.'
+
+
+def generate(conn, scale='small', seed=0):
+    """
+    Fills an empty database with a synthetic catalog. Course popularity is skewed so that a
+    few courses collect most reviews, as on the real site.
+
+    :param scale: key of SCALES or a dict with the same keys
+    :return: dict of the ids the load driver picks from
+    """
+    sizes = SCALES[scale] if isinstance(scale, str) else scale
+    rng = random.Random(seed)
+    now = datetime.now()
+
+    dids = ['D{:03d}'.format(i) for i in range(sizes['departments'])]
+    c_ids = ['C{:05d}'.format(i) for i in range(sizes['courses'])]
+    t_unis = ['t{}{}'.format(rng.choice(LAST).lower()[:2], i) for i in range(sizes['teachers'])]
+    unis = ['u{}{}'.format(rng.choice(FIRST).lower()[:2], i) for i in range(sizes['users'])]
+    password_hash = generate_password_hash(PASSWORD)
+
+    course_names = {}
+    popularity = list(itertools.accumulate(1.0 / (i + 1) for i in range(len(c_ids))))
+
+    with conn, conn.cursor() as cur:
+        _copy(cur, 'departments', ('d_id', 'name', 'abbrev'),
+              [(did, 'Department of {} {}'.format(rng.choice(SUBJECTS), i), did) for i, did in enumerate(dids)])
+
+        rows = []
+        for i, c_id in enumerate(c_ids):
+            course_names[c_id] = '{} {} {}'.format(rng.choice(LEVELS), rng.choice(SUBJECTS), i)
+            rows.append((c_id, course_names[c_id], 'COMS{}'.format(1000 + i), '{}'))
+        _copy(cur, 'courses', ('c_id', 'name', 'abbrev', 'views'), rows)
+
+        _copy(cur, 'teachers', ('uni', 'name'),
+              [(uni, '{}, {}'.format(rng.choice(LAST), rng.choice(FIRST))) for uni in t_unis])
+        _copy(cur, 'users', ('uni', 'name', 'year', 'password_hash', 'school', 'num_reviews'),
+              [(uni, '{}, {}'.format(rng.choice(LAST), rng.choice(FIRST)), rng.randint(2018, 2030),
+                password_hash, rng.choice(['cc', 'seas', 'gs', 'barnard', 'grad']), 0) for uni in unis])
+
+        _copy(cur, 'course_department', ('c_id', 'd_id'), [(c_id, rng.choice(dids)) for c_id in c_ids])
+        _copy(cur, 'teachers_department', ('uni', 'd_id'), [(uni, rng.choice(dids)) for uni in t_unis])
+
+        # every course is taught by one to three teachers
+        teaches = {(uni, c_id) for c_id in c_ids for uni in rng.sample(t_unis, rng.randint(1, min(3, len(t_unis))))}
+        _copy(cur, 'teaches', ('uni', 'c_id'), sorted(teaches))
+        teachers_of = {}
+        for uni, c_id in teaches:
+            teachers_of.setdefault(c_id, []).append(uni)
+
+        rows = []
+        for r_id in range(1, sizes['reviews'] + 1):
+            c_id = rng.choices(c_ids, cum_weights=popularity)[0]
+            rows.append((r_id, c_id, rng.choice(unis), rng.choice(teachers_of[c_id]),
+                         _sentence(rng, rng.randint(10, 60)), _sentence(rng, rng.randint(5, 30)),
+                         0, now - timedelta(minutes=rng.randint(0, 60 * 24 * 365 * 4))))
+        _copy(cur, 'reviews', ('r_id', 'c_id', 'uni', 'teacher_uni', 'general_content', 'workload_content',
+                               'sentiment_score', 'written_on'), rows)
+        cur.execute("SELECT setval('reviews_r_id_seq', %s)", (sizes['reviews'],))
+
+        votes = {}
+        r_ids = range(1, sizes['reviews'] + 1)
+        while len(votes) < min(sizes['votes'], len(unis) * len(r_ids)):
+            votes[(rng.choice(unis), rng.choice(r_ids))] = rng.random() < 0.7
+        _copy(cur, 'votes', ('uni', 'r_id', 'voted_on', 'liked'),
+              [(uni, r_id, now, liked) for (uni, r_id), liked in votes.items()])
+        cur.execute('''
+            UPDATE reviews r SET agree = vc.agree, disagree = vc.disagree
+            FROM (
+                SELECT r_id, COUNT(*) FILTER (WHERE liked) AS agree, COUNT(*) FILTER (WHERE NOT liked) AS disagree
+                FROM votes GROUP BY r_id
+            ) vc
+            WHERE r.r_id = vc.r_id
+        ''')
+        cur.execute('ANALYZE')
+
+    return {
+        'departments': dids,
+        'courses': c_ids,
+        'teachers': t_unis,
+        'users': unis,
+        'reviews': sizes['reviews'],
+        'search_terms': sorted({word.lower() for name in course_names.values() for word in name.split()[:2]})
+                        + [w.lower() for w in SUBJECTS] + [w.lower() for w in LAST],
+    }
@@ -0,0 +1,86 @@
+import glob
+import os
+import shutil
+import socket
+import subprocess
+import tempfile
+
+import psycopg2
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCHEMA = os.path.join(ROOT, 'bench', 'schema.sql')
+MIGRATIONS = os.path.join(ROOT, 'migrations')
+
+
+def _pg_bin(name):
+    """Path of a postgres server binary, which distributions often keep off the PATH"""
+    path = shutil.which(name)
+    if path:
+        return path
+
+    pg_config = shutil.which('pg_config')
+    if pg_config:
+        bindir = subprocess.check_output([pg_config, '--bindir']).decode().strip()
+        if os.path.exists(os.path.join(bindir, name)):
+            return os.path.join(bindir, name)
+
+    raise RuntimeError('{} not found, install postgres or set BENCH_DATABASE_URI'.format(name))
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class LocalPostgres(object):
+    """
+    Throwaway postgres cluster in a temporary directory, listening only on a unix socket,
+    with the app schema and every migration applied. Used as a context manager.
+
+    If BENCH_DATABASE_URI is set that (empty) database is used instead and left running.
+    """
+
+    def __init__(self):
+        self.uri = os.environ.get('BENCH_DATABASE_URI')
+        self.directory = None
+
+    def __enter__(self):
+        if self.uri is None:
+            self._start()
+        self._apply_schema()
+        return self
+
+    def __exit__(self, *exc):
+        if self.directory is not None:
+            subprocess.call([_pg_bin('pg_ctl'), 'stop', '-D', os.path.join(self.directory, 'data'), '-m', 'fast'],
+                            stdout=subprocess.DEVNULL)
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+    def connect(self):
+        return psycopg2.connect(self.uri)
+
+    def _start(self):
+        self.directory = tempfile.mkdtemp(prefix='culpa-bench-')
+        data = os.path.join(self.directory, 'data')
+        port = _free_port()
+
+        subprocess.check_call([_pg_bin('initdb'), '-D', data, '-U', 'bench', '-A', 'trust'],
+                              stdout=subprocess.DEVNULL)
+        subprocess.check_call([_pg_bin('pg_ctl'), 'start', '-w', '-D', data,
+                               '-l', os.path.join(self.directory, 'postgres.log'),
+                               '-o', "-p {} -k {} -c listen_addresses='' -c fsync=off".format(port, self.directory)],
+                              stdout=subprocess.DEVNULL)
+        subprocess.check_call([_pg_bin('createdb'), '-h', self.directory, '-p', str(port), '-U', 'bench', 'bench'])
+
+        self.uri = 'postgresql://bench@/bench?host={}&port={}'.format(self.directory, port)
+
+    def _apply_schema(self):
+        conn = self.connect()
+        try:
+            with conn, conn.cursor() as cur:
+                for path in [SCHEMA] + sorted(glob.glob(os.path.join(MIGRATIONS, '*.sql'))):
+                    with open(path) as f:
+                        cur.execute(f.read())
+        finally:
+            conn.close()
@@ -0,0 +1,219 @@
+import itertools
+import json
+import random
+import threading
+import time
+from collections import defaultdict
+
+from .data import PASSWORD
+
+# relative weight of each scenario in the default mix
+MIX = {
+    'home': 2,
+    'search': 15,
+    'suggest': 15,
+    'course': 25,
+    'teacher': 10,
+    'reviews': 8,
+    'departments': 3,
+    'department': 7,
+    'department_top': 3,
+    'trending': 2,
+    'vote_burst': 10,
+    'register': 2,
+}
+
+# votes cast by one vote_burst, like a user going down a page of reviews
+VOTE_BURST = 5
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of an already sorted list"""
+    if not values:
+        return 0.0
+    rank = max(int(round(p / 100.0 * len(values))) - 1, 0)
+    return values[min(rank, len(values) - 1)]
+
+
+class Recorder(object):
+    """Latencies, statuses and query counts of every request, grouped by scenario name"""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.queries = defaultdict(list)
+        self.errors = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def record(self, name, seconds, response):
+        queries = response.headers.get('X-DB-Queries')
+        with self._lock:
+            self.latencies[name].append(seconds)
+            if queries is not None:
+                self.queries[name].append(int(queries))
+            if response.status_code >= 500:
+                self.errors[name] += 1
+
+    def summary(self, elapsed):
+        endpoints = {}
+        for name, latencies in sorted(self.latencies.items()):
+            latencies = sorted(latencies)
+            queries = self.queries[name]
+            endpoints[name] = {
+                'requests': len(latencies),
+                'errors': self.errors[name],
+                'throughput': len(latencies) / elapsed,
+                'mean': sum(latencies) / len(latencies),
+                'p50': percentile(latencies, 50),
+                'p95': percentile(latencies, 95),
+                'p99': percentile(latencies, 99),
+                'queries': sum(queries) / len(queries) if queries else None,
+            }
+
+        total = sorted(itertools.chain.from_iterable(self.latencies.values()))
+        return {
+            'elapsed': elapsed,
+            'requests': len(total),
+            'errors': sum(self.errors.values()),
+            'throughput': len(total) / elapsed,
+            'p50': percentile(total, 50),
+            'p95': percentile(total, 95),
+            'p99': percentile(total, 99),
+            'endpoints': endpoints,
+        }
+
+
+class Visitor(object):
+    """
+    One simulated browser with its own test client and session. Half of the visitors are
+    logged in, which also keeps them off the anonymous page cache.
+    """
+
+    def __init__(self, app, dataset, recorder, seed, index):
+        self.client = app.test_client()
+        self.dataset = dataset
+        self.recorder = recorder
+        self.rng = random.Random(seed * 1000 + index)
+        self.index = index
+        self.registered = 0
+        self.uni = None
+        # same skew as the generated reviews, popular courses get most of the traffic
+        self.course_weights = list(itertools.accumulate(1.0 / (i + 1) for i in range(len(dataset['courses']))))
+
+        if self.rng.random() < 0.5:
+            self.login(self.rng.choice(dataset['users']))
+
+    def login(self, uni):
+        # skips the login form, whose password check would dominate every other timing
+        with self.client.session_transaction() as session:
+            session['user_id'] = uni
+            session['_fresh'] = True
+        self.uni = uni
+
+    def request(self, name, method, url, **kwargs):
+        start = time.perf_counter()
+        response = self.client.open(url, method=method, **kwargs)
+        self.recorder.record(name, time.perf_counter() - start, response)
+        return response
+
+    def run(self, scenario):
+        getattr(self, scenario)()
+
+    def home(self):
+        self.request('home', 'GET', '/')
+
+    def search(self):
+        self.request('search', 'GET', '/search', query_string={'query': self.rng.choice(self.dataset['search_terms'])})
+
+    def suggest(self):
+        term = self.rng.choice(self.dataset['search_terms'])
+        # a few keystrokes of a word
+        for n in range(2, min(len(term), 5) + 1):
+            self.request('suggest', 'GET', '/search/suggest', query_string={'q': term[:n]})
+
+    def course(self):
+        c_id = self.rng.choices(self.dataset['courses'], cum_weights=self.course_weights)[0]
+        self.request('course', 'GET', '/courses/{}'.format(c_id))
+
+    def teacher(self):
+        self.request('teacher', 'GET', '/teachers/{}'.format(self.rng.choice(self.dataset['teachers'])))
+
+    def reviews(self):
+        c_id = self.rng.choices(self.dataset['courses'], cum_weights=self.course_weights)[0]
+        url = '/reviews/course/{}'.format(c_id)
+        # follow the load more links a couple of pages down
+        for _ in range(3):
+            response = self.request('reviews', 'GET', url)
+            url = response.status_code == 200 and json.loads(response.get_data(as_text=True))['next']
+            if not url:
+                break
+
+    def departments(self):
+        self.request('departments', 'GET', '/departments')
+
+    def department(self):
+        self.request('department', 'GET', '/departments/{}'.format(self.rng.choice(self.dataset['departments'])))
+
+    def department_top(self):
+        self.request('department_top', 'GET', '/departments/{}/top'.format(self.rng.choice(self.dataset['departments'])),
+                     query_string={'by': self.rng.choice(['rating', 'helpful', 'reviews', 'active'])})
+
+    def trending(self):
+        self.request('trending', 'GET', '/trending')
+
+    def vote_burst(self):
+        if self.uni is None:
+            self.login(self.rng.choice(self.dataset['users']))
+        for _ in range(VOTE_BURST):
+            choice = self.rng.choice(['agree', 'disagree'])
+            self.request('vote', 'POST', '/vote/{}'.format(self.rng.randint(1, self.dataset['reviews'])),
+                         data={choice: choice.capitalize()})
+
+    def register(self):
+        self.registered += 1
+        self.request('register', 'POST', '/auth/register', data={
+            'uni': 'zz{}'.format(self.index * 100000 + self.registered),
+            'first': 'Bench',
+            'last': 'User',
+            'grad_year': 2030,
+            'school': 'seas',
+            'password': PASSWORD,
+            'password2': PASSWORD,
+        })
+
+
+def run(app, dataset, requests=1000, threads=4, seed=0, mix=None, warmup=50):
+    """
+    Drives the app with a weighted mix of scenarios from several threads at once
+
+    :param requests: number of scenarios to run in total, some of which issue several requests
+    :param warmup: scenarios run first and left out of the results, to fill caches and pools
+    :return: summary from Recorder.summary
+    """
+    mix = mix or MIX
+    names = sorted(mix)
+    weights = list(itertools.accumulate(mix[name] for name in names))
+
+    rng = random.Random(seed)
+    plan = rng.choices(names, cum_weights=weights, k=warmup + requests)
+    warmup_plan, plan = plan[:warmup], plan[warmup:]
+
+    visitors = [Visitor(app, dataset, Recorder(), seed, i) for i in range(threads)]
+    for i, scenario in enumerate(warmup_plan):
+        visitors[i % threads].run(scenario)
+
+    recorder = Recorder()
+    for visitor in visitors:
+        visitor.recorder = recorder
+
+    def work(visitor, scenarios):
+        for scenario in scenarios:
+            visitor.run(scenario)
+
+    workers = [threading.Thread(target=work, args=(visitor, plan[i::threads])) for i, visitor in enumerate(visitors)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    return recorder.summary(time.perf_counter() - start)
@@ -0,0 +1,60 @@
+import random
+import timeit
+
+from app.cache import MISSING, LRUBackend
+from app.search import prefix_tsquery, terms
+from app.sentiment import score
+from app.suggest import SuggestionIndex
+
+from .data import LAST, LEVELS, SUBJECTS, WORDS
+
+
+def _suggestion_index(rng, size):
+    index = SuggestionIndex()
+    entries = []
+    for i in range(size):
+        name = '{} {} {}'.format(rng.choice(LEVELS), rng.choice(SUBJECTS), i)
+        entries.extend(index._course_entries('C{:05d}'.format(i), name, 'COMS{}'.format(1000 + i)))
+    index._swap(entries)
+    return index
+
+
+def cases(seed=0):
+    """(name, callable) pairs of the hot pure-python paths, none of which touch the database"""
+    rng = random.Random(seed)
+    review = ' '.join(rng.choice(WORDS) for _ in range(200))
+    query = 'Intro to {} with {}'.format(rng.choice(SUBJECTS), rng.choice(LAST))
+
+    index = _suggestion_index(rng, 5000)
+    prefixes = [s[:3].lower() for s in SUBJECTS]
+
+    lru = LRUBackend(max_entries=1000)
+    keys = ['course:C{:05d}'.format(i) for i in range(2000)]
+
+    def suggest():
+        for prefix in prefixes:
+            index.suggest(prefix)
+
+    def cache_churn():
+        for key in keys:
+            if lru.get(key) is MISSING:
+                lru.set(key, key, 300)
+
+    return [
+        ('sentiment.score', lambda: score(review)),
+        ('search.prefix_tsquery', lambda: prefix_tsquery(terms(query))),
+        ('suggest.suggest', suggest),
+        ('cache.lru_churn', cache_churn),
+    ]
+
+
+def run(seed=0, repeat=5):
+    """
+    :return: {name: best seconds per call} over repeat rounds of timeit
+    """
+    results = {}
+    for name, func in cases(seed):
+        timer = timeit.Timer(func)
+        number, _ = timer.autorange()
+        results[name] = min(timer.repeat(repeat, number)) / number
+    return results
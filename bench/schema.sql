@@ -0,0 +1,66 @@
+-- Base schema the app was written against, used to build local benchmark databases.
+-- The numbered files in migrations/ are applied on top of it.
+
+CREATE TABLE users (
+    uni text PRIMARY KEY,
+    name text NOT NULL,
+    year integer,
+    password_hash text NOT NULL,
+    school text,
+    num_reviews integer NOT NULL DEFAULT 0
+);
+
+CREATE TABLE departments (
+    d_id text PRIMARY KEY,
+    name text NOT NULL,
+    abbrev text
+);
+
+CREATE TABLE courses (
+    c_id text PRIMARY KEY,
+    name text NOT NULL,
+    abbrev text,
+    views text[] NOT NULL DEFAULT '{}'
+);
+
+CREATE TABLE teachers (
+    uni text PRIMARY KEY,
+    name text NOT NULL
+);
+
+CREATE TABLE teaches (
+    uni text NOT NULL REFERENCES teachers,
+    c_id text NOT NULL REFERENCES courses,
+    PRIMARY KEY (uni, c_id)
+);
+
+CREATE TABLE course_department (
+    c_id text NOT NULL REFERENCES courses,
+    d_id text NOT NULL REFERENCES departments,
+    PRIMARY KEY (c_id, d_id)
+);
+
+CREATE TABLE teachers_department (
+    uni text NOT NULL REFERENCES teachers,
+    d_id text NOT NULL REFERENCES departments,
+    PRIMARY KEY (uni, d_id)
+);
+
+CREATE TABLE reviews (
+    r_id serial PRIMARY KEY,
+    c_id text NOT NULL REFERENCES courses,
+    uni text NOT NULL REFERENCES users,
+    teacher_uni text NOT NULL REFERENCES teachers,
+    general_content text NOT NULL,
+    workload_content text,
+    sentiment_score integer NOT NULL DEFAULT 0,
+    written_on timestamp NOT NULL
+);
+
+CREATE TABLE votes (
+    uni text NOT NULL REFERENCES users,
+    r_id integer NOT NULL REFERENCES reviews,
+    voted_on timestamp NOT NULL,
+    liked boolean NOT NULL,
+    PRIMARY KEY (uni, r_id)
+);
@@ -0,0 +1,107 @@
+import os
+
+
+def _env_int(name, default):
+    return int(os.environ.get(name, default))
+
+
+class Config:
+    SECRET_KEY = os.environ.get('SECRET_KEY')
+    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or \
+        'postgresql://jz2814:{}@35.227.79.146/proj1part2'.format(os.environ.get('DB_PASSWORD'))
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SQLALCHEMY_POOL_SIZE = _env_int('DB_POOL_SIZE', 10)
+    SQLALCHEMY_MAX_OVERFLOW = _env_int('DB_MAX_OVERFLOW', 5)
+    SQLALCHEMY_POOL_RECYCLE = _env_int('DB_POOL_RECYCLE', 1800)
+    SQLALCHEMY_POOL_PRE_PING = True
+    # milliseconds, 0 leaves postgres' default of no limit
+    SQLALCHEMY_STATEMENT_TIMEOUT = _env_int('DB_STATEMENT_TIMEOUT', 0)
+    # comma separated, read-only finders are spread over these when set
+    SQLALCHEMY_REPLICA_URIS = [uri for uri in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if uri]
+
+    CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'lru')
+    CACHE_REDIS_URL = os.environ.get('CACHE_REDIS_URL', 'redis://localhost:6379/0')
+    # seconds a logged in user is served from the cache instead of the database
+    USER_CACHE_TTL = 60
+    RATELIMIT_BACKEND = os.environ.get('RATELIMIT_BACKEND', 'memory')
+    # proxies in front of the app whose X-Forwarded-For is trusted for the client address,
+    # which keys the rate limits of anonymous visitors
+    PROXY_HOPS = _env_int('PROXY_HOPS', 0)
+    # processes hashing passwords per app process, 0 hashes in the request thread
+    PASSWORD_WORKERS = _env_int('PASSWORD_WORKERS', 2)
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:50000')
+    # file the department directory is written to and started from, see app/directory.py
+    DIRECTORY_SNAPSHOT_PATH = os.environ.get('DIRECTORY_SNAPSHOT_PATH')
+    # bearer token for /metrics and /debug/queries, which are otherwise only served to localhost
+    PROFILER_TOKEN = os.environ.get('PROFILER_TOKEN')
+    # where `flask assets build` writes the fingerprinted assets, see app/assets.py
+    ASSETS_BUILD_DIR = os.environ.get('ASSETS_BUILD_DIR')
+    # bootstrap and jquery come from app/assets.py, never from a CDN
+    BOOTSTRAP_SERVE_LOCAL = True
+
+    TEMPLATES_AUTO_RELOAD = False
+    SEARCH_RESULTS_PER_PAGE = 20
+    REVIEWS_PER_PAGE = 20
+    TRENDING_PAGE_SIZE = 20
+    STREAM_REVIEW_PAGES = False
+
+    @staticmethod
+    def init_app(app):
+        pass
+
+
+class DevelopmentConfig(Config):
+    DEBUG = True
+    TEMPLATES_AUTO_RELOAD = True
+    SQLALCHEMY_DATABASE_URI = os.environ.get('DEV_DATABASE_URL') or Config.SQLALCHEMY_DATABASE_URI
+
+
+class TestingConfig(Config):
+    TESTING = True
+    SECRET_KEY = 'testing'
+    SQLALCHEMY_DATABASE_URI = os.environ.get('TEST_DATABASE_URL') or Config.SQLALCHEMY_DATABASE_URI
+    SQLALCHEMY_POOL_SIZE = 2
+    SQLALCHEMY_MAX_OVERFLOW = 0
+    SQLALCHEMY_STATEMENT_TIMEOUT = 5000
+    WTF_CSRF_ENABLED = False
+    CACHE_BACKEND = 'null'
+    SENTIMENT_WORKER = False
+    VOTE_QUEUE_ASYNC = False
+    RATELIMIT_ENABLED = False
+    PASSWORD_WORKERS = 0
+
+
+class ProductionConfig(Config):
+    SQLALCHEMY_POOL_SIZE = _env_int('DB_POOL_SIZE', 5)
+    SQLALCHEMY_MAX_OVERFLOW = _env_int('DB_MAX_OVERFLOW', 5)
+    SQLALCHEMY_STATEMENT_TIMEOUT = _env_int('DB_STATEMENT_TIMEOUT', 5000)
+    PROFILER_HEADERS = False
+    PROXY_HOPS = _env_int('PROXY_HOPS', 1)
+    # off unless a token guards it, a proxy in front of the app makes every request look local
+    PROFILER_METRICS = bool(os.environ.get('PROFILER_TOKEN'))
+
+    @classmethod
+    def init_app(cls, app):
+        Config.init_app(app)
+        if not app.config['SECRET_KEY']:
+            raise RuntimeError('SECRET_KEY must be set in production')
+
+
+class BenchConfig(ProductionConfig):
+    """Production settings, plus the per-request numbers the benchmark driver reads"""
+    SECRET_KEY = 'bench'
+    SQLALCHEMY_DATABASE_URI = os.environ.get('BENCH_DATABASE_URI') or Config.SQLALCHEMY_DATABASE_URI
+    WTF_CSRF_ENABLED = False
+    PROFILER_HEADERS = True
+    # the driver is a single visitor sending every request
+    RATELIMIT_ENABLED = False
+
+
+config = {
+    'development': DevelopmentConfig,
+    'testing': TestingConfig,
+    'production': ProductionConfig,
+    'bench': BenchConfig,
+
+    'default': DevelopmentConfig
+}
@@ -0,0 +1,31 @@
+# gunicorn -c gunicorn.conf.py wsgi:app
+import multiprocessing
+import os
+
+bind = os.environ.get('BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+# requests mostly wait on postgres, so a few threads per worker keep the cores busy;
+# keep SQLALCHEMY_POOL_SIZE + SQLALCHEMY_MAX_OVERFLOW at or above this
+worker_class = 'gthread'
+threads = int(os.environ.get('THREADS', 4))
+
+# import the app and warm its caches once in the master, workers share the pages copy-on-write
+preload_app = True
+
+timeout = 30
+graceful_timeout = 30
+keepalive = 5
+# recycle workers now and then, staggered so they do not all restart at once
+max_requests = 5000
+max_requests_jitter = 500
+
+accesslog = '-'
+
+
+def post_fork(server, worker):
+    # connections opened while warming must not be shared between processes
+    from app import db, replicas
+    from wsgi import app
+
+    db.get_engine(app).dispose()
+    replicas.dispose()
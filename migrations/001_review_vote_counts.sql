@@ -0,0 +1,16 @@
+-- Denormalized agree/disagree tallies, moved by the net change of every batch of votes
+-- Vote.save_many writes for the VoteQueue (app/votes.py).
+-- Run `flask reconcile-votes` at any time to rebuild them from the votes table.
+
+ALTER TABLE reviews ADD COLUMN IF NOT EXISTS agree integer NOT NULL DEFAULT 0;
+ALTER TABLE reviews ADD COLUMN IF NOT EXISTS disagree integer NOT NULL DEFAULT 0;
+
+UPDATE reviews r SET agree = vc.agree, disagree = vc.disagree
+FROM (
+    SELECT v.r_id,
+           COUNT(*) FILTER (WHERE v.liked) AS agree,
+           COUNT(*) FILTER (WHERE NOT v.liked) AS disagree
+    FROM votes v
+    GROUP BY v.r_id
+) vc
+WHERE r.r_id = vc.r_id;
@@ -0,0 +1,10 @@
+-- Append-only history of course page views in hourly buckets, written in batches by
+-- ViewBuffer. A (course, hour) pair may appear in several rows; sum them when reading.
+
+CREATE TABLE IF NOT EXISTS course_views (
+    c_id text NOT NULL,
+    hour timestamp NOT NULL,
+    views integer NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS course_views_c_id_hour ON course_views (c_id, hour);
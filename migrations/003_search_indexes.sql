@@ -0,0 +1,13 @@
+-- Indexes backing Course.search and Teacher.search. The indexed expressions must match
+-- the ones used in those queries exactly for the planner to pick them up. The trigram
+-- indexes serve the <% (word similarity) operator, which needs PostgreSQL 9.6.
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX IF NOT EXISTS courses_search_tsv ON courses
+    USING gin (to_tsvector('simple', coalesce(name, '') || ' ' || coalesce(abbrev, '')));
+CREATE INDEX IF NOT EXISTS courses_name_trgm ON courses USING gin (lower(name) gin_trgm_ops);
+
+CREATE INDEX IF NOT EXISTS teachers_search_tsv ON teachers
+    USING gin (to_tsvector('simple', coalesce(name, '') || ' ' || uni));
+CREATE INDEX IF NOT EXISTS teachers_name_trgm ON teachers USING gin (lower(name) gin_trgm_ops);
@@ -0,0 +1,6 @@
+-- Keyset pagination of reviews by course, teacher and author, newest first.
+-- The review statements in app/queries.py seek on (written_on, r_id), so each page is an index range scan.
+
+CREATE INDEX IF NOT EXISTS reviews_c_id_written_on ON reviews (c_id, written_on DESC, r_id DESC);
+CREATE INDEX IF NOT EXISTS reviews_teacher_uni_written_on ON reviews (teacher_uni, written_on DESC, r_id DESC);
+CREATE INDEX IF NOT EXISTS reviews_uni_written_on ON reviews (uni, written_on DESC, r_id DESC);
@@ -0,0 +1,16 @@
+-- Queue of reviews waiting for a sentiment score, drained by SentimentWorker.
+-- Scores are fractions in [-1, 1], so sentiment_score is widened to a real.
+
+CREATE TABLE IF NOT EXISTS sentiment_jobs (
+    r_id integer PRIMARY KEY,
+    enqueued_on timestamp NOT NULL DEFAULT now()
+);
+
+CREATE INDEX IF NOT EXISTS sentiment_jobs_enqueued_on ON sentiment_jobs (enqueued_on);
+
+ALTER TABLE reviews ALTER COLUMN sentiment_score TYPE real;
+
+-- reviews written before the queue existed
+INSERT INTO sentiment_jobs (r_id)
+SELECT r_id FROM reviews WHERE sentiment_score = 0
+ON CONFLICT DO NOTHING;
@@ -0,0 +1,41 @@
+-- Review aggregates per course, per teacher and per (course, teacher), maintained by
+-- ReviewStats.add whenever a review, a vote or a sentiment score is written.
+-- Fill them for existing reviews with `flask rebuild-stats`, which can be re-run at any time.
+-- activity is a count of reviews and votes decayed by age, as of activity_at.
+
+CREATE TABLE IF NOT EXISTS course_stats (
+    c_id text PRIMARY KEY,
+    reviews integer NOT NULL DEFAULT 0,
+    sentiment_sum double precision NOT NULL DEFAULT 0,
+    agree integer NOT NULL DEFAULT 0,
+    disagree integer NOT NULL DEFAULT 0,
+    activity double precision NOT NULL DEFAULT 0,
+    activity_at timestamptz NOT NULL DEFAULT now()
+);
+
+CREATE TABLE IF NOT EXISTS teacher_stats (
+    uni text PRIMARY KEY,
+    reviews integer NOT NULL DEFAULT 0,
+    sentiment_sum double precision NOT NULL DEFAULT 0,
+    agree integer NOT NULL DEFAULT 0,
+    disagree integer NOT NULL DEFAULT 0,
+    activity double precision NOT NULL DEFAULT 0,
+    activity_at timestamptz NOT NULL DEFAULT now()
+);
+
+CREATE TABLE IF NOT EXISTS course_teacher_stats (
+    c_id text NOT NULL,
+    uni text NOT NULL,
+    reviews integer NOT NULL DEFAULT 0,
+    sentiment_sum double precision NOT NULL DEFAULT 0,
+    agree integer NOT NULL DEFAULT 0,
+    disagree integer NOT NULL DEFAULT 0,
+    activity double precision NOT NULL DEFAULT 0,
+    activity_at timestamptz NOT NULL DEFAULT now(),
+    PRIMARY KEY (c_id, uni)
+);
+
+CREATE INDEX IF NOT EXISTS course_teacher_stats_uni ON course_teacher_stats (uni);
+
+-- top courses of a department start from its course list
+CREATE INDEX IF NOT EXISTS course_department_d_id ON course_department (d_id);
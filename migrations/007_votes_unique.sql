@@ -0,0 +1,9 @@
+-- Vote.save_many upserts with ON CONFLICT (uni, r_id), which needs a unique index.
+-- Duplicate votes are dropped first, keeping the latest; run `flask reconcile-votes` afterwards.
+
+DELETE FROM votes a
+USING votes b
+WHERE a.uni = b.uni AND a.r_id = b.r_id
+  AND (a.voted_on, a.ctid) < (b.voted_on, b.ctid);
+
+CREATE UNIQUE INDEX IF NOT EXISTS votes_uni_r_id ON votes (uni, r_id);
@@ -0,0 +1,13 @@
+-- Checkpoints of the trending engine in app/trending.py. Every app process merges the
+-- popularity it collected from views, reviews and votes into this table once a minute
+-- and reloads its rankings from it.
+-- score is the log of the decayed popularity scaled to 2018-01-01 (trending.EPOCH), so rows
+-- never need rewriting as time passes and ordering by it orders by current popularity.
+
+CREATE TABLE IF NOT EXISTS course_trending (
+    c_id text PRIMARY KEY REFERENCES courses ON DELETE CASCADE,
+    score double precision NOT NULL,
+    updated_at timestamptz NOT NULL DEFAULT now()
+);
+
+CREATE INDEX IF NOT EXISTS course_trending_score ON course_trending (score DESC);
@@ -0,0 +1,11 @@
+-- Versions of the entities behind cached pages and fragments, see app/page_cache.py.
+-- touch() sets an entity's version to the current time, an entity without a row has version 0.
+-- The row with ident '*' holds the version of every entity of its kind, set by touch_all().
+-- Kept here rather than in the cache so that every worker sees a change as soon as it is made.
+
+CREATE TABLE IF NOT EXISTS cache_versions (
+    kind text NOT NULL,
+    ident text NOT NULL,
+    version double precision NOT NULL,
+    PRIMARY KEY (kind, ident)
+);
@@ -1,7 +1,13 @@
-from app import create_app, db
-from app.models import User, Course, Review
+import os
 
-app = create_app()
+import click
+
+from app import assets, create_app, db, directory, sentiment_worker
+from app.catalog import FORMATS, TABLES, export_catalog, import_catalog
+from app.sentiment import backfill
+from app.models import User, Course, Review, ReviewStats, warm_cache
+
+app = create_app(os.environ.get('FLASK_CONFIG') or 'default')
 
 @app.shell_context_processor
 def make_shell_context():
@@ -11,3 +17,104 @@ def make_shell_context():
                 Course=Course,
                 Review=Review)
 
+
+@app.cli.command()
+def test():
+    """Run the unit tests."""
+    import unittest
+    tests = unittest.TestLoader().discover('tests')
+    unittest.TextTestRunner(verbosity=2).run(tests)
+
+
+@app.cli.command('reconcile-votes')
+def reconcile_votes():
+    """Rebuild review agree/disagree counters from the votes table."""
+    reconciled = Review.reconcile_votes()
+    print(f'{reconciled} reviews reconciled')
+    if reconciled:
+        # the stats summed the drifted counters
+        print(f'{ReviewStats.rebuild()} course/teacher pairs rebuilt')
+
+
+@app.cli.command('rebuild-stats')
+def rebuild_stats():
+    """Recompute course and teacher review stats from reviews and votes."""
+    print(f'{ReviewStats.rebuild()} course/teacher pairs rebuilt')
+
+
+@app.cli.command('score-reviews')
+@click.option('--all', 'rescore_all', is_flag=True, help='Rescore every review instead of draining the queue.')
+@click.option('--processes', type=int, default=None, help='Scoring processes for --all, one per core by default.')
+def score_reviews(rescore_all, processes):
+    """Score queued reviews, or backfill sentiment for the whole corpus."""
+    if rescore_all:
+        print(f'{backfill(processes=processes)} reviews scored')
+        return
+
+    scored = 0
+    while True:
+        batch = sentiment_worker.run_once()
+        scored += batch
+        if batch < app.config['SENTIMENT_BATCH_SIZE']:
+            break
+    print(f'{scored} reviews scored')
+
+
+@app.cli.command('warm-cache')
+def warm_cache_command():
+    """Load the department directory and the suggestion index, e.g. to write DIRECTORY_SNAPSHOT_PATH."""
+    print(f'{warm_cache()} departments cached')
+
+
+@app.cli.command('build-directory')
+def build_directory():
+    """Rebuild the department directory, writing DIRECTORY_SNAPSHOT_PATH when it is set."""
+    print(f'{len(directory.load(rebuild=True).departments)} departments in the directory')
+
+
+@app.cli.group()
+def catalog():
+    """Bulk load or dump departments, courses, teachers and their links."""
+
+
+@catalog.command('import')
+@click.argument('paths', nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False))
+@click.option('--skip-invalid', is_flag=True, help='Drop rows with unknown references instead of aborting.')
+def catalog_import(paths, skip_invalid):
+    """Upsert <table>.csv / <table>.jsonl files in one transaction.
+
+    Running web workers pick the changes up within DIRECTORY_CHECK_INTERVAL seconds.
+    """
+    try:
+        results = import_catalog(paths, skip_invalid)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    for table, read, rejected, inserted, updated in results:
+        print(f'{table}: {read} read, {rejected} rejected, {inserted} inserted, {updated} updated')
+    print(f'Running workers reload the catalog within {app.config["DIRECTORY_CHECK_INTERVAL"]} seconds')
+
+
+@catalog.command('export')
+@click.argument('directory', type=click.Path(exists=True, file_okay=False, writable=True))
+@click.option('--format', 'fmt', type=click.Choice(FORMATS), default='csv')
+@click.option('--table', 'tables', multiple=True, type=click.Choice(sorted(TABLES)),
+              help='Table to export, repeatable. All of them by default.')
+def catalog_export(directory, fmt, tables):
+    """Write every catalog table to DIRECTORY/<table>.<format>."""
+    for path in export_catalog(directory, fmt, tables):
+        print(path)
+
+
+@app.cli.group('assets')
+def assets_group():
+    """Fingerprint and precompress the stylesheets, scripts and fonts."""
+
+
+@assets_group.command('build')
+def assets_build():
+    """Write every asset, its .gz and .br copies and the manifest to ASSETS_BUILD_DIR."""
+    built = assets.build()
+    for name, built_name, size, compressed in built:
+        sizes = ', '.join(f'{encoding} {compressed[encoding]}' for encoding in sorted(compressed))
+        print(f'{built_name}: {size} bytes' + (f' ({sizes})' if sizes else ''))
+    print(f'{len(built)} assets written to {app.config["ASSETS_BUILD_DIR"]}')
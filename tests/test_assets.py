@@ -0,0 +1,49 @@
+import unittest
+
+from app.assets import Assets, fingerprint
+
+
+class FingerprintTestCase(unittest.TestCase):
+    def test_hash_before_extension(self):
+        name = fingerprint('css/styles.css', b'body{}')
+        self.assertRegex(name, r'^css/styles\.[0-9a-f]{12}\.css$')
+        self.assertEqual(name, fingerprint('css/styles.css', b'body{}'))
+        self.assertNotEqual(name, fingerprint('css/styles.css', b'body{color:red}'))
+
+
+class RewriteTestCase(unittest.TestCase):
+    def setUp(self):
+        self.assets = Assets()
+        self.manifest = {
+            'vendor/bootstrap/css/bootstrap.min.css.map': 'vendor/bootstrap/css/bootstrap.min.css.0123456789ab.map',
+            'vendor/bootstrap/fonts/g.eot': 'vendor/bootstrap/fonts/g.73cb3858a687.eot',
+            'js/app.js.map': 'js/app.js.ba9876543210.map',
+        }
+
+    def rewrite(self, name, text):
+        return self.assets._rewrite(name, text.encode('utf-8'), self.manifest).decode('utf-8')
+
+    def test_css_urls_and_source_map(self):
+        css = ('a{src:url(../fonts/g.eot?#x)}\n'
+               '/*# sourceMappingURL=bootstrap.min.css.map */')
+        self.assertEqual(self.rewrite('vendor/bootstrap/css/bootstrap.min.css', css),
+                         'a{src:url(../fonts/g.73cb3858a687.eot?#x)}\n'
+                         '/*# sourceMappingURL=bootstrap.min.css.0123456789ab.map */')
+
+    def test_quoted_url(self):
+        self.assertEqual(self.rewrite('vendor/bootstrap/css/x.css', "a{src:url('../fonts/g.eot')}"),
+                         "a{src:url('../fonts/g.73cb3858a687.eot')}")
+
+    def test_script_source_map(self):
+        self.assertEqual(self.rewrite('js/app.js', 'x()\n//# sourceMappingURL=app.js.map'),
+                         'x()\n//# sourceMappingURL=app.js.ba9876543210.map')
+
+    def test_missing_source_map_is_dropped(self):
+        self.assertEqual(self.rewrite('js/other.js', 'x()\n//# sourceMappingURL=other.js.map'), 'x()\n')
+
+    def test_other_references_left_alone(self):
+        css = ('a{background:url(data:image/png;base64,AAAA)}'
+               'b{background:url(/static/x.png)}'
+               'c{background:url(missing.png)}\n'
+               '/*# sourceMappingURL=https://cdn.example.com/x.css.map */')
+        self.assertEqual(self.rewrite('css/x.css', css), css)
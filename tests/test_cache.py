@@ -0,0 +1,56 @@
+import unittest
+from unittest import mock
+
+from app.cache import MISSING, Cache, LRUBackend
+
+
+class LRUBackendTestCase(unittest.TestCase):
+    def test_evicts_least_recently_used(self):
+        backend = LRUBackend(max_entries=2)
+        backend.set('a', 1, 60)
+        backend.set('b', 2, 60)
+        self.assertEqual(backend.get('a'), 1)
+        backend.set('c', 3, 60)
+        self.assertIs(backend.get('b'), MISSING)
+        self.assertEqual((backend.get('a'), backend.get('c')), (1, 3))
+        self.assertEqual((len(backend), backend.evictions), (2, 1))
+
+    def test_expires_after_ttl(self):
+        backend = LRUBackend()
+        with mock.patch('app.cache.time.monotonic', return_value=100.0):
+            backend.set('a', 1, 10)
+        with mock.patch('app.cache.time.monotonic', return_value=105.0):
+            self.assertEqual(backend.get('a'), 1)
+        with mock.patch('app.cache.time.monotonic', return_value=111.0):
+            self.assertIs(backend.get('a'), MISSING)
+        self.assertEqual((len(backend), backend.evictions), (0, 1))
+
+
+class CacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.cache = Cache()
+        self.cache.backend = LRUBackend(max_entries=1)
+
+    def test_get_or_set_loads_once(self):
+        loader = mock.Mock(return_value='value')
+        self.assertEqual(self.cache.get_or_set('k', loader), 'value')
+        self.assertEqual(self.cache.get_or_set('k', loader), 'value')
+        loader.assert_called_once_with()
+
+    def test_stats(self):
+        self.cache.get_or_set('a', lambda: 1)
+        self.cache.get_or_set('a', lambda: 1)
+        self.cache.get_or_set('b', lambda: 2)
+        self.assertEqual(self.cache.stats(), {
+            'backend': 'LRUBackend',
+            'entries': 1,
+            'hits': 1,
+            'misses': 2,
+            'evictions': 1,
+        })
+
+    def test_null_backend(self):
+        self.cache.backend = None
+        self.cache.set('a', 1)
+        self.assertIs(self.cache.get('a'), MISSING)
+        self.assertEqual(self.cache.stats()['backend'], None)
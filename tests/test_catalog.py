@@ -0,0 +1,53 @@
+import io
+import unittest
+
+from app.catalog import _copy_text, _JSONLines
+
+
+class CopyTextTestCase(unittest.TestCase):
+    def test_null(self):
+        self.assertEqual(_copy_text(None), '\\N')
+
+    def test_escapes(self):
+        self.assertEqual(_copy_text('a\tb\nc\rd\\e'), 'a\\tb\\nc\\rd\\\\e')
+        # a literal backslash N is not NULL
+        self.assertEqual(_copy_text('\\N'), '\\\\N')
+
+    def test_non_strings(self):
+        self.assertEqual(_copy_text(12), '12')
+        self.assertEqual(_copy_text(''), '')
+
+
+class JSONLinesTestCase(unittest.TestCase):
+    def lines(self, text):
+        return _JSONLines(io.StringIO(text), ('c_id', 'name', 'abbrev'))
+
+    def test_columns_in_order(self):
+        f = self.lines('{"name": "Databases", "c_id": "C1", "abbrev": "W4111"}\n'
+                       '{"c_id": "C2", "name": "Tab\\there"}\n')
+        self.assertEqual(f.read(), 'C1\tDatabases\tW4111\nC2\tTab\\there\t\\N\n')
+        self.assertEqual(f.read(), '')
+
+    def test_sized_reads(self):
+        text = ''.join('{{"c_id": "C{0}", "name": "n{0}", "abbrev": "a{0}"}}\n'.format(i) for i in range(50))
+        expected = self.lines(text).read()
+
+        f = self.lines(text)
+        chunks = []
+        while True:
+            chunk = f.read(7)
+            if not chunk:
+                break
+            self.assertLessEqual(len(chunk), 7)
+            chunks.append(chunk)
+        self.assertEqual(''.join(chunks), expected)
+        self.assertEqual(f.line, 50)
+
+    def test_blank_lines_skipped(self):
+        f = self.lines('\n{"c_id": "C1", "name": "n", "abbrev": "a"}\n  \n')
+        self.assertEqual(f.read(), 'C1\tn\ta\n')
+
+    def test_malformed_line(self):
+        f = self.lines('{"c_id": "C1"}\n{broken\n')
+        with self.assertRaisesRegex(ValueError, '^line 2: '):
+            f.read()
@@ -0,0 +1,19 @@
+import unittest
+from datetime import datetime
+
+from app.models import Review
+
+
+class ReviewCursorTestCase(unittest.TestCase):
+    def test_round_trip(self):
+        review = Review('C1', 'ab1234', 'cd5678', '', '', r_id=42, written_on=datetime(2018, 3, 9, 14, 5, 7, 123456))
+        self.assertEqual(Review.parse_cursor(review.cursor()), (review.written_on, 42))
+
+    def test_whole_seconds(self):
+        review = Review('C1', 'ab1234', 'cd5678', '', '', r_id=1, written_on=datetime(2018, 1, 1))
+        self.assertEqual(Review.parse_cursor(review.cursor()), (datetime(2018, 1, 1), 1))
+
+    def test_malformed(self):
+        for cursor in ('', 'abc', '2018-01-01T00:00:00.000000_x', '2018-01-01_1'):
+            with self.assertRaises(ValueError):
+                Review.parse_cursor(cursor)
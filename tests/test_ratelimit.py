@@ -0,0 +1,71 @@
+import unittest
+from unittest import mock
+
+from app import create_app
+from app.ratelimit import MemoryBackend, RateLimited, RateLimiter
+
+
+class MemoryBackendTestCase(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch('app.ratelimit.time.monotonic', lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_burst_then_wait(self):
+        backend = MemoryBackend()
+        self.assertEqual([backend.take('k', 2, 3) for _ in range(3)], [0, 0, 0])
+        self.assertAlmostEqual(backend.take('k', 2, 3), 0.5)
+
+    def test_refills_at_rate(self):
+        backend = MemoryBackend()
+        backend.take('k', 2, 1)
+        self.assertGreater(backend.take('k', 2, 1), 0)
+        self.now += 0.5
+        self.assertEqual(backend.take('k', 2, 1), 0)
+
+    def test_never_exceeds_burst(self):
+        backend = MemoryBackend()
+        backend.take('k', 1, 2)
+        self.now += 100
+        self.assertEqual([backend.take('k', 1, 2) for _ in range(2)], [0, 0])
+        self.assertGreater(backend.take('k', 1, 2), 0)
+
+    def test_evicts_least_recently_used(self):
+        backend = MemoryBackend(max_keys=2)
+        backend.take('a', 1, 1)
+        backend.take('b', 1, 1)
+        # a is used again, so b is the one forgotten
+        backend.take('a', 1, 1)
+        backend.take('c', 1, 1)
+        self.assertEqual(list(backend._buckets), ['a', 'c'])
+        # a forgotten bucket starts full again
+        self.assertEqual(backend.take('b', 1, 1), 0)
+
+
+class RateLimiterTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing', {'RATELIMITS': {'search': (1, 2)}})
+        self.limiter = RateLimiter(self.app)
+
+    def test_stats_count_limited_requests(self):
+        with self.app.test_request_context(environ_base={'REMOTE_ADDR': '10.0.0.1'}):
+            self.limiter.check('search')
+            self.limiter.check('search')
+            with self.assertRaises(RateLimited) as cm:
+                self.limiter.check('search')
+        self.assertEqual(cm.exception.retry_after, 1)
+        self.assertEqual(self.limiter.stats(), {'limited_search': 1})
+
+    def test_visitors_have_their_own_buckets(self):
+        for addr in ('10.0.0.1', '10.0.0.2'):
+            with self.app.test_request_context(environ_base={'REMOTE_ADDR': addr}):
+                self.limiter.check('search')
+                self.limiter.check('search')
+        self.assertEqual(self.limiter.stats(), {})
+
+    def test_unknown_limit_is_not_limited(self):
+        with self.app.test_request_context():
+            for _ in range(10):
+                self.limiter.check('other')
+        self.assertEqual(self.limiter.stats(), {})
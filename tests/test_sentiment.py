@@ -0,0 +1,36 @@
+import unittest
+
+from app.sentiment import score, score_review
+
+
+class SentimentTestCase(unittest.TestCase):
+    def test_neutral_and_empty(self):
+        self.assertEqual(score(''), 0)
+        self.assertEqual(score(None), 0)
+        self.assertEqual(score('the lectures are on tuesdays'), 0)
+
+    def test_polarity(self):
+        self.assertGreater(score('a great and helpful professor'), 0)
+        self.assertLess(score('boring and confusing lectures'), 0)
+
+    def test_bounded(self):
+        self.assertLess(score('amazing ' * 100), 1)
+        self.assertGreater(score('awful ' * 100), -1)
+
+    def test_negation_flips(self):
+        self.assertLess(score('not helpful'), 0)
+        self.assertGreater(score('never boring'), 0)
+
+    def test_negation_scope(self):
+        # the negation reaches three words, not the fourth
+        self.assertAlmostEqual(score('not a b c great'), score('great'))
+
+    def test_intensifier_scales_next_word(self):
+        self.assertGreater(score('very good'), score('good'))
+        self.assertAlmostEqual(score('very the good'), score('good'))
+
+    def test_score_review_weights_general_twice(self):
+        r_id, value = score_review((7, 'great', ''))
+        self.assertEqual(r_id, 7)
+        self.assertAlmostEqual(value, round(2 * score('great') / 3, 4))
+        self.assertGreater(score_review((1, 'great', 'awful'))[1], 0)
@@ -0,0 +1,61 @@
+import unittest
+from collections import namedtuple
+from unittest import mock
+
+from app import create_app
+from app.models import Course, Teacher
+from app.suggest import SuggestionIndex
+
+CourseRow = namedtuple('CourseRow', 'c_id name abbrev')
+TeacherRow = namedtuple('TeacherRow', 'uni name')
+
+
+class SuggestionIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+
+        courses = [CourseRow('C1', 'Introduction to Databases', 'COMS W4111'),
+                   CourseRow('C2', 'Data Structures', 'COMS W3134')]
+        teachers = [TeacherRow('ad1234', 'Alice Data'), TeacherRow('bs5678', 'Bob Smith')]
+        self.index = SuggestionIndex()
+        with mock.patch.object(Course, 'find_all', return_value=courses), \
+                mock.patch.object(Teacher, 'find_all', return_value=teachers):
+            self.index.load()
+
+    def tearDown(self):
+        self.app_context.pop()
+
+    def test_prefix_of_any_word(self):
+        self.assertEqual(self.index.suggest('data'), [
+            ('teacher', 'ad1234', 'Alice Data'),
+            ('course', 'C2', 'Data Structures'),
+            ('course', 'C1', 'Introduction to Databases'),
+        ])
+
+    def test_every_term_must_match(self):
+        self.assertEqual(self.index.suggest('intro data'),
+                         [('course', 'C1', 'Introduction to Databases')])
+        self.assertEqual(self.index.suggest('intro smith'), [])
+
+    def test_abbreviation_and_uni(self):
+        self.assertEqual(self.index.suggest('w3134'), [('course', 'C2', 'Data Structures')])
+        self.assertEqual(self.index.suggest('bs56'), [('teacher', 'bs5678', 'Bob Smith')])
+
+    def test_case_insensitive(self):
+        self.assertEqual(self.index.suggest('BOB'), [('teacher', 'bs5678', 'Bob Smith')])
+
+    def test_limit(self):
+        self.assertEqual(len(self.index.suggest('data', limit=2)), 2)
+
+    def test_empty_query(self):
+        self.assertEqual(self.index.suggest(''), [])
+        self.assertEqual(self.index.suggest('zzz'), [])
+
+    def test_add_teacher_replaces_entries(self):
+        self.index.add_teacher('bs5678', 'Robert Smith')
+        self.assertEqual(self.index.suggest('bob'), [])
+        self.assertEqual(self.index.suggest('rob'), [('teacher', 'bs5678', 'Robert Smith')])
+        self.index.add_teacher('cw9012', 'Carol Data')
+        self.assertIn(('teacher', 'cw9012', 'Carol Data'), self.index.suggest('data'))
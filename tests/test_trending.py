@@ -0,0 +1,60 @@
+import math
+import unittest
+
+from app.trending import TopK, logaddexp
+
+
+class LogAddExpTestCase(unittest.TestCase):
+    def test_matches_direct_sum(self):
+        self.assertAlmostEqual(logaddexp(math.log(2), math.log(3)), math.log(5))
+        self.assertAlmostEqual(logaddexp(math.log(3), math.log(2)), math.log(5))
+
+    def test_large_values_do_not_overflow(self):
+        self.assertAlmostEqual(logaddexp(1000, 1000), 1000 + math.log(2))
+        self.assertEqual(logaddexp(1000, 0), 1000)
+
+
+class TopKTestCase(unittest.TestCase):
+    def test_top_is_highest_first(self):
+        top = TopK(3)
+        top.add('a', 1)
+        top.add('b', 3)
+        top.add('c', 2)
+        self.assertEqual(top.top(2), [('b', 3), ('c', 2)])
+
+    def test_add_to_existing_item_is_logaddexp(self):
+        top = TopK(3)
+        top.add('a', math.log(2))
+        top.add('a', math.log(3))
+        self.assertAlmostEqual(top.scores['a'], math.log(5))
+
+    def test_full_sketch_replaces_lowest_item(self):
+        top = TopK(2)
+        top.add('a', 1)
+        top.add('b', 2)
+        top.add('c', 0.5)
+        self.assertEqual(set(top.scores), {'b', 'c'})
+        # starts from the score of the item it replaced
+        self.assertAlmostEqual(top.scores['c'], logaddexp(1, 0.5))
+
+    def test_stale_heap_entries_are_skipped(self):
+        top = TopK(2)
+        top.add('a', 1)
+        top.add('b', 2)
+        # leaves a stale (1, 'a') behind in the heap
+        top.add('a', 5)
+        top.add('c', 0)
+        self.assertEqual(set(top.scores), {'a', 'c'})
+        self.assertAlmostEqual(top.scores['c'], logaddexp(2, 0))
+
+    def test_memory_stays_bounded(self):
+        top = TopK(5)
+        for i in range(1000):
+            top.add(i % 7, i / 100)
+        self.assertEqual(len(top.scores), 5)
+        self.assertLessEqual(len(top._heap), 4 * 5 + 1)
+
+    def test_initial_scores(self):
+        top = TopK(2, {'a': 1, 'b': 2}.items())
+        top.add('c', 0)
+        self.assertEqual(set(top.scores), {'b', 'c'})
@@ -0,0 +1,12 @@
+import os
+
+from app import create_app
+from app.models import warm_cache
+
+app = create_app(os.environ.get('FLASK_CONFIG') or 'production')
+
+# with gunicorn's preload_app this runs once in the master, so every worker forks with
+# warm caches and a loaded suggestion index instead of each filling them on its own
+if os.environ.get('WARM_CACHE', '1') == '1':
+    with app.app_context():
+        warm_cache()